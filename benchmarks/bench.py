@@ -0,0 +1,265 @@
+"""
+Microbenchmarks for the django-turnstile-site-protect hot paths.
+
+Usage:
+    python benchmarks/bench.py                       # run and print results
+    python benchmarks/bench.py --json results.json   # also write them as JSON
+    python benchmarks/bench.py --save-baseline       # store results as the baseline
+    python benchmarks/bench.py --compare             # flag regressions vs. the baseline
+
+Each benchmark reports the median cost of one call in nanoseconds. With
+--compare, the script exits with status 1 if any benchmark is slower than
+the baseline by more than --tolerance.
+"""
+
+import argparse
+import ipaddress
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    SECRET_KEY='benchmark-secret-key',
+    ROOT_URLCONF='django_turnstile_site_protect.urls',
+    INSTALLED_APPS=[
+        'django.contrib.sessions',
+        'django.contrib.contenttypes',
+        'django_turnstile_site_protect',
+    ],
+    ALLOWED_HOSTS=['*'],
+    TEMPLATES=[
+        {
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'APP_DIRS': True,
+        },
+    ],
+    TURNSTILE_SITE_KEY='benchmark-site-key',
+    TURNSTILE_SECRET_KEY='benchmark-secret-key',
+    # The verify benchmark submits one token over and over; measure the
+    # verification path rather than the replay cache's answer to it
+    TURNSTILE_REPLAY_CACHE=None,
+    TURNSTILE_PRERENDER_CHALLENGE=True,
+)
+os.environ['TURNSTILE_ENABLED'] = 'True'
+django.setup()
+
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware  # noqa: E402
+from django_turnstile_site_protect.views import (  # noqa: E402
+    challenge_view,
+    verify_view,
+)
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+
+IP_RANGE_SIZES = [10, 1000, 100000]
+PATH_PATTERN_SIZES = [1, 100, 1000]
+DOMAIN_SIZES = [1, 100, 1000]
+
+factory = RequestFactory()
+rng = random.Random(1234)
+
+
+def make_ip_ranges(count):
+    """
+    Generate `count` disjoint IPv4 /24 networks and IPv6 /48 networks.
+    """
+    ranges = []
+    for i in range(count):
+        if i % 4 == 3:
+            ranges.append(f'2001:db8:{i % 65536:x}::/48')
+        else:
+            ranges.append(f'{ipaddress.IPv4Address(rng.getrandbits(24) << 8)}/24')
+    return ranges
+
+
+def make_path_patterns(count):
+    """
+    Generate a mix of plain prefixes and regular expressions.
+    """
+    return [f'/assets-{i}/' if i % 2 else rf'^/section-{i}/\d+/' for i in range(count)]
+
+
+def make_domains(count):
+    return [
+        f'*.zone-{i}.example.net' if i % 2 else f'tenant-{i}.example.com'
+        for i in range(count)
+    ]
+
+
+def request(path='/protected/', session=None, **extra):
+    req = factory.get(path, **extra)
+    req.session = {} if session is None else session
+    return req
+
+
+def middleware(**overrides):
+    with override_settings(**overrides):
+        return TurnstileMiddleware(lambda req: HttpResponse())
+
+
+def benchmarks():
+    """
+    Yield (name, callable) pairs. Setup happens here, outside the timed calls.
+    """
+    gate = middleware()
+    session_hit = request(session={gate.session_key: True})
+    session_miss = request(REMOTE_ADDR='203.0.113.7')
+    yield 'process_request/session_hit', lambda: gate.process_request(session_hit)
+    yield 'process_request/session_miss', lambda: gate.process_request(session_miss)
+
+    for size in IP_RANGE_SIZES:
+        ranges = make_ip_ranges(size)
+        gate = middleware(TURNSTILE_EXCLUDED_IPS=ranges)
+        hit = request(REMOTE_ADDR=ranges[len(ranges) // 2].split('/')[0])
+        miss = request(REMOTE_ADDR='198.51.100.1')
+        yield f'is_ip_excluded/{size}/hit', lambda g=gate, r=hit: g.is_ip_excluded(r)
+        yield f'is_ip_excluded/{size}/miss', lambda g=gate, r=miss: g.is_ip_excluded(r)
+        yield (
+            f'process_request/ip_ranges/{size}/miss',
+            lambda g=gate, r=miss: g.process_request(r),
+        )
+
+    for size in PATH_PATTERN_SIZES:
+        patterns = make_path_patterns(size)
+        gate = middleware(TURNSTILE_EXCLUDED_PATHS=patterns)
+        last = [p for p in patterns if p.startswith('^')][-1]
+        last = last.lstrip('^').replace(r'\d+', '42')
+        yield (
+            f'is_path_excluded/{size}/hit_last_regex',
+            lambda g=gate, p=last: g.is_path_excluded(p),
+        )
+        yield (
+            f'is_path_excluded/{size}/miss',
+            lambda g=gate: g.is_path_excluded('/protected/page/'),
+        )
+
+    for size in DOMAIN_SIZES:
+        domains = make_domains(size)
+        gate = middleware(TURNSTILE_EXCLUDED_DOMAINS=domains)
+        hit = request(HTTP_HOST='www.zone-1.example.net' if size > 1 else domains[0])
+        miss = request(HTTP_HOST='www.example.org')
+        yield (
+            f'is_domain_excluded/{size}/hit',
+            lambda g=gate, r=hit: g.is_domain_excluded(r),
+        )
+        yield (
+            f'is_domain_excluded/{size}/miss',
+            lambda g=gate, r=miss: g.is_domain_excluded(r),
+        )
+
+    challenge = factory.get('/challenge/?next=/protected/')
+    yield 'challenge_view', lambda: challenge_view(challenge)
+
+    def verify():
+        req = factory.post(
+            '/verify/', {'cf-turnstile-response': 'token', 'next': '/protected/'}
+        )
+        req.session = {}
+        return verify_view(req)
+
+    yield 'verify_view/stubbed_upstream', verify
+
+
+def measure(func, repeat):
+    """
+    Return the median cost of one call in nanoseconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    timings = timer.repeat(repeat=repeat, number=number)
+    return statistics.median(timings) / number * 1e9
+
+
+def run(repeat, selected):
+    siteverify = MagicMock(status_code=200)
+    siteverify.json.return_value = {'success': True}
+
+    results = {}
+    with patch(
+        'django_turnstile_site_protect.client.requests.Session.post',
+        return_value=siteverify,
+    ):
+        for name, func in benchmarks():
+            if selected and not any(name.startswith(prefix) for prefix in selected):
+                continue
+            results[name] = measure(func, repeat)
+            print(f'{name:50} {results[name]:>12,.0f} ns')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print benchmarks that regressed against the baseline and return them.
+    """
+    regressions = []
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = value / previous
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            print(
+                f'REGRESSION {name}: {previous:,.0f} ns -> {value:,.0f} ns '
+                f'({ratio:.2f}x)'
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--json', help='write results to this file as JSON')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='allowed slowdown before flagging a regression (default: 0.25)',
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        'benchmarks', nargs='*', help='only run benchmarks with these prefixes'
+    )
+    args = parser.parse_args()
+    # Fail before spending minutes on benchmarks that can't be compared
+    if args.compare and not args.save_baseline and not Path(args.baseline).exists():
+        parser.error(f'no baseline at {args.baseline}; run --save-baseline first')
+
+    results = run(args.repeat, args.benchmarks)
+    report = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': platform.machine(),
+        'unit': 'ns/call',
+        'results': results,
+    }
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, sort_keys=True))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2, sort_keys=True))
+    if args.compare:
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
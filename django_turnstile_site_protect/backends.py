@@ -0,0 +1,152 @@
+import logging
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+from .client import apost_siteverify, post_siteverify
+from .utils import SharedInstances
+
+logger = logging.getLogger(__name__)
+
+# Namespaces the signatures of tokens issued for the HMAC backend
+HMAC_TOKEN_SALT = 'django_turnstile_site_protect.backends.hmac'
+
+
+class VerificationBackend:
+    """
+    Verifies Turnstile tokens.
+
+    verify() takes the token and the client's IP address and returns a
+    siteverify-style result: a dict with a boolean 'success' and, on
+    failure, a list of 'error-codes'. It raises if the token couldn't be
+    checked at all, which counts towards opening the circuit breaker. The
+    async variant defaults to running verify() in a thread.
+    """
+
+    def verify(self, token, remote_ip):
+        raise NotImplementedError
+
+    async def averify(self, token, remote_ip):
+        return await sync_to_async(self.verify)(token, remote_ip)
+
+
+class CloudflareBackend(VerificationBackend):
+    """
+    Post the token to Cloudflare's siteverify endpoint. This is the default.
+    """
+
+    def get_request(self, token, remote_ip):
+        """
+        Return the siteverify URL and form data for a token.
+        """
+        verification_url = getattr(
+            settings,
+            'TURNSTILE_VERIFICATION_URL',
+            'https://challenges.cloudflare.com/turnstile/v0/siteverify',
+        )
+        data = {
+            'secret': getattr(settings, 'TURNSTILE_SECRET_KEY', ''),
+            'response': token,
+            'remoteip': remote_ip,
+        }
+        return verification_url, data
+
+    def verify(self, token, remote_ip):
+        return post_siteverify(*self.get_request(token, remote_ip))
+
+    async def averify(self, token, remote_ip):
+        # Through the shared, connection-pooled async client
+        return await apost_siteverify(*self.get_request(token, remote_ip))
+
+
+class LocalBackend(VerificationBackend):
+    """
+    Base class for backends that answer without a network call, for tests
+    and load tests. Never use them in production.
+    """
+
+    def __init__(self):
+        logger.warning(
+            'Turnstile tokens are verified by %s, not by Cloudflare.',
+            type(self).__name__,
+        )
+
+    async def averify(self, token, remote_ip):
+        return self.verify(token, remote_ip)
+
+
+class AlwaysPassBackend(LocalBackend):
+    """
+    Accept every token.
+    """
+
+    def verify(self, token, remote_ip):
+        return {'success': True}
+
+
+class AlwaysFailBackend(LocalBackend):
+    """
+    Reject every token.
+    """
+
+    def verify(self, token, remote_ip):
+        return {'success': False, 'error-codes': ['invalid-input-response']}
+
+
+def _get_hmac_signer():
+    return signing.TimestampSigner(
+        key=getattr(settings, 'TURNSTILE_SECRET_KEY', ''), salt=HMAC_TOKEN_SALT
+    )
+
+
+def make_hmac_token():
+    """
+    Issue a token that HMACBackend accepts, signed with
+    TURNSTILE_SECRET_KEY. Load test clients post these in place of the
+    widget's tokens.
+    """
+    return _get_hmac_signer().sign(secrets.token_urlsafe(16))
+
+
+class HMACBackend(LocalBackend):
+    """
+    Accept tokens from make_hmac_token() that are at most
+    TURNSTILE_HMAC_TOKEN_MAX_AGE seconds old. A load test exercises the
+    whole verification path, including token parsing and rejections,
+    without a network call.
+    """
+
+    def verify(self, token, remote_ip):
+        max_age = getattr(settings, 'TURNSTILE_HMAC_TOKEN_MAX_AGE', 300)
+        try:
+            _get_hmac_signer().unsign(token, max_age=max_age)
+        except signing.SignatureExpired:
+            return {'success': False, 'error-codes': ['timeout-or-duplicate']}
+        except signing.BadSignature:
+            return {'success': False, 'error-codes': ['invalid-input-response']}
+        return {'success': True}
+
+
+VERIFICATION_BACKENDS = {
+    'cloudflare': CloudflareBackend,
+    'always_pass': AlwaysPassBackend,
+    'always_fail': AlwaysFailBackend,
+    'hmac': HMACBackend,
+}
+
+_backends = SharedInstances()
+
+
+def get_verification_backend():
+    """
+    Return the process-wide verification backend named by
+    TURNSTILE_VERIFICATION_BACKEND: one of VERIFICATION_BACKENDS or the
+    dotted path to a VerificationBackend subclass.
+    """
+    name = getattr(settings, 'TURNSTILE_VERIFICATION_BACKEND', 'cloudflare')
+    return _backends.get(
+        name, lambda: (VERIFICATION_BACKENDS.get(name) or import_string(name))()
+    )
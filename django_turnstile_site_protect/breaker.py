@@ -0,0 +1,95 @@
+import threading
+import time
+
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around calls to the verification endpoint.
+
+    The circuit opens after `threshold` consecutive failures. While open,
+    calls are short-circuited without touching the network. Once `cooldown`
+    seconds have passed, a single probe call is let through (half-open): if
+    it succeeds the circuit closes, otherwise it opens again for another
+    cooldown period. A probe that never reports back, because it was
+    cancelled for example, is given up on after another cooldown period and
+    a new probe is let through.
+    """
+
+    def __init__(self, threshold=5, cooldown=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Return True if a call may go through to the verification endpoint.
+        """
+        if self.state == CLOSED:
+            return True
+
+        with self._lock:
+            if self.state == CLOSED:
+                # Closed by another request meanwhile
+                return True
+            now = self.clock()
+            if now - self.opened_at >= self.cooldown:
+                # Let exactly one probe through, and time it from now
+                self.state = HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def retry_after(self):
+        """
+        Return the number of seconds until the next probe is allowed.
+        """
+        if self.state == CLOSED:
+            return 0
+        return max(0, self.cooldown - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker():
+    """
+    Return the process-wide circuit breaker for the verification endpoint.
+    """
+    global _breaker
+
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    threshold=getattr(
+                        settings, 'TURNSTILE_CIRCUIT_BREAKER_THRESHOLD', 5
+                    ),
+                    cooldown=getattr(
+                        settings, 'TURNSTILE_CIRCUIT_BREAKER_COOLDOWN', 30
+                    ),
+                )
+    return _breaker
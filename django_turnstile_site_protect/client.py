@@ -0,0 +1,158 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+# Status codes where the server refused the request without processing it
+RETRY_STATUS_CODES = frozenset({429, 503})
+
+# One keep-alive session per process, shared by all threads
+_session = None
+_session_lock = threading.Lock()
+
+# One pooled async client per event loop. Connections belong to the loop
+# that opened them, so a client can't be shared between loops.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_pool_size():
+    return getattr(settings, 'TURNSTILE_HTTP_POOL_SIZE', 100)
+
+
+def get_timeouts():
+    """
+    Return the (connect, read) timeouts in seconds for siteverify requests.
+    """
+    return (
+        getattr(settings, 'TURNSTILE_HTTP_CONNECT_TIMEOUT', 3.05),
+        getattr(settings, 'TURNSTILE_HTTP_READ_TIMEOUT', 5),
+    )
+
+
+def get_backoff_delays():
+    """
+    Return the jittered sleep before each retry. The retry budget and base
+    delay are configurable, and each delay is drawn uniformly from zero up to
+    an exponentially growing cap ("full jitter") so that workers retrying
+    after the same outage don't stampede the endpoint in lockstep.
+    """
+    retries = getattr(settings, 'TURNSTILE_HTTP_MAX_RETRIES', 2)
+    backoff = getattr(settings, 'TURNSTILE_HTTP_RETRY_BACKOFF', 0.1)
+    return [random.uniform(0, backoff * 2**attempt) for attempt in range(retries)]
+
+
+def get_session():
+    """
+    Return the process-wide keep-alive requests session, creating it on
+    first use. The underlying urllib3 connection pool is thread-safe.
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Retries are handled in post_siteverify
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=get_pool_size(), max_retries=0
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _never_sent(error):
+    """
+    Return True if a requests error happened while connecting, before any
+    part of the request could reach the server.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # Other connection errors wrap urllib3's, which say whether the
+    # connection was never made or dropped once the request was sent
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def post_siteverify(url, data):
+    """
+    Post a token to the siteverify endpoint over the pooled session and
+    return the decoded JSON result.
+
+    Only failures where the request was never processed are retried:
+    failures to connect and 429/503 responses. Timeouts and dropped
+    connections after the request was sent are not retried, since the
+    token may already have been spent.
+    """
+    session = get_session()
+    timeout = get_timeouts()
+
+    for delay in get_backoff_delays() + [None]:
+        try:
+            response = session.post(url, data=data, timeout=timeout)
+        except requests.ConnectionError as e:
+            if delay is None or not _never_sent(e):
+                raise
+        else:
+            if delay is None or response.status_code not in RETRY_STATUS_CODES:
+                return response.json()
+        time.sleep(delay)
+
+
+def get_async_client():
+    """
+    Return the shared, connection-pooled async HTTP client for the running
+    event loop, creating it on first use.
+    """
+    if httpx is None:
+        raise ImproperlyConfigured(
+            'The async verify view requires httpx. Install it with '
+            '"pip install django-turnstile-site-protect[async]".'
+        )
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = get_pool_size()
+        connect_timeout, read_timeout = get_timeouts()
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def apost_siteverify(url, data):
+    """
+    Post a token to the siteverify endpoint without blocking the event loop
+    and return the decoded JSON result. Retries follow post_siteverify.
+    """
+    client = get_async_client()
+
+    for delay in get_backoff_delays() + [None]:
+        try:
+            response = await client.post(url, data=data)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Unlike requests, httpx only raises these while connecting
+            if delay is None:
+                raise
+        else:
+            if delay is None or response.status_code not in RETRY_STATUS_CODES:
+                return response.json()
+        await asyncio.sleep(delay)
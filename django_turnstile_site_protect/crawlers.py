@@ -0,0 +1,41 @@
+# User-agent signatures of known AI crawlers and AI assistants' fetchers.
+# This module has no imports, so it can be used from a settings file:
+#
+#     from django_turnstile_site_protect.crawlers import AI_CRAWLERS
+#     TURNSTILE_BLOCKED_USER_AGENTS = AI_CRAWLERS
+AI_CRAWLERS = [
+    'AI2Bot',
+    'Amazonbot',
+    'anthropic-ai',
+    'Brightbot',
+    'Bytespider',
+    'CCBot',
+    'ChatGPT-User',
+    'Claude-SearchBot',
+    'Claude-User',
+    'Claude-Web',
+    'ClaudeBot',
+    'cohere-ai',
+    'cohere-training-data-crawler',
+    'Diffbot',
+    'DuckAssistBot',
+    'FacebookBot',
+    'Google-CloudVertexBot',
+    'GPTBot',
+    'iaskspider',
+    'ImagesiftBot',
+    'img2dataset',
+    'Kangaroo Bot',
+    'meta-externalagent',
+    'meta-externalfetcher',
+    'MistralAI-User',
+    'Novellum',
+    'OAI-SearchBot',
+    'Omgilibot',
+    'PanguBot',
+    'Perplexity-User',
+    'PerplexityBot',
+    'Timpibot',
+    'webzio-extended',
+    'YouBot',
+]
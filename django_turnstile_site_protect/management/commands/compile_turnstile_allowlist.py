@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...middleware.ip_ranges import read_allowlist, write_allowlist
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile text IP allowlists into the binary format that '
+        'TURNSTILE_EXCLUDED_IPS_FILES memory-maps.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources',
+            nargs='+',
+            help='Text files with one IP address, range or CIDR network per line.',
+        )
+        parser.add_argument(
+            '-o', '--output', required=True, help='Path of the compiled file.'
+        )
+
+    def handle(self, *args, **options):
+        intervals = []
+        for source in options['sources']:
+            try:
+                intervals.extend(read_allowlist(source))
+            except OSError as e:
+                raise CommandError(f'Could not read {source}: {e}')
+
+        # Write to a temporary file and rename it into place, so workers
+        # never map a half-written file
+        output = options['output']
+        temporary = f'{output}.tmp'
+        with open(temporary, 'wb') as f:
+            v4_count, v6_count = write_allowlist(intervals, f)
+        os.replace(temporary, output)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Compiled {len(intervals)} entries into {v4_count} IPv4 and '
+                f'{v6_count} IPv6 ranges in {output}.'
+            )
+        )
@@ -0,0 +1,245 @@
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DECISIONS = 'turnstile_decisions_total'
+CHALLENGE_RENDERS = 'turnstile_challenge_renders_total'
+VERIFICATIONS = 'turnstile_verifications_total'
+VERIFICATION_ERRORS = 'turnstile_verification_errors_total'
+SITEVERIFY_SECONDS = 'turnstile_siteverify_duration_seconds'
+BLOCKED = 'turnstile_blocked_total'
+RATE_LIMITED = 'turnstile_rate_limited_total'
+
+# Metric type and help text, used for the Prometheus exposition
+METRICS = {
+    DECISIONS: (
+        'counter',
+        'Requests seen by the middleware, by the rule that let them through '
+        'or "challenge" if they were redirected to the challenge page.',
+    ),
+    CHALLENGE_RENDERS: ('counter', 'Challenge page responses, by status code.'),
+    VERIFICATIONS: ('counter', 'Token verification attempts, by outcome.'),
+    VERIFICATION_ERRORS: (
+        'counter',
+        'Error codes returned by the verification endpoint.',
+    ),
+    SITEVERIFY_SECONDS: (
+        'histogram',
+        'Time spent waiting on the verification endpoint, including retries.',
+    ),
+    BLOCKED: ('counter', 'Requests rejected by user agent, by matched signature.'),
+    RATE_LIMITED: ('counter', 'Requests rejected by the rate limiter, by view.'),
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DEFAULT_SINK = 'django_turnstile_site_protect.metrics.InMemorySink'
+
+
+def _key(name, labels):
+    labels = tuple(labels.items())
+    if len(labels) > 1:
+        labels = tuple(sorted(labels))
+    return name, labels
+
+
+def _merge(counters, histograms, shard_counters, shard_histograms):
+    """
+    Add a shard's counters and histograms to the running totals.
+    """
+    for key, value in dict(shard_counters).items():
+        counters[key] = counters.get(key, 0) + value
+    for key, entry in dict(shard_histograms).items():
+        entry = list(entry)
+        total = histograms.setdefault(key, [0] * len(entry))
+        for i, value in enumerate(entry):
+            total[i] += value
+
+
+class NullSink:
+    """
+    A sink that discards everything. Other sinks (StatsD, OpenTelemetry and
+    so on) implement the same three methods.
+    """
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def collect(self):
+        """
+        Return ({(name, labels): total}, {(name, labels): (buckets, count, sum)})
+        for the Prometheus exposition. Sinks that export elsewhere return
+        nothing.
+        """
+        return {}, {}
+
+
+class InMemorySink(NullSink):
+    """
+    Keep counters and histograms in process memory.
+
+    Every thread records into its own shard, so recording never takes a
+    lock; the shards are only summed when the metrics are collected. The
+    shards of threads that have exited are folded into one, so servers that
+    replace their worker threads don't keep a shard for each one.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = ({}, {})
+        self._lock = threading.Lock()
+
+    def _retire_dead_shards(self):
+        # Called with the lock held. A thread that has exited can't record
+        # into its shard anymore, so the shard can be merged safely.
+        live = []
+        for thread, counters, histograms in self._shards:
+            if thread.is_alive():
+                live.append((thread, counters, histograms))
+            else:
+                _merge(*self._retired, counters, histograms)
+        self._shards = live
+
+    def _add_shard(self):
+        self._local.counters = counters = {}
+        self._local.histograms = histograms = {}
+        with self._lock:
+            self._retire_dead_shards()
+            self._shards.append((threading.current_thread(), counters, histograms))
+
+    def increment(self, name, value=1, **labels):
+        try:
+            counters = self._local.counters
+        except AttributeError:
+            self._add_shard()
+            counters = self._local.counters
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        try:
+            histograms = self._local.histograms
+        except AttributeError:
+            self._add_shard()
+            histograms = self._local.histograms
+        key = _key(name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            # One count per bucket, one for +Inf, then the sum
+            entry = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def collect(self):
+        counters = {}
+        histograms = {}
+        # Summing under the lock keeps a shard from being counted twice if
+        # its thread exits and the shard is retired meanwhile
+        with self._lock:
+            self._retire_dead_shards()
+            _merge(counters, histograms, *self._retired)
+            for _, shard_counters, shard_histograms in self._shards:
+                _merge(counters, histograms, shard_counters, shard_histograms)
+
+        cumulative = {}
+        for key, entry in histograms.items():
+            counts = []
+            running = 0
+            for count in entry[:-1]:
+                running += count
+                counts.append(running)
+            cumulative[key] = (counts, running, entry[-1])
+        return counters, cumulative
+
+    def value(self, name, **labels):
+        """
+        Return the current value of a counter.
+        """
+        return self.collect()[0].get(_key(name, labels), 0)
+
+    def reset(self):
+        with self._lock:
+            for _, counters, histograms in self._shards:
+                counters.clear()
+                histograms.clear()
+            for totals in self._retired:
+                totals.clear()
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink():
+    """
+    Return the process-wide metrics sink configured by TURNSTILE_METRICS_SINK.
+    """
+    global _sink
+
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                path = getattr(settings, 'TURNSTILE_METRICS_SINK', DEFAULT_SINK)
+                _sink = import_string(path)() if path else NullSink()
+    return _sink
+
+
+def increment(name, value=1, **labels):
+    get_sink().increment(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    get_sink().observe(name, value, **labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render_prometheus(sink=None):
+    """
+    Render the collected metrics in the Prometheus text exposition format.
+    """
+    sink = sink or get_sink()
+    counters, histograms = sink.collect()
+    buckets = getattr(sink, 'buckets', DEFAULT_BUCKETS)
+
+    samples = {}
+    for (name, labels), value in sorted(counters.items()):
+        samples.setdefault(name, []).append(
+            f'{name}{_format_labels(labels)} {_format_value(value)}'
+        )
+    for (name, labels), (counts, count, total) in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+            bucket_labels = labels + (('le', bound),)
+            lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {bucket_count}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+
+    output = []
+    for name, lines in samples.items():
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        output.append(f'# HELP {name} {help_text}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(lines)
+    return '\n'.join(output) + '\n' if output else ''
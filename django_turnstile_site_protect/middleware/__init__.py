@@ -1,26 +1,78 @@
-import ipaddress
+import json
 import os
-import re
+import threading
+import time
+from http import HTTPStatus
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
 
+from .. import metrics
+from ..pass_store import get_pass_store
+from ..utils import accepts_json, add_server_timing, get_client_ip, is_navigation
+from . import rules
+from .adaptive import ADAPTIVE, TrafficMonitor
+from .domains import DomainIndex
+from .geoip import GeoIPResolver
+from .ip_ranges import IPRangeIndex, parse_ip_ranges
+from .paths import PathMatcher
+from .reload import RulesFileWatcher, read_rules_file
+from .user_agents import SignatureMatcher
+
+# In-memory rules first, the session or pass cookie lookup last
+DEFAULT_CHECK_ORDER = (
+    rules.PATH,
+    rules.METHOD,
+    rules.BLOCK,
+    rules.GEO_CHALLENGE,
+    rules.DOMAIN,
+    rules.IP,
+    rules.GEO,
+    rules.HEADER,
+    rules.USER_AGENT,
+    rules.SESSION,
+)
+
+# Carries the challenge page URL on lightweight challenge responses
+CHALLENGE_URL_HEADER = 'X-Turnstile-Challenge-URL'
+
+# Request headers that decide between a redirect and a lightweight response
+LIGHTWEIGHT_VARY_HEADERS = (
+    'Accept',
+    'Sec-Fetch-Mode',
+    'Sec-Fetch-Dest',
+    'X-Requested-With',
+)
+
 
 class TurnstileMiddleware(MiddlewareMixin):
     """
     Middleware that checks if a user has passed a Cloudflare Turnstile challenge.
     If not, redirects to the challenge page unless the path is excluded.
+
+    The middleware is both sync and async capable. Under ASGI the gate runs
+    natively on the event loop.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         super().__init__(get_response)
         self.get_response = get_response
         self.session_key = getattr(
             settings, 'TURNSTILE_SESSION_KEY', 'turnstile_passed'
         )
-        self.excluded_paths = getattr(settings, 'TURNSTILE_EXCLUDED_PATHS', [])
+
+        # Where verified users are remembered: the session by default, or a
+        # signed cookie, a cache or process memory
+        self.pass_store = get_pass_store()
 
         # Check if middleware is enabled (defaults to True if not specified)
         self.enabled = os.environ.get('TURNSTILE_ENABLED', 'True').lower() not in (
@@ -30,118 +82,293 @@ class TurnstileMiddleware(MiddlewareMixin):
             'off',
         )
 
-        # Compile excluded paths into regex patterns for faster matching
-        self.excluded_patterns = [re.compile(path) for path in self.excluded_paths]
-
         # Always exclude the challenge and verification paths
         self.challenge_path = reverse('turnstile_challenge')
         self.verify_path = reverse('turnstile_verify')
 
-        # Get excluded IP ranges from settings
-        self.excluded_ips = getattr(settings, 'TURNSTILE_EXCLUDED_IPS', [])
-        self.ip_ranges = self._parse_ip_ranges(self.excluded_ips)
+        # Compile every bypass rule into one decision table, ordered so cheap
+        # in-memory rules can bypass a request before the session (or pass
+        # cookie) is looked up
+        self.check_order = tuple(
+            getattr(settings, 'TURNSTILE_CHECK_ORDER', DEFAULT_CHECK_ORDER)
+        )
 
-        # Get excluded domains from settings
-        self.excluded_domains = getattr(settings, 'TURNSTILE_EXCLUDED_DOMAINS', [])
+        # Clients with a blocked user agent get a minimal response whose body
+        # is built once, here
+        self.blocked_status = getattr(settings, 'TURNSTILE_BLOCKED_STATUS', 403)
+        if self.blocked_status not in (403, 429):
+            raise ImproperlyConfigured('TURNSTILE_BLOCKED_STATUS must be 403 or 429.')
+        self.blocked_content = HTTPStatus(self.blocked_status).phrase.encode()
 
-    def is_path_excluded(self, path):
+        # Optionally answer fetch and XHR calls, images and other requests
+        # that can't show the challenge page with a small response pointing
+        # to it, instead of a redirect
+        self.lightweight_challenges = getattr(
+            settings, 'TURNSTILE_LIGHTWEIGHT_CHALLENGES', False
+        )
+        self.lightweight_status = getattr(
+            settings, 'TURNSTILE_LIGHTWEIGHT_CHALLENGE_STATUS', 403
+        )
+        if self.lightweight_status not in (401, 403):
+            raise ImproperlyConfigured(
+                'TURNSTILE_LIGHTWEIGHT_CHALLENGE_STATUS must be 401 or 403.'
+            )
+        self.lightweight_json = json.dumps(
+            {
+                'error': 'turnstile_challenge_required',
+                'challenge_url': self.challenge_path,
+            }
+        ).encode()
+
+        # Country and ASN rules resolve client IPs against local MaxMind databases
+        country_database = getattr(settings, 'TURNSTILE_GEOIP_COUNTRY_DATABASE', None)
+        asn_database = getattr(settings, 'TURNSTILE_GEOIP_ASN_DATABASE', None)
+        self.geoip = None
+        if country_database or asn_database:
+            self.geoip = GeoIPResolver(
+                country_database,
+                asn_database,
+                cache_size=getattr(settings, 'TURNSTILE_GEOIP_CACHE_SIZE', 4096),
+            )
+
+        # Exclusion rules come from settings, optionally overridden by a rules
+        # file that is watched and reloaded without a restart
+        self.rules_file = getattr(settings, 'TURNSTILE_RULES_FILE', None)
+        overrides = {}
+        if self.rules_file:
+            try:
+                overrides = read_rules_file(self.rules_file)
+            except (OSError, ValueError) as e:
+                raise ImproperlyConfigured(
+                    f'Could not load TURNSTILE_RULES_FILE: {e}'
+                ) from e
+        self.load_rules(overrides)
+        self.pre_session_reasons = frozenset(
+            self.check_order[: self.check_order.index(rules.SESSION)]
+        )
+
+        self.rules_watcher = None
+        reload_interval = getattr(settings, 'TURNSTILE_RULES_RELOAD_INTERVAL', 5)
+        if self.rules_file and reload_interval:
+            # Started by the first request in each process
+            self.rules_watcher = RulesFileWatcher(
+                self.rules_file, self.load_rules, reload_interval
+            )
+
+        # In adaptive mode, unverified clients are only challenged while
+        # traffic is spiking
+        self.traffic_monitor = None
+        if getattr(settings, 'TURNSTILE_ADAPTIVE', False):
+            cache_alias = getattr(settings, 'TURNSTILE_ADAPTIVE_CACHE', None)
+            self.traffic_monitor = TrafficMonitor(
+                threshold=getattr(settings, 'TURNSTILE_ADAPTIVE_THRESHOLD', 50),
+                unverified_ratio=getattr(
+                    settings, 'TURNSTILE_ADAPTIVE_UNVERIFIED_RATIO', 0.5
+                ),
+                window=getattr(settings, 'TURNSTILE_ADAPTIVE_WINDOW', 10),
+                release=getattr(settings, 'TURNSTILE_ADAPTIVE_RELEASE', 0.5),
+                hold=getattr(settings, 'TURNSTILE_ADAPTIVE_HOLD', 300),
+                cache=caches[cache_alias] if cache_alias else None,
+            )
+
+        # Decisions are counted by the reason that made them
+        self.metrics = metrics.get_sink()
+
+        # Optionally report the cost of each decision in a Server-Timing header
+        self.server_timing = getattr(settings, 'TURNSTILE_SERVER_TIMING', False)
+
+        # Number of requests decided without a session or pass cookie lookup
+        self.lookups_avoided = 0
+        self._lookups_avoided_lock = threading.Lock()
+
+    def load_rules(self, overrides=None):
         """
-        Check if the current path should be excluded from Turnstile verification.
+        Build the exclusion indexes and the rule engine from settings, with
+        `overrides` (a mapping of setting names to values) taking precedence,
+        and swap them in.
+
+        Everything is built before anything is replaced, so a failed build
+        leaves the current rules untouched. The rule engine is replaced last,
+        with a single assignment: a request reads it once, so it sees either
+        the old rules or the new ones and never waits on a lock.
         """
-        if path.startswith(self.challenge_path) or path.startswith(self.verify_path):
-            return True
+        overrides = overrides or {}
+
+        def setting(name, default):
+            return overrides.get(name, getattr(settings, name, default))
+
+        # Always exclude the challenge and verification paths
+        excluded_paths = setting('TURNSTILE_EXCLUDED_PATHS', [])
+        path_matcher = PathMatcher(
+            excluded_paths, prefixes=[self.challenge_path, self.verify_path]
+        )
+
+        excluded_ips = setting('TURNSTILE_EXCLUDED_IPS', [])
+        excluded_ips_files = setting('TURNSTILE_EXCLUDED_IPS_FILES', [])
+        try:
+            ip_ranges = IPRangeIndex(
+                self._parse_ip_ranges(excluded_ips), files=excluded_ips_files
+            )
+        except (OSError, ValueError) as e:
+            raise ImproperlyConfigured(
+                f'Could not load TURNSTILE_EXCLUDED_IPS_FILES: {e}'
+            ) from e
+
+        excluded_domains = setting('TURNSTILE_EXCLUDED_DOMAINS', [])
+        domain_index = DomainIndex(excluded_domains)
+
+        # Rule kinds without a dedicated index
+        excluded_methods = setting('TURNSTILE_EXCLUDED_METHODS', [])
+        excluded_headers = setting('TURNSTILE_EXCLUDED_HEADERS', {})
+        excluded_user_agents = setting('TURNSTILE_EXCLUDED_USER_AGENTS', [])
+        blocked_user_agents = SignatureMatcher(
+            setting('TURNSTILE_BLOCKED_USER_AGENTS', [])
+        )
+
+        # Country and ASN rules, as (countries, ASNs) pairs
+        geo = (
+            setting('TURNSTILE_EXCLUDED_COUNTRIES', []),
+            setting('TURNSTILE_EXCLUDED_ASNS', []),
+        )
+        geo_challenge = (
+            setting('TURNSTILE_CHALLENGED_COUNTRIES', []),
+            setting('TURNSTILE_CHALLENGED_ASNS', []),
+        )
+
+        rule_engine = self._compile_rules(
+            self.check_order,
+            path_matcher,
+            ip_ranges=ip_ranges,
+            domain_index=domain_index,
+            methods=excluded_methods,
+            headers=excluded_headers,
+            user_agents=excluded_user_agents,
+            blocked_user_agents=blocked_user_agents,
+            geo=geo,
+            geo_challenge=geo_challenge,
+        )
+
+        self.excluded_paths = excluded_paths
+        self.path_matcher = path_matcher
+        self.excluded_ips = excluded_ips
+        self.excluded_ips_files = excluded_ips_files
+        self.ip_ranges = ip_ranges
+        self.excluded_domains = excluded_domains
+        self.domain_index = domain_index
+        self.excluded_methods = excluded_methods
+        self.excluded_headers = excluded_headers
+        self.excluded_user_agents = excluded_user_agents
+        self.blocked_user_agents = blocked_user_agents
+        self.rule_engine = rule_engine
+
+    def _compile_rules(
+        self,
+        check_order,
+        path_matcher,
+        ip_ranges=(),
+        domain_index=(),
+        methods=(),
+        headers=None,
+        user_agents=(),
+        blocked_user_agents=(),
+        geo=((), ()),
+        geo_challenge=((), ()),
+    ):
+        """
+        Build the rule engine from the configured check order. Rule kinds
+        with nothing configured are left out of the table entirely.
+        """
+        unknown = set(check_order) - set(rules.KINDS)
+        if unknown or rules.SESSION not in check_order:
+            raise ImproperlyConfigured(
+                'TURNSTILE_CHECK_ORDER must contain "session" and may only contain '
+                + ', '.join(f'"{kind}"' for kind in rules.KINDS)
+                + '.'
+            )
+
+        table = {
+            rules.PATH: rules.path_rule(path_matcher),
+            rules.SESSION: rules.Rule(
+                rules.SESSION,
+                lambda info: self.has_passed(info.request),
+                lambda info: self.ahas_passed(info.request),
+            ),
+        }
+        if methods:
+            table[rules.METHOD] = rules.method_rule(methods)
+        if len(blocked_user_agents):
+            table[rules.BLOCK] = rules.block_rule(blocked_user_agents)
+        if len(domain_index):
+            table[rules.DOMAIN] = rules.domain_rule(domain_index)
+        if len(ip_ranges):
+            table[rules.IP] = rules.ip_rule(ip_ranges)
+        if headers:
+            table[rules.HEADER] = rules.header_rule(headers)
+        if user_agents:
+            table[rules.USER_AGENT] = rules.user_agent_rule(user_agents)
+        if any(geo) or any(geo_challenge):
+            if self.geoip is None:
+                raise ImproperlyConfigured(
+                    'Country and ASN rules require TURNSTILE_GEOIP_COUNTRY_DATABASE '
+                    'or TURNSTILE_GEOIP_ASN_DATABASE.'
+                )
+            if any(geo):
+                table[rules.GEO] = rules.geo_rule(self.geoip, *geo)
+            if any(geo_challenge):
+                table[rules.GEO_CHALLENGE] = rules.geo_challenge_rule(
+                    self.geoip, *geo_challenge
+                )
 
-        for pattern in self.excluded_patterns:
-            if pattern.match(path):
-                return True
+        return rules.RuleEngine(table[kind] for kind in check_order if kind in table)
 
-        return False
+    def is_path_excluded(self, path):
+        """
+        Check if the current path should be excluded from Turnstile verification.
+        """
+        return self.path_matcher.match(path) is not None
 
     def _parse_ip_ranges(self, ip_list):
         """
-        Parse a list of IP addresses and ranges into network objects for efficient matching.
-        Format for ranges: '192.168.1.0-192.168.1.255'
-        Format for single IPs: '192.168.1.1'
-        """
-        networks = []
-
-        for item in ip_list:
-            if '-' in item:  # It's a range
-                start_ip, end_ip = item.split('-')
-                try:
-                    # Convert to integer representations for comparison
-                    start_int = int(ipaddress.IPv4Address(start_ip.strip()))
-                    end_int = int(ipaddress.IPv4Address(end_ip.strip()))
-
-                    # Store the range as a tuple of integers for efficient comparison
-                    networks.append(('range', (start_int, end_int)))
-                except ValueError:
-                    # If invalid IP, just skip it
-                    continue
-            else:  # It's a single IP
-                try:
-                    networks.append(
-                        ('single', int(ipaddress.IPv4Address(item.strip())))
-                    )
-                except ValueError:
-                    # If invalid IP, just skip it
-                    continue
-
-        return networks
+        Parse a list of IP addresses, ranges and CIDR networks into
+        (version, start, end) integer intervals. Both IPv4 and IPv6 are supported.
+        """
+        return parse_ip_ranges(ip_list)
 
     def is_domain_excluded(self, request):
         """
         Check if the current domain should be excluded from Turnstile verification.
         """
-        host = request.get_host()
-
-        # Remove port if present
-        if ':' in host:
-            host = host.split(':', 1)[0]
+        return self.domain_index.match(rules.RequestInfo(request).host) is not None
 
-        for domain in self.excluded_domains:
-            # Direct match
-            if host == domain:
-                return True
+    def is_ip_excluded(self, request):
+        """
+        Check if the requester's IP address should be excluded from Turnstile verification.
+        """
+        client_ip = get_client_ip(request)
 
-            # Wildcard match (*.example.com matches subdomain.example.com)
-            if domain.startswith('*.') and host.endswith(domain[1:]):
-                # Make sure it's a proper subdomain match
-                if '.' + host == domain[1:] or host.endswith('.' + domain[2:]):
-                    return True
+        # If the IP is invalid, don't exclude
+        if client_ip is None:
+            return False
 
-        return False
+        # Bisect the sorted, merged intervals
+        return client_ip in self.ip_ranges
 
-    def is_ip_excluded(self, request):
+    def has_passed(self, request):
         """
-        Check if the requester's IP address should be excluded from Turnstile verification.
+        Check if the user has already passed the Turnstile challenge.
         """
-        # Get client IP from request
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            # Use the first IP in X-Forwarded-For header
-            ip = x_forwarded_for.split(',')[0].strip()
-        else:
-            ip = request.META.get('REMOTE_ADDR')
+        return self.pass_store.has_passed(request)
 
-        try:
-            # Convert client IP to integer for comparison
-            client_ip_int = int(ipaddress.IPv4Address(ip))
-
-            # Check against our networks list
-            for net_type, net_value in self.ip_ranges:
-                if net_type == 'single' and client_ip_int == net_value:
-                    return True
-                elif (
-                    net_type == 'range'
-                    and net_value[0] <= client_ip_int <= net_value[1]
-                ):
-                    return True
+    async def ahas_passed(self, request):
+        """
+        Async version of has_passed that checks the pass store without
+        blocking the event loop.
+        """
+        return await self.pass_store.ahas_passed(request)
 
-            return False
-        except ValueError:
-            # If the IP is invalid, don't exclude
-            return False
+    def _count_lookup_avoided(self):
+        with self._lookups_avoided_lock:
+            self.lookups_avoided += 1
 
     def process_request(self, request):
         """
@@ -151,24 +378,123 @@ class TurnstileMiddleware(MiddlewareMixin):
         if not self.enabled:
             return None
 
-        # Skip verification for excluded paths
-        if self.is_path_excluded(request.path):
-            return None
+        if self.rules_watcher is not None:
+            self.rules_watcher.ensure_started()
 
-        # Check if user has already passed Turnstile challenge (fast check first)
-        if request.session.get(self.session_key):
+        # Skip verification if any rule applies, including a passed challenge
+        started = time.perf_counter()
+        reason, forced = self.rule_engine.classify(request)
+        if self.traffic_monitor is not None:
+            under_attack = self.traffic_monitor.record(unverified=reason is None)
+            # Challenge rules apply whether or not the site is under attack
+            if reason is None and not forced and not under_attack:
+                reason = ADAPTIVE
+        if self.server_timing:
+            request._turnstile_timing = (
+                reason or 'challenge',
+                time.perf_counter() - started,
+            )
+        self.metrics.increment(metrics.DECISIONS, reason=reason or 'challenge')
+        if reason is not None:
+            if reason in self.pre_session_reasons:
+                self._count_lookup_avoided()
+            if reason == rules.BLOCK:
+                return self._block(request)
             return None
 
-        # For users without valid sessions, apply exclusion rules
-        # Skip verification for excluded IPs
-        if self.is_ip_excluded(request):
+        return self._challenge(request)
+
+    async def aprocess_request(self, request):
+        """
+        Async version of process_request used when running under ASGI.
+        """
+        # Skip middleware completely if disabled via environment variable
+        if not self.enabled:
             return None
 
-        # Skip verification for excluded domains
-        if self.is_domain_excluded(request):
+        if self.rules_watcher is not None:
+            self.rules_watcher.ensure_started()
+
+        # Skip verification if any rule applies, including a passed challenge
+        started = time.perf_counter()
+        reason, forced = await self.rule_engine.aclassify(request)
+        if self.traffic_monitor is not None:
+            under_attack = await self.traffic_monitor.arecord(unverified=reason is None)
+            if reason is None and not forced and not under_attack:
+                reason = ADAPTIVE
+        if self.server_timing:
+            request._turnstile_timing = (
+                reason or 'challenge',
+                time.perf_counter() - started,
+            )
+        self.metrics.increment(metrics.DECISIONS, reason=reason or 'challenge')
+        if reason is not None:
+            if reason in self.pre_session_reasons:
+                self._count_lookup_avoided()
+            if reason == rules.BLOCK:
+                return self._block(request)
             return None
 
-        # User hasn't passed Turnstile and no exclusions apply - redirect to challenge
+        return self._challenge(request)
+
+    def _block(self, request):
+        """
+        Reject a client with a blocked user agent, without rendering a
+        template or touching the session.
+        """
+        signature = self.blocked_user_agents.match(
+            request.META.get('HTTP_USER_AGENT', '')
+        )
+        # The signature is None if the rules were reloaded since the decision
+        self.metrics.increment(metrics.BLOCKED, signature=signature or 'unknown')
+        return HttpResponse(
+            self.blocked_content,
+            content_type='text/plain; charset=utf-8',
+            status=self.blocked_status,
+        )
+
+    def _challenge(self, request):
+        """
+        Redirect a user who hasn't passed Turnstile to the challenge page.
+        """
         next_url = request.path
         challenge_url = f"{self.challenge_path}?next={next_url}"
-        return redirect(challenge_url)
+        if not self.lightweight_challenges:
+            return redirect(challenge_url)
+
+        if is_navigation(request):
+            response = redirect(challenge_url)
+        elif accepts_json(request):
+            response = HttpResponse(
+                self.lightweight_json,
+                content_type='application/json',
+                status=self.lightweight_status,
+            )
+        else:
+            response = HttpResponse(status=self.lightweight_status)
+        response[CHALLENGE_URL_HEADER] = challenge_url
+        if self.lightweight_status == 401:
+            # Required on 401 responses
+            response['WWW-Authenticate'] = 'Turnstile'
+        # Shared caches must not serve one kind of response for the other
+        patch_vary_headers(response, LIGHTWEIGHT_VARY_HEADERS)
+        return response
+
+    def process_response(self, request, response):
+        """
+        Add the gate's decision and its cost to the Server-Timing header.
+        """
+        timing = getattr(request, '_turnstile_timing', None)
+        if timing is not None:
+            reason, duration = timing
+            add_server_timing(response, 'turnstile', duration, reason)
+        return response
+
+    async def __acall__(self, request):
+        """
+        Run the gate natively on the event loop instead of handing
+        process_request to a worker thread through sync_to_async.
+        """
+        response = await self.aprocess_request(request)
+        response = response or await self.get_response(request)
+        return self.process_response(request, response)
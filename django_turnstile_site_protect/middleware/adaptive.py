@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from ..utils import acache_call
+
+logger = logging.getLogger(__name__)
+
+# Reason code for requests let through because the site is not under attack
+ADAPTIVE = 'adaptive'
+
+
+class TrafficMonitor:
+    """
+    Decide whether the site is under attack from its recent traffic.
+
+    Requests are counted in one-second buckets, split into those that would
+    be challenged (unverified) and the rest. When a second is over, the
+    first request of the next second evaluates the last `window` seconds:
+    the site goes under attack once the request rate reaches `threshold`
+    requests per second and the unverified share reaches `unverified_ratio`.
+
+    It only relaxes again after the rate or the unverified share has stayed
+    below `release` times its threshold for `hold` seconds, so a fluctuating
+    attack doesn't switch challenges on and off.
+
+    With a `cache`, each worker adds its finished buckets to shared counters
+    and evaluates the totals of all workers; otherwise each worker only sees
+    its own traffic. Either way, counting a request takes a lock and two
+    additions, and the cache is used at most once a second per worker.
+    """
+
+    prefix = 'turnstile:adaptive:'
+
+    def __init__(
+        self,
+        threshold,
+        unverified_ratio=0.5,
+        window=10,
+        release=0.5,
+        hold=300,
+        cache=None,
+        clock=time.time,
+    ):
+        self.threshold = threshold
+        self.unverified_ratio = unverified_ratio
+        self.window = window
+        self.release = release
+        self.hold = hold
+        self.cache = cache
+        self.clock = clock
+        self.under_attack = False
+        self.calm_since = None
+
+        self._second = int(clock())
+        self._total = 0
+        self._unverified = 0
+        self._history = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _count(self, unverified):
+        """
+        Count a request. Returns the bucket that just finished, as a
+        (second, total, unverified) tuple, if this request started a new
+        second, or None.
+        """
+        second = int(self.clock())
+        finished = None
+        with self._lock:
+            if second != self._second:
+                finished = (self._second, self._total, self._unverified)
+                self._history.append(finished)
+                self._second = second
+                self._total = self._unverified = 0
+            self._total += 1
+            if unverified:
+                self._unverified += 1
+        return finished
+
+    def _window_seconds(self):
+        # The last `window` complete seconds
+        return range(self._second - self.window, self._second)
+
+    def _local_totals(self):
+        seconds = self._window_seconds()
+        total = unverified = 0
+        for second, bucket_total, bucket_unverified in tuple(self._history):
+            if second in seconds:
+                total += bucket_total
+                unverified += bucket_unverified
+        return total, unverified
+
+    def _cache_keys(self, seconds):
+        total_keys = [f'{self.prefix}{second}:total' for second in seconds]
+        unverified_keys = [f'{self.prefix}{second}:unverified' for second in seconds]
+        return total_keys, unverified_keys
+
+    def _add_to_cache(self, key, value):
+        if value:
+            # Keep the bucket around for as long as it is in the window
+            self.cache.add(key, 0, self.window + 1)
+            try:
+                self.cache.incr(key, value)
+            except ValueError:
+                # Evicted between add() and incr()
+                self.cache.set(key, value, self.window + 1)
+
+    async def _aadd_to_cache(self, key, value):
+        if value:
+            await acache_call(self.cache, 'add', key, 0, self.window + 1)
+            try:
+                await acache_call(self.cache, 'incr', key, value)
+            except ValueError:
+                await acache_call(self.cache, 'set', key, value, self.window + 1)
+
+    @staticmethod
+    def _sum(values, keys):
+        return sum(values.get(key, 0) for key in keys)
+
+    def _cache_failed(self):
+        logger.warning(
+            'Adaptive mode cache unavailable, judging by this worker\'s traffic.',
+            exc_info=True,
+        )
+        return self._local_totals()
+
+    def _totals(self, finished):
+        """
+        Return (total, unverified) over the last `window` complete seconds,
+        after adding the finished bucket to the shared counters.
+
+        If the cache fails, the worker falls back to its own traffic rather
+        than treating the site as calm or under attack.
+        """
+        if self.cache is None:
+            return self._local_totals()
+        (total_key,), (unverified_key,) = self._cache_keys([finished[0]])
+        total_keys, unverified_keys = self._cache_keys(self._window_seconds())
+        try:
+            self._add_to_cache(total_key, finished[1])
+            self._add_to_cache(unverified_key, finished[2])
+            values = self.cache.get_many(total_keys + unverified_keys)
+        except Exception:
+            return self._cache_failed()
+        return self._sum(values, total_keys), self._sum(values, unverified_keys)
+
+    async def _atotals(self, finished):
+        if self.cache is None:
+            return self._local_totals()
+        (total_key,), (unverified_key,) = self._cache_keys([finished[0]])
+        total_keys, unverified_keys = self._cache_keys(self._window_seconds())
+        try:
+            await self._aadd_to_cache(total_key, finished[1])
+            await self._aadd_to_cache(unverified_key, finished[2])
+            values = await acache_call(
+                self.cache, 'get_many', total_keys + unverified_keys
+            )
+        except Exception:
+            return self._cache_failed()
+        return self._sum(values, total_keys), self._sum(values, unverified_keys)
+
+    def _evaluate(self, total, unverified):
+        rate = total / self.window
+        ratio = unverified / total if total else 0
+        now = self.clock()
+
+        if rate >= self.threshold and ratio >= self.unverified_ratio:
+            if not self.under_attack:
+                logger.warning(
+                    'Under attack: %.1f requests/s, %.0f%% unverified. '
+                    'Challenging every unverified client.',
+                    rate,
+                    ratio * 100,
+                )
+            self.under_attack = True
+
+        calm = (
+            rate < self.threshold * self.release
+            or ratio < self.unverified_ratio * self.release
+        )
+        if not calm:
+            self.calm_since = None
+        elif self.calm_since is None:
+            self.calm_since = now
+        elif self.under_attack and now - self.calm_since >= self.hold:
+            logger.warning('No longer under attack: %.1f requests/s.', rate)
+            self.under_attack = False
+
+    def record(self, unverified):
+        """
+        Count a request, and return True if the site is under attack.
+        """
+        finished = self._count(unverified)
+        if finished is not None:
+            self._evaluate(*self._totals(finished))
+        return self.under_attack
+
+    async def arecord(self, unverified):
+        """
+        Async version of record, for ASGI deployments.
+        """
+        finished = self._count(unverified)
+        if finished is not None:
+            self._evaluate(*await self._atotals(finished))
+        return self.under_attack
@@ -0,0 +1,64 @@
+def normalize_host(host):
+    """
+    Lower-case a hostname and convert internationalized labels to their
+    ASCII (punycode) form so that lookups compare like with like.
+    """
+    host = host.strip().rstrip('.').lower()
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+class DomainIndex:
+    """
+    Index of excluded domains.
+
+    Exact hosts are kept in a frozenset. Wildcard entries ('*.example.com')
+    are stored in a trie keyed by reversed labels, so a lookup walks at most
+    one node per label of the requested host, however many rules there are.
+    """
+
+    def __init__(self, domains):
+        exact = set()
+        self._wildcards = {}
+
+        for domain in domains:
+            if domain.startswith('*.'):
+                node = self._wildcards
+                for label in reversed(normalize_host(domain[2:]).split('.')):
+                    node = node.setdefault(label, {})
+                # The None key marks the end of a wildcard and holds the rule
+                node.setdefault(None, domain)
+            else:
+                exact.add(normalize_host(domain))
+
+        self._exact = frozenset(exact)
+
+    def __len__(self):
+        return len(self._exact) + self._count(self._wildcards)
+
+    def _count(self, node):
+        return sum(
+            1 if label is None else self._count(child) for label, child in node.items()
+        )
+
+    def match(self, host):
+        """
+        Return the rule that matches an already normalized host, or None.
+        A wildcard matches subdomains of the domain, but not the domain itself.
+        """
+        if host in self._exact:
+            return host
+
+        node = self._wildcards
+        labels = host.split('.')
+        for label in labels[:0:-1]:
+            node = node.get(label)
+            if node is None:
+                return None
+            # At least one label (labels[0]) is left to act as the subdomain
+            if None in node:
+                return node[None]
+
+        return None
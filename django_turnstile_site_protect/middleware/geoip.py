@@ -0,0 +1,55 @@
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import maxminddb
+except ImportError:  # pragma: no cover - optional dependency
+    maxminddb = None
+
+
+def open_database(path):
+    """
+    Open a MaxMind DB file. MODE_AUTO memory-maps the file, through the C
+    extension when it is available, so every worker process shares one copy
+    of it through the page cache.
+    """
+    if maxminddb is None:
+        raise ImproperlyConfigured(
+            'GeoIP rules require maxminddb. Install it with '
+            '"pip install django-turnstile-site-protect[geoip]".'
+        )
+    try:
+        return maxminddb.open_database(path, maxminddb.MODE_AUTO)
+    except (OSError, ValueError) as e:
+        raise ImproperlyConfigured(f'Could not open GeoIP database {path}: {e}')
+
+
+class GeoIPResolver:
+    """
+    Resolve client IPs to (country code, ASN) pairs from local MaxMind
+    country and ASN databases (GeoLite2 or GeoIP2). Either database may be
+    left out, in which case its half of the pair is None.
+
+    Recent results are kept in an LRU cache, so repeat visitors cost one
+    dictionary lookup instead of a walk of the database's search tree.
+    """
+
+    def __init__(self, country_database=None, asn_database=None, cache_size=4096):
+        self.country_reader = country_database and open_database(country_database)
+        self.asn_reader = asn_database and open_database(asn_database)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, address):
+        country = asn = None
+        if self.country_reader:
+            record = self.country_reader.get(address) or {}
+            # Fall back to the registered country for anonymous and
+            # satellite providers that have no physical location
+            location = record.get('country') or record.get('registered_country')
+            if location:
+                country = location.get('iso_code')
+        if self.asn_reader:
+            record = self.asn_reader.get(address) or {}
+            asn = record.get('autonomous_system_number')
+        return country, asn
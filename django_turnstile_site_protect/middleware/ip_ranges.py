@@ -0,0 +1,234 @@
+import ipaddress
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+# Compiled allowlist files start with this header: the magic bytes, then the
+# number of IPv4 and IPv6 intervals. The header is followed by the IPv4 start
+# and end addresses as little-endian uint32 arrays, then the IPv6 start and
+# end addresses as 16-byte big-endian integers. Intervals are sorted and merged.
+ALLOWLIST_MAGIC = b'TSIPLST1'
+ALLOWLIST_HEADER = struct.Struct('<8sQQ')
+
+
+def parse_ip_ranges(ip_list):
+    """
+    Parse a list of IP addresses, ranges and networks into integer intervals.
+    Format for networks: '192.168.1.0/24' or '2001:db8::/32'
+    Format for ranges: '192.168.1.0-192.168.1.255'
+    Format for single IPs: '192.168.1.1' or '::1'
+
+    Returns a list of (version, start, end) tuples. Invalid entries are skipped.
+    """
+    intervals = []
+
+    for item in ip_list:
+        item = item.strip()
+        try:
+            if '/' in item:  # It's a network in CIDR notation
+                network = ipaddress.ip_network(item, strict=False)
+                start = network.network_address
+                end = network.broadcast_address
+            elif '-' in item:  # It's a range
+                start_ip, end_ip = item.split('-', 1)
+                start = ipaddress.ip_address(start_ip.strip())
+                end = ipaddress.ip_address(end_ip.strip())
+                if start.version != end.version:
+                    continue
+                if start > end:
+                    start, end = end, start
+            else:  # It's a single IP
+                start = end = ipaddress.ip_address(item)
+        except ValueError:
+            # If invalid IP, just skip it
+            continue
+
+        intervals.append((start.version, int(start), int(end)))
+
+    return intervals
+
+
+def _merge(intervals):
+    """
+    Sort intervals and merge the ones that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def read_allowlist(path):
+    """
+    Parse a text allowlist file with one entry per line, in any format
+    parse_ip_ranges accepts. Blank lines and # comments are ignored.
+    """
+    with open(path) as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return parse_ip_ranges(line for line in lines if line)
+
+
+def is_compiled_allowlist(path):
+    with open(path, 'rb') as f:
+        return f.read(len(ALLOWLIST_MAGIC)) == ALLOWLIST_MAGIC
+
+
+def _uint32_array(values):
+    values = array('I', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_allowlist(intervals, f):
+    """
+    Write (version, start, end) intervals to a binary file object in the
+    compiled allowlist format.
+    """
+    v4 = _merge((start, end) for version, start, end in intervals if version == 4)
+    v6 = _merge((start, end) for version, start, end in intervals if version == 6)
+
+    f.write(ALLOWLIST_HEADER.pack(ALLOWLIST_MAGIC, len(v4), len(v6)))
+    f.write(_uint32_array(start for start, _ in v4))
+    f.write(_uint32_array(end for _, end in v4))
+    f.write(b''.join(start.to_bytes(16, 'big') for start, _ in v6))
+    f.write(b''.join(end.to_bytes(16, 'big') for _, end in v6))
+    return len(v4), len(v6)
+
+
+class _PackedUInt128:
+    """
+    Read-only sequence of 16-byte big-endian integers in a buffer, so bisect
+    can search IPv6 addresses without unpacking the whole array.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def __len__(self):
+        return len(self._buffer) // 16
+
+    def __getitem__(self, i):
+        start = i * 16
+        end = start + 16
+        return int.from_bytes(self._buffer[start:end], 'big')
+
+
+def _split_half(buffer):
+    half = len(buffer) // 2
+    return buffer[:half], buffer[half:]
+
+
+def load_allowlist(path):
+    """
+    Memory-map a compiled allowlist file. Returns the IPv4 (starts, ends)
+    and IPv6 (starts, ends) sequences and the mmap backing them. The pages
+    are shared with every other process that maps the same file.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, v4_count, v6_count = ALLOWLIST_HEADER.unpack_from(mapped)
+    if magic != ALLOWLIST_MAGIC:
+        raise ValueError(f'{path} is not a compiled allowlist file.')
+
+    view = memoryview(mapped)
+    v4_start = ALLOWLIST_HEADER.size
+    v6_start = v4_start + v4_count * 8
+    if len(view) != v6_start + v6_count * 32:
+        raise ValueError(f'{path} is truncated or corrupt.')
+
+    v4 = view[v4_start:v6_start]
+    if sys.byteorder == 'big':
+        # The file is little-endian, so swap into a private copy
+        v4, data = array('I'), v4
+        v4.frombytes(data)
+        v4.byteswap()
+    else:
+        v4 = v4.cast('I')
+    v6_starts, v6_ends = _split_half(view[v6_start:])
+
+    return (
+        (v4[:v4_count], v4[v4_count:]),
+        (_PackedUInt128(v6_starts), _PackedUInt128(v6_ends)),
+        mapped,
+    )
+
+
+class IPRangeIndex:
+    """
+    Immutable index of IP intervals searched by bisection.
+
+    Intervals are merged at build time and stored as parallel sorted arrays of
+    start and end addresses, one pair per IP version, so a lookup costs
+    O(log n) regardless of the size of the allowlist.
+
+    Allowlist files may be given as well. Text files are merged into the
+    in-memory arrays; compiled files are memory-mapped and searched in place,
+    one more bisection per file.
+    """
+
+    def __init__(self, intervals=(), files=()):
+        intervals = list(intervals)
+        compiled = []
+        for path in files:
+            if is_compiled_allowlist(path):
+                compiled.append(load_allowlist(path))
+            else:
+                intervals.extend(read_allowlist(path))
+
+        v4 = []
+        v6 = []
+        for version, start, end in intervals:
+            (v4 if version == 4 else v6).append((start, end))
+
+        v4 = _merge(v4)
+        v6 = _merge(v6)
+
+        # IPv4 addresses fit in a C unsigned long; IPv6 needs Python ints
+        tables_v4 = [
+            (
+                array('L', (start for start, _ in v4)),
+                array('L', (end for _, end in v4)),
+            )
+        ]
+        tables_v6 = [
+            ([start for start, _ in v6], [end for _, end in v6]),
+        ]
+        self._mmaps = []
+        for table_v4, table_v6, mapped in compiled:
+            tables_v4.append(table_v4)
+            tables_v6.append(table_v6)
+            self._mmaps.append(mapped)
+
+        # Skip empty tables so lookups only bisect where there is data
+        self._v4_tables = tuple(table for table in tables_v4 if len(table[0]))
+        self._v6_tables = tuple(table for table in tables_v6 if len(table[0]))
+
+    def __len__(self):
+        return sum(len(starts) for starts, _ in self._v4_tables + self._v6_tables)
+
+    def __contains__(self, address):
+        """
+        Check if an ipaddress.IPv4Address or IPv6Address falls in any interval.
+        """
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        if address.version == 4:
+            tables = self._v4_tables
+        else:
+            tables = self._v6_tables
+
+        value = int(address)
+        for starts, ends in tables:
+            i = bisect_right(starts, value) - 1
+            if i >= 0 and value <= ends[i]:
+                return True
+        return False
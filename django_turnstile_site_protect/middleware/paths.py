@@ -0,0 +1,104 @@
+import re
+
+# Characters that give a pattern regex semantics beyond a literal prefix
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+# Patterns referring to their own groups, by backreference or conditional
+# group, cannot be renumbered inside an alternation
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def literal_prefix(pattern):
+    """
+    Return the literal prefix a pattern matches, or None if it is a real regex.
+    Since patterns are applied with re.match, '/static/' and '^/static/' both
+    match exactly the paths starting with '/static/'.
+    """
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    if REGEX_METACHARACTERS.isdisjoint(pattern):
+        return pattern
+    return None
+
+
+class PathMatcher:
+    """
+    Matches request paths against all excluded path rules at once.
+
+    Plain prefixes are stored in a character trie and the remaining regular
+    expressions are compiled into a single alternation, so the cost of a
+    lookup does not grow with the number of rules.
+    """
+
+    def __init__(self, patterns, prefixes=()):
+        # Always-excluded literal prefixes, such as the challenge page
+        self._trie = {}
+        for prefix in prefixes:
+            self._add_prefix(prefix, prefix)
+
+        self._rules = []
+        regexes = []
+        for pattern in patterns:
+            # Compile individually first so invalid patterns fail loudly
+            compiled = re.compile(pattern)
+            prefix = literal_prefix(pattern)
+            if prefix is not None:
+                self._add_prefix(prefix, pattern)
+            else:
+                self._rules.append(pattern)
+                regexes.append(compiled)
+
+        self._regex = None
+        self._regexes = ()
+        if regexes:
+            try:
+                if any(BACKREFERENCE.search(pattern) for pattern in self._rules):
+                    raise re.error('group references cannot be combined')
+                # Each alternative ends in an empty marker group whose index
+                # identifies the rule. Wrapping the patterns themselves in
+                # named groups would stop the regex engine from optimizing
+                # the alternation, making misses linear in the rule count.
+                self._marker_rules = {}
+                group = 0
+                for pattern, compiled in zip(self._rules, regexes):
+                    group += compiled.groups + 1
+                    self._marker_rules[group] = pattern
+                self._regex = re.compile(
+                    '|'.join(f'(?:{pattern})()' for pattern in self._rules)
+                )
+            except re.error:
+                # Fall back to matching the patterns one by one
+                self._regexes = tuple(regexes)
+
+    def _add_prefix(self, prefix, rule):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # The None key marks the end of a prefix and holds the rule
+        node.setdefault(None, rule)
+
+    def match(self, path):
+        """
+        Return the rule that matches the path, or None if no rule matches.
+        """
+        node = self._trie
+        for char in path:
+            if None in node:
+                return node[None]
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                return node[None]
+
+        if self._regex is not None:
+            match = self._regex.match(path)
+            if match:
+                return self._marker_rules[match.lastindex]
+        else:
+            for rule, regex in zip(self._rules, self._regexes):
+                if regex.match(path):
+                    return rule
+
+        return None
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Settings a rules file may override
+RELOADABLE_SETTINGS = (
+    'TURNSTILE_EXCLUDED_PATHS',
+    'TURNSTILE_EXCLUDED_IPS',
+    'TURNSTILE_EXCLUDED_IPS_FILES',
+    'TURNSTILE_EXCLUDED_DOMAINS',
+    'TURNSTILE_EXCLUDED_METHODS',
+    'TURNSTILE_EXCLUDED_HEADERS',
+    'TURNSTILE_EXCLUDED_USER_AGENTS',
+    'TURNSTILE_BLOCKED_USER_AGENTS',
+    'TURNSTILE_EXCLUDED_COUNTRIES',
+    'TURNSTILE_EXCLUDED_ASNS',
+    'TURNSTILE_CHALLENGED_COUNTRIES',
+    'TURNSTILE_CHALLENGED_ASNS',
+)
+
+
+def read_rules_file(path):
+    """
+    Read a JSON rules file: an object whose keys are names from
+    RELOADABLE_SETTINGS. Raises ValueError if the file is malformed.
+    """
+    with open(path) as f:
+        overrides = json.load(f)
+
+    if not isinstance(overrides, dict):
+        raise ValueError(f'{path} must contain a JSON object.')
+    unknown = set(overrides) - set(RELOADABLE_SETTINGS)
+    if unknown:
+        raise ValueError(
+            f'{path} contains unsupported settings: {", ".join(sorted(unknown))}.'
+        )
+    return overrides
+
+
+class RulesFileWatcher:
+    """
+    Poll a rules file and call `on_change` with its contents whenever its
+    modification time or size changes.
+
+    The file is read and `on_change` runs on the watcher's own daemon
+    thread, so building new indexes never delays a request. If reading or
+    applying the file fails, the error is logged and the previous rules stay
+    in place.
+
+    Threads don't survive a fork, so the middleware calls ensure_started()
+    on each request rather than starting the watcher when it is created:
+    with gunicorn --preload, each forked worker then starts its own thread.
+    """
+
+    def __init__(self, path, on_change, interval=5):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._stamp = self._get_stamp()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """
+        Reload the rules if the file changed. Returns True if they were
+        reloaded.
+        """
+        stamp = self._get_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+
+        try:
+            self.on_change(read_rules_file(self.path))
+        except Exception:
+            logger.exception('Could not reload Turnstile rules from %s', self.path)
+            return False
+        return True
+
+    def ensure_started(self):
+        """
+        Start the watcher thread unless it runs in this process already.
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.start()
+
+    def start(self):
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name='turnstile-rules-watcher', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
@@ -0,0 +1,253 @@
+import hmac
+import re
+
+from django.http.request import split_domain_port
+
+from ..utils import get_client_ip
+
+# Reason codes returned by RuleEngine.decide
+PATH = 'path'
+METHOD = 'method'
+DOMAIN = 'domain'
+IP = 'ip'
+HEADER = 'header'
+USER_AGENT = 'user_agent'
+GEO = 'geo'
+SESSION = 'session'
+
+# Rules that force a challenge instead of bypassing it
+GEO_CHALLENGE = 'geo_challenge'
+
+# Rules that reject the request outright
+BLOCK = 'block'
+
+KINDS = (
+    PATH,
+    METHOD,
+    BLOCK,
+    GEO_CHALLENGE,
+    DOMAIN,
+    IP,
+    GEO,
+    HEADER,
+    USER_AGENT,
+    SESSION,
+)
+
+
+class RequestInfo:
+    """
+    The normalized attributes of a request that rules match against.
+    Each attribute is computed at most once, and only if a rule needs it.
+    """
+
+    _unset = object()
+
+    def __init__(self, request):
+        self.request = request
+        self._host = self._unset
+        self._client_ip = self._unset
+
+    @property
+    def path(self):
+        return self.request.path
+
+    @property
+    def method(self):
+        return self.request.method
+
+    @property
+    def meta(self):
+        return self.request.META
+
+    @property
+    def user_agent(self):
+        return self.request.META.get('HTTP_USER_AGENT', '')
+
+    @property
+    def host(self):
+        if self._host is self._unset:
+            # Remove port if present; split_domain_port also lower-cases the host
+            self._host, _ = split_domain_port(self.request.get_host())
+        return self._host
+
+    @property
+    def client_ip(self):
+        if self._client_ip is self._unset:
+            self._client_ip = get_client_ip(self.request)
+        return self._client_ip
+
+
+class Rule:
+    """
+    One row of the decision table: a reason code and a predicate taking a
+    RequestInfo. Rules that have to do I/O can provide an async predicate.
+
+    A matching rule normally bypasses the challenge. A matching challenge
+    rule instead skips the remaining bypass rules, so only the session check
+    can let the request through.
+    """
+
+    __slots__ = ('reason', 'match', 'amatch', 'challenge')
+
+    def __init__(self, reason, match, amatch=None, challenge=False):
+        self.reason = reason
+        self.match = match
+        self.amatch = amatch
+        self.challenge = challenge
+
+
+def path_rule(matcher):
+    return Rule(PATH, lambda info: matcher.match(info.path) is not None)
+
+
+def method_rule(methods):
+    methods = frozenset(method.upper() for method in methods)
+    return Rule(METHOD, lambda info: info.method in methods)
+
+
+def domain_rule(index):
+    return Rule(DOMAIN, lambda info: index.match(info.host) is not None)
+
+
+def ip_rule(ranges):
+    def match(info):
+        # Invalid client IPs are never excluded
+        client_ip = info.client_ip
+        return client_ip is not None and client_ip in ranges
+
+    return Rule(IP, match)
+
+
+def _geo_match(resolver, countries, asns):
+    countries = frozenset(country.upper() for country in countries)
+    asns = frozenset(int(asn) for asn in asns)
+
+    def match(info):
+        # Country and ASN rules can't be met or escaped with a forged header
+        client_ip = info.client_ip
+        if client_ip is None:
+            return False
+        country, asn = resolver.lookup(client_ip)
+        return country in countries or asn in asns
+
+    return match
+
+
+def geo_rule(resolver, countries=(), asns=()):
+    return Rule(GEO, _geo_match(resolver, countries, asns))
+
+
+def geo_challenge_rule(resolver, countries=(), asns=()):
+    return Rule(GEO_CHALLENGE, _geo_match(resolver, countries, asns), challenge=True)
+
+
+def header_rule(headers):
+    """
+    Match requests carrying any of the given headers. A value of None matches
+    any value; other values are compared in constant time, since they are
+    typically shared secrets.
+    """
+    expected = tuple(
+        (
+            'HTTP_' + name.upper().replace('-', '_'),
+            None if value is None else value.encode(),
+        )
+        for name, value in headers.items()
+    )
+
+    def match(info):
+        meta = info.meta
+        for key, value in expected:
+            actual = meta.get(key)
+            if actual is not None and (
+                value is None or hmac.compare_digest(actual.encode(), value)
+            ):
+                return True
+        return False
+
+    return Rule(HEADER, match)
+
+
+def user_agent_rule(patterns):
+    regex = re.compile(
+        '|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE
+    )
+    return Rule(USER_AGENT, lambda info: regex.search(info.user_agent) is not None)
+
+
+def block_rule(matcher):
+    """
+    Match requests whose user agent contains a blocked signature. The rule
+    engine returns BLOCK like any other reason; rejecting the request is up
+    to the middleware.
+    """
+    return Rule(BLOCK, lambda info: matcher.match(info.user_agent) is not None)
+
+
+class RuleEngine:
+    """
+    An immutable decision table of bypass rules, evaluated in order.
+
+    decide() normalizes the request once, stops at the first rule that
+    matches and returns its reason code, or None if no rule matches. If the
+    first match is a challenge rule, only the session rule is evaluated
+    after it.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.reasons = tuple(rule.reason for rule in self.rules)
+        self.session_rules = tuple(
+            rule for rule in self.rules if rule.reason == SESSION
+        )
+
+    def __len__(self):
+        return len(self.rules)
+
+    def decide(self, request):
+        return self.classify(request)[0]
+
+    async def adecide(self, request):
+        return (await self.aclassify(request))[0]
+
+    def classify(self, request):
+        """
+        Return (reason, forced), where reason is what decide() returns and
+        forced is True if a challenge rule matched. A forced challenge must
+        not be waived by anything outside the table.
+        """
+        info = RequestInfo(request)
+        for rule in self.rules:
+            if rule.match(info):
+                if not rule.challenge:
+                    return rule.reason, False
+                # Only a passed challenge lets the request through now
+                for session_rule in self.session_rules:
+                    if session_rule.match(info):
+                        return session_rule.reason, True
+                return None, True
+        return None, False
+
+    async def aclassify(self, request):
+        info = RequestInfo(request)
+        for rule in self.rules:
+            if rule.amatch is not None:
+                matched = await rule.amatch(info)
+            else:
+                matched = rule.match(info)
+            if matched:
+                if not rule.challenge:
+                    return rule.reason, False
+                # Only a passed challenge lets the request through now
+                for session_rule in self.session_rules:
+                    if await self._amatch(session_rule, info):
+                        return session_rule.reason, True
+                return None, True
+        return None, False
+
+    @staticmethod
+    async def _amatch(rule, info):
+        if rule.amatch is not None:
+            return await rule.amatch(info)
+        return rule.match(info)
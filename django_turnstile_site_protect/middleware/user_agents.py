@@ -0,0 +1,32 @@
+import re
+
+
+class SignatureMatcher:
+    """
+    Find which of a set of user-agent signatures a user agent contains.
+
+    Signatures are case-insensitive substrings, such as 'GPTBot'. They are
+    lower-cased and compiled into a single alternation of literals, which is
+    searched in the lower-cased user agent: several times faster than a
+    re.IGNORECASE search. The matched text identifies the signature.
+    """
+
+    def __init__(self, signatures=()):
+        self.signatures = {signature.lower(): signature for signature in signatures}
+        self.regex = None
+        if self.signatures:
+            # Longer signatures first, so 'ClaudeBot' is preferred over 'Claude'
+            literals = sorted(self.signatures, key=len, reverse=True)
+            self.regex = re.compile('|'.join(map(re.escape, literals)))
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def match(self, user_agent):
+        """
+        Return the first signature found in the user agent, or None.
+        """
+        if self.regex is None:
+            return None
+        match = self.regex.search(user_agent.lower())
+        return match and self.signatures[match.group()]
@@ -0,0 +1,39 @@
+from django.conf import settings
+
+# Namespaces the HMAC so the pass cookie can't be forged from other signed cookies
+PASS_COOKIE_SALT = 'django_turnstile_site_protect.pass'
+
+
+def get_pass_cookie_name():
+    return getattr(settings, 'TURNSTILE_PASS_COOKIE_NAME', 'turnstile_pass')
+
+
+def get_pass_cookie_age():
+    return getattr(settings, 'TURNSTILE_PASS_COOKIE_AGE', settings.SESSION_COOKIE_AGE)
+
+
+def has_pass_cookie(request, name, max_age):
+    """
+    Check for a valid, unexpired pass cookie. This only verifies an HMAC
+    signature and a timestamp, so no session or cache backend is touched.
+    """
+    value = request.get_signed_cookie(
+        name, default=None, salt=PASS_COOKIE_SALT, max_age=max_age
+    )
+    return value is not None
+
+
+def set_pass_cookie(response, value='1', salt=PASS_COOKIE_SALT):
+    """
+    Issue a signed, expiring pass cookie on the response.
+    """
+    response.set_signed_cookie(
+        get_pass_cookie_name(),
+        value,
+        salt=salt,
+        max_age=get_pass_cookie_age(),
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.SESSION_COOKIE_SAMESITE,
+    )
+    return response
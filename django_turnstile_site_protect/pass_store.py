@@ -0,0 +1,293 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .pass_cookie import (
+    get_pass_cookie_age,
+    get_pass_cookie_name,
+    has_pass_cookie,
+    set_pass_cookie,
+)
+from .utils import SharedInstances, acache_call, get_client_ip
+
+# Namespaces the HMAC of the client id cookie issued by keyed stores
+CLIENT_ID_SALT = 'django_turnstile_site_protect.client_id'
+
+
+class PassStore:
+    """
+    Remembers which clients have passed the challenge.
+
+    The middleware asks has_passed() on every request that no exclusion rule
+    bypasses, and the verify view calls mark_passed() after a successful
+    verification. The async variants default to running the sync methods in
+    a thread; stores that can do better override them.
+    """
+
+    def has_passed(self, request):
+        raise NotImplementedError
+
+    def mark_passed(self, request, response):
+        """
+        Remember the client and return the response, which the store may
+        modify (to set a cookie, for example).
+        """
+        raise NotImplementedError
+
+    async def ahas_passed(self, request):
+        return await sync_to_async(self.has_passed)(request)
+
+    async def amark_passed(self, request, response):
+        return await sync_to_async(self.mark_passed)(request, response)
+
+
+class SessionPassStore(PassStore):
+    """
+    Set a flag in the Django session. This is the default.
+    """
+
+    def __init__(self):
+        self.session_key = getattr(
+            settings, 'TURNSTILE_SESSION_KEY', 'turnstile_passed'
+        )
+
+    def has_passed(self, request):
+        return bool(request.session.get(self.session_key))
+
+    def mark_passed(self, request, response):
+        request.session[self.session_key] = True
+        return response
+
+    async def ahas_passed(self, request):
+        session = request.session
+        if hasattr(session, 'aget'):
+            # Django 5.0+ sessions support native async access
+            return bool(await session.aget(self.session_key))
+        return bool(await sync_to_async(session.get)(self.session_key))
+
+    async def amark_passed(self, request, response):
+        session = request.session
+        if hasattr(session, 'aset'):
+            await session.aset(self.session_key, True)
+        else:
+            await sync_to_async(session.__setitem__)(self.session_key, True)
+        return response
+
+
+class SignedCookiePassStore(PassStore):
+    """
+    Issue a signed, expiring cookie. Checking it only verifies an HMAC, so no
+    backend is touched at all.
+    """
+
+    def __init__(self):
+        self.cookie_name = get_pass_cookie_name()
+        self.max_age = get_pass_cookie_age()
+
+    def has_passed(self, request):
+        return has_pass_cookie(request, self.cookie_name, self.max_age)
+
+    def mark_passed(self, request, response):
+        return set_pass_cookie(response)
+
+    async def ahas_passed(self, request):
+        return self.has_passed(request)
+
+    async def amark_passed(self, request, response):
+        return self.mark_passed(request, response)
+
+
+class KeyedPassStore(PassStore):
+    """
+    Base class for stores that keep verified clients in a key-value store,
+    with a TTL of TURNSTILE_PASS_COOKIE_AGE.
+
+    Clients are keyed by a random id issued in a signed cookie, or with
+    TURNSTILE_PASS_STORE_KEY = 'fingerprint', by a hash of their IP address
+    and user agent, which needs no cookie at all.
+    """
+
+    def __init__(self):
+        self.ttl = get_pass_cookie_age()
+        self.cookie_name = get_pass_cookie_name()
+        self.key_source = getattr(settings, 'TURNSTILE_PASS_STORE_KEY', 'cookie')
+        if self.key_source not in ('cookie', 'fingerprint'):
+            raise ImproperlyConfigured(
+                'TURNSTILE_PASS_STORE_KEY must be "cookie" or "fingerprint".'
+            )
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key):
+        raise NotImplementedError
+
+    async def aget(self, key):
+        return await sync_to_async(self.get)(key)
+
+    async def aset(self, key):
+        return await sync_to_async(self.set)(key)
+
+    def fingerprint(self, request):
+        client = '\n'.join(
+            (
+                str(get_client_ip(request)),
+                request.META.get('HTTP_USER_AGENT', ''),
+            )
+        )
+        return hashlib.sha256(client.encode()).hexdigest()
+
+    def get_key(self, request):
+        """
+        Return the client's key, or None if it has none yet.
+        """
+        if self.key_source == 'fingerprint':
+            return self.fingerprint(request)
+        return request.get_signed_cookie(
+            self.cookie_name, default=None, salt=CLIENT_ID_SALT, max_age=self.ttl
+        )
+
+    def issue_key(self, request, response):
+        """
+        Return a key for a newly verified client, setting its cookie if needed.
+        """
+        if self.key_source == 'fingerprint':
+            return self.fingerprint(request)
+        key = secrets.token_urlsafe(18)
+        set_pass_cookie(response, key, salt=CLIENT_ID_SALT)
+        return key
+
+    def has_passed(self, request):
+        key = self.get_key(request)
+        return key is not None and self.get(key)
+
+    def mark_passed(self, request, response):
+        self.set(self.issue_key(request, response))
+        return response
+
+    async def ahas_passed(self, request):
+        key = self.get_key(request)
+        return key is not None and await self.aget(key)
+
+    async def amark_passed(self, request, response):
+        await self.aset(self.issue_key(request, response))
+        return response
+
+
+class CachePassStore(KeyedPassStore):
+    """
+    Keep verified clients in a Django cache, such as Redis or Memcached,
+    shared by all worker processes.
+    """
+
+    prefix = 'turnstile:pass:'
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[getattr(settings, 'TURNSTILE_PASS_STORE_CACHE', 'default')]
+
+    def get(self, key):
+        return bool(self.cache.get(self.prefix + key))
+
+    def set(self, key):
+        self.cache.set(self.prefix + key, True, self.ttl)
+
+    async def aget(self, key):
+        return bool(await acache_call(self.cache, 'get', self.prefix + key))
+
+    async def aset(self, key):
+        await acache_call(self.cache, 'set', self.prefix + key, True, self.ttl)
+
+
+class MemoryPassStore(KeyedPassStore):
+    """
+    Keep verified clients in process memory. The store holds at most
+    TURNSTILE_PASS_STORE_MAX_ENTRIES clients and evicts the least recently
+    seen one when full. Each worker process has its own store.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        super().__init__()
+        self.max_entries = getattr(settings, 'TURNSTILE_PASS_STORE_MAX_ENTRIES', 10000)
+        self.clock = clock
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._expires)
+
+    def get(self, key):
+        with self._lock:
+            expires = self._expires.get(key)
+            if expires is None:
+                return False
+            if expires <= self.clock():
+                del self._expires[key]
+                return False
+            self._expires.move_to_end(key)
+            return True
+
+    def set(self, key):
+        with self._lock:
+            self._expires[key] = self.clock() + self.ttl
+            self._expires.move_to_end(key)
+            while len(self._expires) > self.max_entries:
+                self._expires.popitem(last=False)
+
+    # Nothing here blocks, so the async versions don't need a thread
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key):
+        self.set(key)
+
+
+PASS_STORES = {
+    'session': SessionPassStore,
+    'cookie': SignedCookiePassStore,
+    'cache': CachePassStore,
+    'memory': MemoryPassStore,
+}
+
+_pass_stores = SharedInstances()
+
+
+def _get_pass_store_config():
+    """
+    Get the pass store settings. TURNSTILE_PASS_COOKIE = True is shorthand
+    for TURNSTILE_PASS_STORE = 'cookie'.
+    """
+    default = (
+        'cookie' if getattr(settings, 'TURNSTILE_PASS_COOKIE', False) else 'session'
+    )
+    return {
+        'store': getattr(settings, 'TURNSTILE_PASS_STORE', default),
+        'session_key': getattr(settings, 'TURNSTILE_SESSION_KEY', 'turnstile_passed'),
+        'cookie_name': get_pass_cookie_name(),
+        'ttl': get_pass_cookie_age(),
+        'key': getattr(settings, 'TURNSTILE_PASS_STORE_KEY', 'cookie'),
+        'cache': getattr(settings, 'TURNSTILE_PASS_STORE_CACHE', 'default'),
+        'max_entries': getattr(settings, 'TURNSTILE_PASS_STORE_MAX_ENTRIES', 10000),
+    }
+
+
+def get_pass_store():
+    """
+    Return the process-wide pass store for the current configuration. The
+    middleware and the verify view share it, which matters for the
+    in-memory store.
+    """
+    config = _get_pass_store_config()
+    name = config['store']
+    return _pass_stores.get(
+        tuple(config.items()),
+        lambda: (PASS_STORES.get(name) or import_string(name))(),
+    )
@@ -0,0 +1,217 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .utils import SharedInstances, acache_call
+
+# Bits of the address shared by a client's neighbours: a /24 for IPv4 and a
+# /64 (one customer allocation) for IPv6
+SUBNET_BITS = {4: 8, 6: 64}
+
+
+class RateLimiter:
+    """
+    Sliding window rate limits on the challenge and verify views, per client
+    IP and per subnet.
+
+    Each key has a counter for the current fixed window and one for the
+    previous window. The request rate is estimated by weighting the previous
+    count by how much of it still overlaps the sliding window, which needs
+    two integers per key instead of a timestamp per request.
+
+    Subclasses store the counters: hit() increments the current window's
+    counter of a key and returns (previous count, current count).
+    """
+
+    def __init__(self, limit=None, subnet_limit=None, window=60, clock=time.time):
+        self.limit = limit
+        self.subnet_limit = subnet_limit
+        self.window = window
+        self.clock = clock
+
+    def hit(self, key, index):
+        raise NotImplementedError
+
+    async def ahit(self, key, index):
+        return self.hit(key, index)
+
+    def keys(self, client_ip):
+        """
+        Return the (key, limit) pairs a client counts against.
+        """
+        keys = []
+        if self.limit:
+            keys.append((f'ip:{client_ip}', self.limit))
+        if self.subnet_limit:
+            network = int(client_ip) >> SUBNET_BITS[client_ip.version]
+            keys.append((f'net{client_ip.version}:{network}', self.subnet_limit))
+        return keys
+
+    def _window(self):
+        index, elapsed = divmod(self.clock(), self.window)
+        return int(index), elapsed
+
+    def _retry_after(self, counts, limit, elapsed):
+        """
+        Return the seconds until a key is under its limit, or None if it
+        already is.
+        """
+        previous, current = counts
+        weight = 1 - elapsed / self.window
+        if previous * weight + current <= limit:
+            return None
+        if current > limit:
+            # Only the next window starts below the limit
+            return self.window - elapsed
+        # Wait for enough of the previous window to slide out
+        remaining = (previous * weight + current - limit) / previous
+        return remaining * self.window
+
+    def check(self, client_ip):
+        """
+        Count a request from the client. Returns the number of seconds to
+        wait if it is over a limit, or None if it may go ahead.
+        """
+        if client_ip is None:
+            return None
+        index, elapsed = self._window()
+        waits = [
+            self._retry_after(self.hit(key, index), limit, elapsed)
+            for key, limit in self.keys(client_ip)
+        ]
+        return self._longest(waits)
+
+    async def acheck(self, client_ip):
+        if client_ip is None:
+            return None
+        index, elapsed = self._window()
+        waits = [
+            self._retry_after(await self.ahit(key, index), limit, elapsed)
+            for key, limit in self.keys(client_ip)
+        ]
+        return self._longest(waits)
+
+    @staticmethod
+    def _longest(waits):
+        waits = [wait for wait in waits if wait is not None]
+        return max(1, math.ceil(max(waits))) if waits else None
+
+
+class MemoryRateLimiter(RateLimiter):
+    """
+    Keep the counters in process memory. At most
+    TURNSTILE_RATE_LIMIT_MAX_ENTRIES keys are kept, evicting the least
+    recently seen. Each worker process counts on its own, so the effective
+    limit is multiplied by the number of workers.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = getattr(settings, 'TURNSTILE_RATE_LIMIT_MAX_ENTRIES', 10000)
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def hit(self, key, index):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = [index, 0, 0]
+            elif counter[0] != index:
+                # Roll over to the new window
+                previous = counter[2] if counter[0] == index - 1 else 0
+                counter[:] = [index, previous, 0]
+            counter[2] += 1
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_entries:
+                self._counters.popitem(last=False)
+            return counter[1], counter[2]
+
+
+class CacheRateLimiter(RateLimiter):
+    """
+    Keep the counters in a Django cache, such as Redis or Memcached, so all
+    worker processes share the same limits. Windows are aligned to the wall
+    clock, so every process agrees on them.
+    """
+
+    prefix = 'turnstile:rl:'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = caches[getattr(settings, 'TURNSTILE_RATE_LIMIT_CACHE', 'default')]
+
+    def _keys(self, key, index):
+        return f'{self.prefix}{key}:{index - 1}', f'{self.prefix}{key}:{index}'
+
+    def hit(self, key, index):
+        previous_key, current_key = self._keys(key, index)
+        # A counter lives for two windows, so it can serve as the previous one
+        self.cache.add(current_key, 0, self.window * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Evicted between add() and incr()
+            self.cache.set(current_key, 1, self.window * 2)
+            current = 1
+        return self.cache.get(previous_key, 0), current
+
+    async def ahit(self, key, index):
+        previous_key, current_key = self._keys(key, index)
+        await acache_call(self.cache, 'add', current_key, 0, self.window * 2)
+        try:
+            current = await acache_call(self.cache, 'incr', current_key)
+        except ValueError:
+            await acache_call(self.cache, 'set', current_key, 1, self.window * 2)
+            current = 1
+        return await acache_call(self.cache, 'get', previous_key, 0), current
+
+
+RATE_LIMITERS = {
+    'memory': MemoryRateLimiter,
+    'cache': CacheRateLimiter,
+}
+
+_rate_limiters = SharedInstances()
+
+
+def _get_rate_limit_config():
+    return {
+        'backend': getattr(settings, 'TURNSTILE_RATE_LIMIT_BACKEND', 'memory'),
+        'limit': getattr(settings, 'TURNSTILE_RATE_LIMIT', None),
+        'subnet_limit': getattr(settings, 'TURNSTILE_RATE_LIMIT_SUBNET', None),
+        'window': getattr(settings, 'TURNSTILE_RATE_LIMIT_WINDOW', 60),
+        'cache': getattr(settings, 'TURNSTILE_RATE_LIMIT_CACHE', 'default'),
+        'max_entries': getattr(settings, 'TURNSTILE_RATE_LIMIT_MAX_ENTRIES', 10000),
+    }
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide rate limiter for the current configuration, or
+    None if rate limiting is off.
+    """
+    config = _get_rate_limit_config()
+    if not config['limit'] and not config['subnet_limit']:
+        return None
+
+    if config['window'] <= 0:
+        raise ImproperlyConfigured('TURNSTILE_RATE_LIMIT_WINDOW must be positive.')
+
+    name = config['backend']
+    return _rate_limiters.get(
+        tuple(config.items()),
+        lambda: (RATE_LIMITERS.get(name) or import_string(name))(
+            limit=config['limit'],
+            subnet_limit=config['subnet_limit'],
+            window=config['window'],
+        ),
+    )
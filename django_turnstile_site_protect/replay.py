@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .utils import SharedInstances, acache_call
+
+
+class _Flight:
+    """
+    A verification in progress, which concurrent requests for the same
+    token wait on instead of calling siteverify themselves.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ReplayGuard:
+    """
+    Remembers which Turnstile tokens have been verified, for
+    TURNSTILE_REPLAY_CACHE_TTL seconds (tokens expire after five minutes).
+
+    Tokens are single-use: Cloudflare rejects a token it has seen before, so
+    every duplicate can be rejected without a network call, whoever sends
+    it. Only a hash of each token is stored. Subclasses implement get() and
+    set(), and optionally their async variants.
+    """
+
+    def __init__(self):
+        self.ttl = getattr(settings, 'TURNSTILE_REPLAY_CACHE_TTL', 300)
+        self._flights = {}
+        self._afutures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Return True if the token has been seen.
+        """
+        raise NotImplementedError
+
+    def set(self, key):
+        raise NotImplementedError
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key):
+        self.set(key)
+
+    def check(self, key):
+        """
+        Return True if the token has been seen and must be rejected.
+        """
+        return bool(self.get(key))
+
+    async def acheck(self, key):
+        return bool(await self.aget(key))
+
+    def remember(self, key):
+        self.set(key)
+
+    async def aremember(self, key):
+        await self.aset(key)
+
+    def single_flight(self, key, func):
+        """
+        Call `func` and return (result, False), unless the same token is
+        already being verified. Then wait for that verification and return
+        (its result, True), for the caller to decide whether the token was
+        spent.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    async def asingle_flight(self, key, func):
+        """
+        Async version of single_flight; `func` is a coroutine function.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (key, loop)
+        future = self._afutures.get(flight_key)
+        if future is not None:
+            # Don't let a cancelled waiter cancel the shared verification
+            return await asyncio.shield(future), True
+
+        future = self._afutures[flight_key] = loop.create_future()
+        try:
+            result = await func()
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved when nobody else is waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._afutures[flight_key]
+        return result, False
+
+
+class MemoryReplayGuard(ReplayGuard):
+    """
+    Keep seen tokens in process memory, at most
+    TURNSTILE_REPLAY_CACHE_MAX_ENTRIES of them, evicting the least recently
+    seen. Each worker process has its own cache.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        super().__init__()
+        self.max_entries = getattr(
+            settings, 'TURNSTILE_REPLAY_CACHE_MAX_ENTRIES', 10000
+        )
+        self.clock = clock
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def get(self, key):
+        with self._seen_lock:
+            expires = self._seen.get(key)
+            if expires is None:
+                return False
+            if expires <= self.clock():
+                del self._seen[key]
+                return False
+            self._seen.move_to_end(key)
+            return True
+
+    def set(self, key):
+        with self._seen_lock:
+            self._seen[key] = self.clock() + self.ttl
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+
+
+class CacheReplayGuard(ReplayGuard):
+    """
+    Keep seen tokens in a Django cache, shared by all worker processes.
+    Concurrent verifications are still only coalesced within a process.
+    """
+
+    prefix = 'turnstile:token:'
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[
+            getattr(settings, 'TURNSTILE_REPLAY_CACHE_ALIAS', 'default')
+        ]
+
+    def get(self, key):
+        return bool(self.cache.get(self.prefix + key))
+
+    def set(self, key):
+        self.cache.set(self.prefix + key, True, self.ttl)
+
+    async def aget(self, key):
+        return bool(await acache_call(self.cache, 'get', self.prefix + key))
+
+    async def aset(self, key):
+        await acache_call(self.cache, 'set', self.prefix + key, True, self.ttl)
+
+
+REPLAY_GUARDS = {
+    'memory': MemoryReplayGuard,
+    'cache': CacheReplayGuard,
+}
+
+_replay_guards = SharedInstances()
+
+
+def _get_replay_config():
+    return {
+        'backend': getattr(settings, 'TURNSTILE_REPLAY_CACHE', 'memory'),
+        'ttl': getattr(settings, 'TURNSTILE_REPLAY_CACHE_TTL', 300),
+        'alias': getattr(settings, 'TURNSTILE_REPLAY_CACHE_ALIAS', 'default'),
+        'max_entries': getattr(settings, 'TURNSTILE_REPLAY_CACHE_MAX_ENTRIES', 10000),
+    }
+
+
+def get_replay_guard():
+    """
+    Return the process-wide replay guard for the current configuration, or
+    None if TURNSTILE_REPLAY_CACHE is None.
+    """
+    config = _get_replay_config()
+    if config['backend'] is None:
+        return None
+
+    name = config['backend']
+    return _replay_guards.get(
+        tuple(config.items()),
+        lambda: (REPLAY_GUARDS.get(name) or import_string(name))(),
+    )
@@ -80,3 +80,32 @@ def turnstile_settings():
         TURNSTILE_EXCLUDED_IPS=['192.168.1.1', '10.0.0.0-10.0.0.255'],
         TURNSTILE_EXCLUDED_DOMAINS=['example.com', '*.test.com'],
     )
+
+
+@pytest.fixture(autouse=True)
+def reset_process_state():
+    """
+    Give every test a closed circuit breaker, an empty metrics sink, and no
+    pass stores, rate limiters, replay guards or verification backends left
+    over from another test.
+    """
+    from django_turnstile_site_protect import (
+        backends,
+        breaker,
+        metrics,
+        pass_store,
+        ratelimit,
+        replay,
+    )
+
+    def reset():
+        breaker._breaker = None
+        metrics._sink = None
+        backends._backends.clear()
+        pass_store._pass_stores.clear()
+        ratelimit._rate_limiters.clear()
+        replay._replay_guards.clear()
+
+    reset()
+    yield
+    reset()
@@ -0,0 +1,11 @@
+"""Shared helpers for the django-turnstile-site-protect tests."""
+
+
+class FakeClock:
+    """A clock that only moves when a test sets or advances `now`."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
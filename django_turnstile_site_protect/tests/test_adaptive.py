@@ -0,0 +1,150 @@
+"""Tests for the adaptive under-attack mode."""
+
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware, adaptive
+from django_turnstile_site_protect.tests.helpers import FakeClock
+
+
+class BrokenCache:
+    """A cache whose every call fails, like one that can't be reached."""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('cache unavailable')
+
+        return fail
+
+
+class TestTrafficMonitor(SimpleTestCase):
+    """Test cases for the traffic monitor's attack detection."""
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+
+    def monitor(self, **kwargs):
+        options = dict(threshold=10, window=2, hold=5, clock=self.clock)
+        options.update(kwargs)
+        return adaptive.TrafficMonitor(**options)
+
+    def run_traffic(self, monitor, seconds, per_second, unverified_ratio=1.0):
+        """Send `per_second` requests a second, and return the final verdict."""
+        unverified = round(per_second * unverified_ratio)
+        for _ in range(seconds):
+            for i in range(per_second):
+                monitor.record(unverified=i < unverified)
+            self.clock.now += 1
+        # The first request of the next second evaluates the last one
+        return monitor.record(unverified=False)
+
+    def test_calm_traffic(self):
+        monitor = self.monitor()
+        self.assertFalse(self.run_traffic(monitor, 5, 5))
+
+    def test_spike_engages(self):
+        monitor = self.monitor()
+        self.assertFalse(self.run_traffic(monitor, 1, 5))
+        self.assertTrue(self.run_traffic(monitor, 2, 30))
+
+    def test_verified_traffic_does_not_engage(self):
+        """Test that a busy site with mostly verified visitors stays open."""
+        monitor = self.monitor()
+        self.assertFalse(self.run_traffic(monitor, 3, 30, unverified_ratio=0.2))
+
+    def test_hysteresis(self):
+        monitor = self.monitor()
+        self.assertTrue(self.run_traffic(monitor, 2, 30))
+
+        # Below the threshold but above the release level: still engaged
+        self.assertTrue(self.run_traffic(monitor, 10, 8))
+
+        # Calm, but not for long enough yet
+        self.assertTrue(self.run_traffic(monitor, 4, 2))
+        self.assertFalse(self.run_traffic(monitor, 4, 2))
+
+    def test_shared_counters(self):
+        """Test that workers sharing a cache see each other's traffic."""
+        cache.clear()
+        workers = [self.monitor(cache=cache) for _ in range(3)]
+        for _ in range(2):
+            for worker in workers:
+                for _ in range(8):
+                    worker.record(unverified=True)
+            self.clock.now += 1
+
+        self.assertTrue(all(worker.record(unverified=False) for worker in workers))
+        # On its own, one worker's traffic is under the threshold
+        self.assertFalse(self.run_traffic(self.monitor(), 2, 8))
+
+    async def test_async_shared_counters(self):
+        cache.clear()
+        monitor = self.monitor(cache=cache)
+        for _ in range(2):
+            for _ in range(30):
+                await monitor.arecord(unverified=True)
+            self.clock.now += 1
+
+        self.assertTrue(await monitor.arecord(unverified=False))
+
+    def test_counter_evicted_before_increment(self):
+        cache.clear()
+        monitor = self.monitor(cache=cache)
+        with patch.object(cache, 'incr', side_effect=ValueError):
+            self.assertTrue(self.run_traffic(monitor, 2, 30))
+        self.assertEqual(cache.get(f'{monitor.prefix}1001:total'), 30)
+
+    def test_unavailable_cache_falls_back_to_local_traffic(self):
+        with self.assertLogs(adaptive.logger, 'WARNING'):
+            self.assertFalse(self.run_traffic(self.monitor(cache=BrokenCache()), 2, 5))
+        self.assertTrue(self.run_traffic(self.monitor(cache=BrokenCache()), 2, 30))
+
+    async def test_async_unavailable_cache_falls_back_to_local_traffic(self):
+        monitor = self.monitor(cache=BrokenCache())
+        for _ in range(2):
+            for _ in range(30):
+                await monitor.arecord(unverified=True)
+            self.clock.now += 1
+
+        self.assertTrue(await monitor.arecord(unverified=False))
+
+
+@override_settings(TURNSTILE_ADAPTIVE=True, TURNSTILE_ADAPTIVE_THRESHOLD=10)
+class TestAdaptiveMiddleware(SimpleTestCase):
+    """Test cases for the middleware in adaptive mode."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        self.clock = FakeClock(1000.0)
+        self.middleware.traffic_monitor.clock = self.clock
+        self.middleware.traffic_monitor._second = int(self.clock())
+
+    def request(self):
+        request = self.factory.get('/protected/')
+        request.session = {}
+        return request
+
+    def test_unverified_clients_pass_while_calm(self):
+        self.assertIsNone(self.middleware.process_request(self.request()))
+
+    def test_unverified_clients_are_challenged_under_attack(self):
+        for _ in range(2):
+            for _ in range(200):
+                self.middleware.process_request(self.request())
+            self.clock.now += 1
+
+        response = self.middleware.process_request(self.request())
+
+        self.assertEqual(response.status_code, 302)
+
+    async def test_async(self):
+        request = self.request()
+        self.assertIsNone(await self.middleware.aprocess_request(request))
+
+    def test_excluded_requests_are_not_affected(self):
+        request = self.factory.get('/excluded/path/')
+        self.assertIsNone(self.middleware.process_request(request))
@@ -0,0 +1,127 @@
+"""Tests for allowlist files and the compile_turnstile_allowlist command."""
+
+import ipaddress
+import os
+import tempfile
+from io import StringIO
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware
+from django_turnstile_site_protect.middleware.ip_ranges import (
+    IPRangeIndex,
+    is_compiled_allowlist,
+    load_allowlist,
+    parse_ip_ranges,
+    write_allowlist,
+)
+
+ALLOWLIST = """\
+# Office network
+192.168.1.0/24
+10.0.0.0-10.0.0.255  # VPN
+203.0.113.7
+
+2001:db8::/32
+not-an-ip
+"""
+
+INSIDE = ['192.168.1.200', '10.0.0.1', '203.0.113.7', '2001:db8::1', '::ffff:10.0.0.9']
+OUTSIDE = ['192.168.2.1', '10.0.1.0', '203.0.113.8', '2001:db9::1', '::1']
+
+
+class TestAllowlistFiles(SimpleTestCase):
+    """Test cases for text and compiled allowlist files."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.text_path = os.path.join(self.directory.name, 'allowlist.txt')
+        with open(self.text_path, 'w') as f:
+            f.write(ALLOWLIST)
+        self.compiled_path = os.path.join(self.directory.name, 'allowlist.bin')
+
+    def compile(self):
+        out = StringIO()
+        call_command(
+            'compile_turnstile_allowlist',
+            self.text_path,
+            output=self.compiled_path,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def assertIndexMatches(self, index):
+        for ip in INSIDE:
+            self.assertIn(ipaddress.ip_address(ip), index, ip)
+        for ip in OUTSIDE:
+            self.assertNotIn(ipaddress.ip_address(ip), index, ip)
+
+    def test_text_file(self):
+        """Test that text files are parsed, skipping comments and bad entries."""
+        index = IPRangeIndex(files=[self.text_path])
+        self.assertEqual(len(index), 4)
+        self.assertIndexMatches(index)
+
+    def test_compiled_file(self):
+        """Test that a compiled file matches exactly what its source did."""
+        output = self.compile()
+
+        self.assertIn('3 IPv4 and 1 IPv6', output)
+        self.assertTrue(is_compiled_allowlist(self.compiled_path))
+        self.assertFalse(is_compiled_allowlist(self.text_path))
+        index = IPRangeIndex(files=[self.compiled_path])
+        self.assertEqual(len(index), 4)
+        self.assertIndexMatches(index)
+
+    def test_compiled_file_is_memory_mapped(self):
+        self.compile()
+        (v4_starts, v4_ends), _, mapped = load_allowlist(self.compiled_path)
+        self.assertIsInstance(v4_starts, memoryview)
+        self.assertEqual(v4_starts.obj, mapped)
+
+    def test_compiled_ranges_are_merged(self):
+        """Test that large, overlapping inputs are merged and stay searchable."""
+        networks = [f'10.{i // 256}.{i % 256}.0/24' for i in range(5000)]
+        networks += [f'2001:db8:{i:x}::/48' for i in range(0, 5000, 2)]
+        with open(self.compiled_path, 'wb') as f:
+            write_allowlist(parse_ip_ranges(networks), f)
+
+        index = IPRangeIndex(files=[self.compiled_path])
+
+        # The IPv4 networks are contiguous, the IPv6 ones are not
+        self.assertEqual(len(index), 1 + 2500)
+        self.assertIn(ipaddress.ip_address('10.19.135.1'), index)
+        self.assertNotIn(ipaddress.ip_address('10.19.136.0'), index)
+        self.assertIn(ipaddress.ip_address('2001:db8:1386::1'), index)
+        self.assertNotIn(ipaddress.ip_address('2001:db8:1387::1'), index)
+
+    def test_files_are_combined_with_settings(self):
+        self.compile()
+        index = IPRangeIndex(
+            parse_ip_ranges(['198.51.100.0/24']), files=[self.compiled_path]
+        )
+        self.assertIn(ipaddress.ip_address('198.51.100.1'), index)
+        self.assertIndexMatches(index)
+
+    def test_middleware_loads_files(self):
+        self.compile()
+        with self.settings(TURNSTILE_EXCLUDED_IPS_FILES=[self.compiled_path]):
+            middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/', REMOTE_ADDR='203.0.113.7')
+        self.assertTrue(middleware.is_ip_excluded(request))
+
+    def test_middleware_rejects_bad_files(self):
+        truncated = os.path.join(self.directory.name, 'truncated.bin')
+        self.compile()
+        with open(self.compiled_path, 'rb') as f, open(truncated, 'wb') as g:
+            g.write(f.read()[:-1])
+
+        for path in [truncated, os.path.join(self.directory.name, 'missing.txt')]:
+            with self.subTest(path=path):
+                with override_settings(TURNSTILE_EXCLUDED_IPS_FILES=[path]):
+                    with self.assertRaises(ImproperlyConfigured):
+                        TurnstileMiddleware(lambda request: HttpResponse())
@@ -0,0 +1,109 @@
+"""Tests for the verification backends."""
+
+import time
+from unittest.mock import patch
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import backends, metrics
+from django_turnstile_site_protect.views import averify_view, verify_view
+
+
+class AlwaysRaisingBackend(backends.VerificationBackend):
+    def verify(self, token, remote_ip):
+        raise ConnectionError
+
+
+@patch('django_turnstile_site_protect.client.requests.Session.post')
+class TestVerificationBackends(SimpleTestCase):
+    """Test cases for verifying tokens through each backend."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post(self, token='token'):
+        request = self.factory.post(
+            '/verify/', {'cf-turnstile-response': token, 'next': '/protected/'}
+        )
+        request.session = {}
+        return request
+
+    def assertPassed(self, request, response):
+        self.assertEqual(response.url, '/protected/')
+        self.assertTrue(request.session.get('turnstile_passed'))
+
+    def assertRejected(self, request, response):
+        self.assertIn('challenge', response.url)
+        self.assertNotIn('turnstile_passed', request.session)
+
+    @override_settings(TURNSTILE_VERIFICATION_BACKEND='always_pass')
+    def test_always_pass(self, session_post):
+        request = self.post()
+        self.assertPassed(request, verify_view(request))
+        session_post.assert_not_called()
+
+    @override_settings(TURNSTILE_VERIFICATION_BACKEND='always_fail')
+    def test_always_fail(self, session_post):
+        request = self.post()
+        self.assertRejected(request, verify_view(request))
+        session_post.assert_not_called()
+        self.assertEqual(
+            metrics.get_sink().value(
+                metrics.VERIFICATION_ERRORS, code='invalid-input-response'
+            ),
+            1,
+        )
+
+    @override_settings(TURNSTILE_VERIFICATION_BACKEND='hmac')
+    def test_hmac(self, session_post):
+        request = self.post(backends.make_hmac_token())
+        self.assertPassed(request, verify_view(request))
+
+        request = self.post(backends.make_hmac_token() + 'x')
+        self.assertRejected(request, verify_view(request))
+
+        # Signed with another secret
+        with self.settings(TURNSTILE_SECRET_KEY='other-secret'):
+            token = backends.make_hmac_token()
+        request = self.post(token)
+        self.assertRejected(request, verify_view(request))
+        session_post.assert_not_called()
+
+    @override_settings(TURNSTILE_VERIFICATION_BACKEND='hmac')
+    def test_hmac_tokens_expire(self, session_post):
+        token = backends.make_hmac_token()
+        with patch('django.core.signing.time.time', return_value=time.time() + 301):
+            result = backends.get_verification_backend().verify(token, '')
+        self.assertEqual(
+            result, {'success': False, 'error-codes': ['timeout-or-duplicate']}
+        )
+
+    @override_settings(TURNSTILE_VERIFICATION_BACKEND='hmac')
+    async def test_hmac_async(self, session_post):
+        request = self.post(backends.make_hmac_token())
+        self.assertPassed(request, await averify_view(request))
+
+    @override_settings(
+        TURNSTILE_VERIFICATION_BACKEND=(
+            'django_turnstile_site_protect.tests.test_backends.AlwaysRaisingBackend'
+        ),
+        TURNSTILE_CIRCUIT_BREAKER_THRESHOLD=1,
+    )
+    def test_custom_backend(self, session_post):
+        """Test that backend errors count towards opening the circuit breaker."""
+        request = self.post()
+        self.assertRejected(request, verify_view(request))
+
+        response = verify_view(self.post('another-token'))
+        self.assertEqual(response.status_code, 503)
+
+    def test_cloudflare_is_the_default(self, session_post):
+        session_post.return_value.status_code = 200
+        session_post.return_value.json.return_value = {'success': True}
+        request = self.post()
+
+        self.assertPassed(request, verify_view(request))
+        self.assertIsInstance(
+            backends.get_verification_backend(), backends.CloudflareBackend
+        )
+        session_post.assert_called_once()
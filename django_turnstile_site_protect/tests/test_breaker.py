@@ -0,0 +1,127 @@
+"""Tests for the verification circuit breaker."""
+
+from unittest.mock import patch
+
+import requests
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import breaker
+from django_turnstile_site_protect.breaker import CircuitBreaker
+from django_turnstile_site_protect.tests.helpers import FakeClock
+from django_turnstile_site_protect.views import verify_view
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    """Test cases for the CircuitBreaker state machine."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(threshold=3, cooldown=10, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that the circuit trips after the failure threshold."""
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow_request())
+
+        # A success resets the count of consecutive failures
+        self.breaker.record_success()
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_half_open_probe(self):
+        """Test that a single probe is allowed through after the cooldown."""
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.clock.now = 10
+        self.assertTrue(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, breaker.HALF_OPEN)
+        # Only one probe at a time
+        self.assertFalse(self.breaker.allow_request())
+
+        # A failed probe opens the circuit for another cooldown
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, breaker.OPEN)
+        self.assertFalse(self.breaker.allow_request())
+
+        # A successful probe closes it
+        self.clock.now = 20
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_lost_probe_is_replaced(self):
+        """Test that a probe that never reports back doesn't block the circuit."""
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.clock.now = 10
+        self.assertTrue(self.breaker.allow_request())
+        self.clock.now = 19
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.retry_after(), 1)
+
+        # The first probe was cancelled; another one goes through
+        self.clock.now = 20
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, breaker.CLOSED)
+
+
+@override_settings(TURNSTILE_CIRCUIT_BREAKER_THRESHOLD=2, TURNSTILE_HTTP_MAX_RETRIES=0)
+class TestVerifyViewCircuitBreaker(SimpleTestCase):
+    """Test cases for verify_view while the verification endpoint is down."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post(self):
+        request = self.factory.post(
+            '/verify/', {'cf-turnstile-response': 'test-token', 'next': '/protected/'}
+        )
+        request.session = {}
+        return request
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def trip(self, mock_post):
+        mock_post.side_effect = requests.ConnectTimeout()
+        for _ in range(2):
+            response = verify_view(self.post())
+            self.assertIn('challenge', response.url)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_fail_closed(self, mock_post):
+        """Test that an open circuit shows the unavailable page without a network call."""
+        self.trip()
+
+        request = self.post()
+        response = verify_view(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn(b'Temporarily Unavailable', response.content)
+        self.assertTrue(int(response['Retry-After']) > 0)
+        self.assertEqual(request.session, {})
+        mock_post.assert_not_called()
+
+    @override_settings(TURNSTILE_FAIL_OPEN=True)
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_fail_open(self, mock_post):
+        """Test that an open circuit lets users through when configured to."""
+        self.trip()
+
+        request = self.post()
+        response = verify_view(request)
+
+        self.assertEqual(response.url, '/protected/')
+        self.assertTrue(request.session.get('turnstile_passed'))
+        mock_post.assert_not_called()
@@ -0,0 +1,93 @@
+"""Tests for the pooled siteverify HTTP clients."""
+
+from unittest.mock import MagicMock, patch
+
+import requests
+from django.test import SimpleTestCase, override_settings
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from django_turnstile_site_protect import client
+
+
+def connection_refused():
+    reason = NewConnectionError(None, 'Connection refused')
+    return requests.ConnectionError(MaxRetryError(None, '/', reason))
+
+
+def json_response(status_code=200, payload=None):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = payload or {'success': True}
+    return response
+
+
+@override_settings(TURNSTILE_HTTP_RETRY_BACKOFF=0)
+class TestPostSiteverify(SimpleTestCase):
+    """Test cases for post_siteverify."""
+
+    def test_session_is_shared(self):
+        """Test that the keep-alive session is created once per process."""
+        self.assertIs(client.get_session(), client.get_session())
+
+    @override_settings(TURNSTILE_HTTP_CONNECT_TIMEOUT=1, TURNSTILE_HTTP_READ_TIMEOUT=2)
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_timeouts_are_applied(self, mock_post):
+        """Test that connect and read timeouts are passed to every request."""
+        mock_post.return_value = json_response()
+
+        result = client.post_siteverify('https://example.com/', {'response': 'x'})
+
+        self.assertEqual(result, {'success': True})
+        self.assertEqual(mock_post.call_args.kwargs['timeout'], (1, 2))
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_connection_errors_are_retried(self, mock_post):
+        """Test that connection failures are retried within the budget."""
+        mock_post.side_effect = [
+            connection_refused(),
+            json_response(503),
+            json_response(),
+        ]
+
+        result = client.post_siteverify('https://example.com/', {})
+
+        self.assertEqual(result, {'success': True})
+        self.assertEqual(mock_post.call_count, 3)
+
+    @override_settings(TURNSTILE_HTTP_MAX_RETRIES=1)
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_retry_budget_is_bounded(self, mock_post):
+        """Test that the last connection failure is raised once retries run out."""
+        mock_post.side_effect = requests.ConnectTimeout()
+
+        with self.assertRaises(requests.ConnectTimeout):
+            client.post_siteverify('https://example.com/', {})
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_read_timeouts_are_not_retried(self, mock_post):
+        """Test that a request which may have been processed is not repeated."""
+        mock_post.side_effect = requests.ReadTimeout()
+
+        with self.assertRaises(requests.ReadTimeout):
+            client.post_siteverify('https://example.com/', {})
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_dropped_connections_are_not_retried(self, mock_post):
+        """Test that a connection lost after sending the token is not retried."""
+        mock_post.side_effect = requests.ConnectionError(
+            ProtocolError('Connection aborted.', ConnectionResetError())
+        )
+
+        with self.assertRaises(requests.ConnectionError):
+            client.post_siteverify('https://example.com/', {})
+        self.assertEqual(mock_post.call_count, 1)
+
+    @override_settings(TURNSTILE_HTTP_MAX_RETRIES=3, TURNSTILE_HTTP_RETRY_BACKOFF=1)
+    def test_backoff_delays_are_jittered_and_bounded(self):
+        """Test that each backoff delay stays below its exponential cap."""
+        for _ in range(20):
+            delays = client.get_backoff_delays()
+            self.assertEqual(len(delays), 3)
+            for attempt, delay in enumerate(delays):
+                self.assertTrue(0 <= delay <= 2**attempt)
@@ -0,0 +1,207 @@
+"""Tests for country and ASN rules."""
+
+import ipaddress
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware, geoip, rules
+
+COUNTRIES = {
+    '203.0.113.0/24': {'country': {'iso_code': 'DE'}},
+    '198.51.100.0/24': {'country': {'iso_code': 'NL'}},
+    # Anonymous proxies only have a registered country
+    '192.0.2.0/24': {'registered_country': {'iso_code': 'US'}},
+}
+ASNS = {
+    '203.0.113.0/24': {'autonomous_system_number': 64500},
+    '198.51.100.0/24': {'autonomous_system_number': 64501},
+}
+
+
+class FakeReader:
+    """Stand-in for maxminddb.Reader over a few networks."""
+
+    def __init__(self, networks):
+        self.networks = {
+            ipaddress.ip_network(network): record
+            for network, record in networks.items()
+        }
+        self.calls = 0
+
+    def get(self, address):
+        self.calls += 1
+        for network, record in self.networks.items():
+            if address in network:
+                return record
+        return None
+
+
+def open_fake_database(path, mode):
+    return FakeReader({'country.mmdb': COUNTRIES, 'asn.mmdb': ASNS}[path])
+
+
+@patch(
+    'django_turnstile_site_protect.middleware.geoip.maxminddb.open_database',
+    open_fake_database,
+)
+@override_settings(
+    TURNSTILE_GEOIP_COUNTRY_DATABASE='country.mmdb',
+    TURNSTILE_GEOIP_ASN_DATABASE='asn.mmdb',
+)
+class TestGeoIPRules(SimpleTestCase):
+    """Test cases for GeoIP resolution and the country and ASN rules."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def decide(self, middleware, ip, session=None):
+        request = self.factory.get('/protected/', REMOTE_ADDR=ip)
+        request.session = session or {}
+        return middleware.rule_engine.decide(request)
+
+    def test_resolver(self):
+        resolver = geoip.GeoIPResolver('country.mmdb', 'asn.mmdb')
+        for ip, expected in [
+            ('203.0.113.5', ('DE', 64500)),
+            ('192.0.2.1', ('US', None)),
+            ('2001:db8::1', (None, None)),
+        ]:
+            with self.subTest(ip=ip):
+                self.assertEqual(resolver.lookup(ipaddress.ip_address(ip)), expected)
+
+    def test_recent_verdicts_are_cached(self):
+        resolver = geoip.GeoIPResolver('country.mmdb', cache_size=2)
+        address = ipaddress.ip_address('203.0.113.5')
+        for _ in range(3):
+            self.assertEqual(resolver.lookup(address), ('DE', None))
+        self.assertEqual(resolver.country_reader.calls, 1)
+
+    @override_settings(
+        TURNSTILE_EXCLUDED_ASNS=[64500], TURNSTILE_EXCLUDED_COUNTRIES=['us']
+    )
+    def test_excluded_countries_and_asns(self):
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        self.assertEqual(self.decide(middleware, '203.0.113.5'), rules.GEO)
+        self.assertEqual(self.decide(middleware, '192.0.2.1'), rules.GEO)
+        self.assertIsNone(self.decide(middleware, '198.51.100.5'))
+
+    @override_settings(
+        TURNSTILE_CHALLENGED_ASNS=[64501],
+        TURNSTILE_EXCLUDED_IPS=['198.51.100.0/24'],
+    )
+    def test_challenged_asns_skip_other_bypasses(self):
+        """Test that a challenge rule overrides later bypass rules, not the session."""
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        self.assertIsNone(self.decide(middleware, '198.51.100.5'))
+        self.assertEqual(
+            self.decide(middleware, '198.51.100.5', {middleware.session_key: True}),
+            rules.SESSION,
+        )
+        # Path exclusions come first, so the challenge page stays reachable
+        request = self.factory.get(
+            middleware.challenge_path, REMOTE_ADDR='198.51.100.5'
+        )
+        self.assertEqual(middleware.rule_engine.decide(request), rules.PATH)
+
+    @override_settings(TURNSTILE_CHALLENGED_COUNTRIES=['NL'])
+    async def test_async_challenge_rules(self):
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        request = self.factory.get('/protected/', REMOTE_ADDR='198.51.100.5')
+        request.session = {}
+
+        self.assertIsNone(await middleware.rule_engine.adecide(request))
+
+        request.session = {middleware.session_key: True}
+        self.assertEqual(await middleware.rule_engine.adecide(request), rules.SESSION)
+
+    @override_settings(
+        TURNSTILE_EXCLUDED_ASNS=[64500], TURNSTILE_CHALLENGED_COUNTRIES=['NL']
+    )
+    def test_forged_forwarded_for_is_ignored(self):
+        """Test that X-Forwarded-For neither bypasses nor escapes a geo rule."""
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        def decide(ip, forwarded_for):
+            request = self.factory.get(
+                '/protected/', REMOTE_ADDR=ip, HTTP_X_FORWARDED_FOR=forwarded_for
+            )
+            request.session = {}
+            return middleware.rule_engine.classify(request)
+
+        # A forged address in an excluded ASN doesn't bypass the challenge
+        self.assertEqual(decide('192.0.2.1', '203.0.113.5'), (None, False))
+        # A client from a challenged country can't escape with another address
+        self.assertEqual(decide('198.51.100.5', '192.0.2.1'), (None, True))
+
+        # Behind a trusted proxy, the address the proxy added is used
+        with self.settings(TURNSTILE_TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(
+                decide('10.0.0.1', '198.51.100.5, 203.0.113.5'), (rules.GEO, False)
+            )
+
+    @override_settings(
+        TURNSTILE_EXCLUDED_ASNS=[64500], TURNSTILE_CHALLENGED_COUNTRIES=['NL']
+    )
+    async def test_async_forged_forwarded_for_is_ignored(self):
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        for ip, forwarded_for, expected in [
+            ('192.0.2.1', '203.0.113.5', (None, False)),
+            ('198.51.100.5', '192.0.2.1', (None, True)),
+        ]:
+            request = self.factory.get(
+                '/protected/', REMOTE_ADDR=ip, HTTP_X_FORWARDED_FOR=forwarded_for
+            )
+            request.session = {}
+            with self.subTest(ip=ip):
+                self.assertEqual(
+                    await middleware.rule_engine.aclassify(request), expected
+                )
+
+    @override_settings(TURNSTILE_CHALLENGED_ASNS=[64500], TURNSTILE_ADAPTIVE=True)
+    def test_adaptive_mode_keeps_challenge_rules(self):
+        """Test that adaptive mode only waives challenges no rule forced."""
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        def process(ip):
+            request = self.factory.get('/protected/', REMOTE_ADDR=ip)
+            request.session = {}
+            return middleware.process_request(request)
+
+        self.assertEqual(process('203.0.113.5').status_code, 302)
+        self.assertIsNone(process('198.51.100.5'))
+
+    @override_settings(TURNSTILE_CHALLENGED_ASNS=[64500], TURNSTILE_ADAPTIVE=True)
+    async def test_async_adaptive_mode_keeps_challenge_rules(self):
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        request = self.factory.get('/protected/', REMOTE_ADDR='203.0.113.5')
+        request.session = {}
+
+        response = await middleware.aprocess_request(request)
+
+        self.assertEqual(response.status_code, 302)
+
+
+class TestGeoIPConfiguration(SimpleTestCase):
+    """Test cases for GeoIP misconfiguration."""
+
+    @override_settings(TURNSTILE_EXCLUDED_ASNS=[64500])
+    def test_rules_require_a_database(self):
+        with self.assertRaises(ImproperlyConfigured):
+            TurnstileMiddleware(lambda request: HttpResponse())
+
+    @override_settings(TURNSTILE_GEOIP_ASN_DATABASE='asn.mmdb')
+    def test_database_requires_maxminddb(self):
+        with patch.object(geoip, 'maxminddb', None):
+            with self.assertRaises(ImproperlyConfigured):
+                TurnstileMiddleware(lambda request: HttpResponse())
+
+    @override_settings(TURNSTILE_GEOIP_ASN_DATABASE='/does/not/exist.mmdb')
+    def test_missing_database(self):
+        with self.assertRaises(ImproperlyConfigured):
+            TurnstileMiddleware(lambda request: HttpResponse())
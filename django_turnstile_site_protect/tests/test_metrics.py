@@ -0,0 +1,182 @@
+"""Tests for the metrics sinks and instrumentation."""
+
+import threading
+from unittest.mock import MagicMock, patch
+
+import requests
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import metrics
+from django_turnstile_site_protect.middleware import TurnstileMiddleware
+from django_turnstile_site_protect.views import (
+    challenge_view,
+    metrics_view,
+    verify_view,
+)
+
+
+class TestInMemorySink(SimpleTestCase):
+    """Test cases for the in-memory metrics sink."""
+
+    def test_counters_are_summed_across_threads(self):
+        """Test that per-thread shards add up when collected."""
+        sink = metrics.InMemorySink()
+
+        def record():
+            for _ in range(1000):
+                sink.increment('hits_total', reason='ip')
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sink.increment('hits_total', reason='path')
+
+        self.assertEqual(sink.value('hits_total', reason='ip'), 4000)
+        self.assertEqual(sink.value('hits_total', reason='path'), 1)
+        self.assertEqual(sink.value('hits_total', reason='session'), 0)
+
+    def test_shards_of_exited_threads_are_merged(self):
+        """Test that short-lived threads don't leave a shard each behind."""
+        sink = metrics.InMemorySink(buckets=(1,))
+
+        def record():
+            sink.increment('hits_total')
+            sink.observe('latency_seconds', 0.5)
+
+        for _ in range(10):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+
+        counters, histograms = sink.collect()
+        self.assertEqual(counters[('hits_total', ())], 10)
+        self.assertEqual(histograms[('latency_seconds', ())], ([10, 10], 10, 5.0))
+        self.assertEqual(sink._shards, [])
+
+        sink.reset()
+        self.assertEqual(sink.collect(), ({}, {}))
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that observations land in the first bucket that holds them."""
+        sink = metrics.InMemorySink(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            sink.observe('latency_seconds', value)
+
+        counts, count, total = sink.collect()[1][('latency_seconds', ())]
+
+        self.assertEqual(counts, [2, 3, 4])
+        self.assertEqual(count, 4)
+        self.assertAlmostEqual(total, 2.65)
+
+    def test_reset(self):
+        sink = metrics.InMemorySink()
+        sink.increment('hits_total')
+        sink.reset()
+        self.assertEqual(sink.collect(), ({}, {}))
+
+    def test_prometheus_exposition(self):
+        """Test the text exposition of counters and histograms."""
+        sink = metrics.InMemorySink(buckets=(0.5,))
+        sink.increment(metrics.DECISIONS, reason='challenge')
+        sink.increment(metrics.VERIFICATION_ERRORS, code='bad "code"')
+        sink.observe(metrics.SITEVERIFY_SECONDS, 0.25)
+
+        text = metrics.render_prometheus(sink)
+
+        self.assertIn('# TYPE turnstile_decisions_total counter\n', text)
+        self.assertIn('turnstile_decisions_total{reason="challenge"} 1\n', text)
+        self.assertIn(
+            'turnstile_verification_errors_total{code="bad \\"code\\""} 1\n', text
+        )
+        self.assertIn('# TYPE turnstile_siteverify_duration_seconds histogram', text)
+        self.assertIn(
+            'turnstile_siteverify_duration_seconds_bucket{le="0.5"} 1\n', text
+        )
+        self.assertIn(
+            'turnstile_siteverify_duration_seconds_bucket{le="+Inf"} 1\n', text
+        )
+        self.assertIn('turnstile_siteverify_duration_seconds_sum 0.25\n', text)
+        self.assertIn('turnstile_siteverify_duration_seconds_count 1\n', text)
+
+    @override_settings(TURNSTILE_METRICS_SINK=None)
+    def test_sink_can_be_disabled(self):
+        self.assertIsInstance(metrics.get_sink(), metrics.NullSink)
+        metrics.increment(metrics.DECISIONS, reason='ip')
+        self.assertEqual(metrics.render_prometheus(), '')
+
+
+class TestInstrumentation(SimpleTestCase):
+    """Test that the middleware and views record metrics."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.sink = metrics.get_sink()
+
+    def test_middleware_decisions(self):
+        """Test that decisions are counted by the reason that decided them."""
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        for path, session in (
+            ('/excluded/path/', {}),
+            ('/protected/', {middleware.session_key: True}),
+            ('/protected/', {}),
+        ):
+            request = self.factory.get(path)
+            request.session = session
+            middleware.process_request(request)
+
+        self.assertEqual(self.sink.value(metrics.DECISIONS, reason='path'), 1)
+        self.assertEqual(self.sink.value(metrics.DECISIONS, reason='session'), 1)
+        self.assertEqual(self.sink.value(metrics.DECISIONS, reason='challenge'), 1)
+
+    def test_challenge_renders(self):
+        challenge_view(self.factory.get('/challenge/'))
+        self.assertEqual(self.sink.value(metrics.CHALLENGE_RENDERS, status=200), 1)
+
+    def verify(self):
+        request = self.factory.post('/verify/', {'cf-turnstile-response': 'token'})
+        request.session = SessionStore()
+        return verify_view(request)
+
+    @override_settings(TURNSTILE_REPLAY_CACHE=None)
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_verification_outcomes(self, mock_post):
+        """Test that outcomes, error codes and upstream latency are recorded."""
+        mock_post.return_value = MagicMock(status_code=200)
+        mock_post.return_value.json.side_effect = [
+            {'success': True},
+            {'success': False, 'error-codes': ['invalid-input-response']},
+        ]
+        self.verify()
+        self.verify()
+
+        self.assertEqual(self.sink.value(metrics.VERIFICATIONS, outcome='success'), 1)
+        self.assertEqual(self.sink.value(metrics.VERIFICATIONS, outcome='failure'), 1)
+        self.assertEqual(
+            self.sink.value(metrics.VERIFICATION_ERRORS, code='invalid-input-response'),
+            1,
+        )
+        _, count, _ = self.sink.collect()[1][(metrics.SITEVERIFY_SECONDS, ())]
+        self.assertEqual(count, 2)
+
+    @override_settings(TURNSTILE_HTTP_MAX_RETRIES=0)
+    @patch(
+        'django_turnstile_site_protect.client.requests.Session.post',
+        side_effect=requests.ConnectionError(),
+    )
+    def test_verification_errors(self, mock_post):
+        self.verify()
+        self.assertEqual(self.sink.value(metrics.VERIFICATIONS, outcome='error'), 1)
+
+    def test_metrics_view(self):
+        metrics.increment(metrics.DECISIONS, reason='ip')
+
+        response = metrics_view(self.factory.get('/metrics/'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'turnstile_decisions_total{reason="ip"} 1', response.content)
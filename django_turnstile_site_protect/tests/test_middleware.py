@@ -1,11 +1,20 @@
 """Tests for the TurnstileMiddleware class."""
 
-from unittest.mock import patch
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
 
+from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponse
-from django.test import RequestFactory, TestCase, override_settings
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
 
 from django_turnstile_site_protect.middleware import TurnstileMiddleware
+from django_turnstile_site_protect.middleware.paths import PathMatcher
+from django_turnstile_site_protect.pass_cookie import set_pass_cookie
 
 
 class TestTurnstileMiddleware(TestCase):
@@ -33,8 +42,6 @@ class TestTurnstileMiddleware(TestCase):
             'TURNSTILE_CHALLENGE_PATH': '/challenge/',
             'TURNSTILE_EXCLUDED_PATHS': ['/challenge/', '/verify/'],
             'TURNSTILE_EXCLUDED_IPS': [
-                # Note: The middleware only supports single IPs and range format (X.X.X.X-Y.Y.Y.Y)
-                # Converting CIDR to range format for testing:
                 '192.168.1.0-192.168.1.255',  # 192.168.1.0/24 in range format
                 '10.0.0.0-10.255.255.255',  # 10.0.0.0/8 in range format
                 '203.0.112.0-203.0.113.255',  # Already in range format
@@ -76,6 +83,58 @@ class TestTurnstileMiddleware(TestCase):
             middleware = TurnstileMiddleware(self.get_response)
             self.assertTrue(middleware.is_path_excluded('/api/'))
 
+    def test_path_matcher_reports_matching_rule(self):
+        """Test that the combined path matcher reports which rule matched."""
+        excluded_paths = [
+            '/static/',
+            '^/media/',
+            r'^/(en|fr)/admin/',
+            r'^/api/v\d+/',
+            r'^/blog/(?P<year>\d{4})/',
+            r'.*\.xml$',
+        ]
+
+        with self.settings(TURNSTILE_EXCLUDED_PATHS=excluded_paths):
+            middleware = TurnstileMiddleware(self.get_response)
+
+        test_cases = [
+            ('/static/css/site.css', '/static/'),
+            ('/media/photo.jpg', '^/media/'),
+            ('/api/v2/items/', r'^/api/v\d+/'),
+            ('/sitemap.xml', r'.*\.xml$'),
+            ('/fr/admin/users/', r'^/(en|fr)/admin/'),
+            ('/blog/2024/post/', r'^/blog/(?P<year>\d{4})/'),
+            (middleware.challenge_path, middleware.challenge_path),
+            ('/api/latest/', None),
+            ('/staticfiles/', None),
+        ]
+        for path, rule in test_cases:
+            with self.subTest(path=path, rule=rule):
+                self.assertEqual(middleware.path_matcher.match(path), rule)
+                self.assertEqual(middleware.is_path_excluded(path), rule is not None)
+
+    def test_path_matcher_falls_back_for_uncombinable_patterns(self):
+        """Test that patterns which cannot share one regex are still matched."""
+        excluded_paths = [r'^/(a)\1/', '(?i)^/ADMIN/']
+
+        with self.settings(TURNSTILE_EXCLUDED_PATHS=excluded_paths):
+            middleware = TurnstileMiddleware(self.get_response)
+
+        self.assertEqual(middleware.path_matcher.match('/aa/'), r'^/(a)\1/')
+        self.assertEqual(middleware.path_matcher.match('/admin/'), '(?i)^/ADMIN/')
+        self.assertIsNone(middleware.path_matcher.match('/ab/'))
+
+    def test_path_matcher_falls_back_for_conditional_groups(self):
+        """Test that conditional group references keep their group numbers."""
+        numbered = r'^/(a)?(?(1)b|c)x'
+        named = r'^/(?P<v>v)?(?(v)w|y)z'
+        matcher = PathMatcher([r'^/z(q)?', numbered, named])
+
+        self.assertEqual(matcher.match('/abx'), numbered)
+        self.assertEqual(matcher.match('/cx'), numbered)
+        self.assertEqual(matcher.match('/vwz'), named)
+        self.assertIsNone(matcher.match('/acx'))
+
     def test_is_ip_excluded(self):
         """Test IP exclusion logic."""
         # List of IPs to test with their expected exclusion results
@@ -105,6 +164,69 @@ class TestTurnstileMiddleware(TestCase):
                     request = self.get_request(REMOTE_ADDR=ip)
                     self.assertEqual(test_middleware.is_ip_excluded(request), expected)
 
+    def test_is_ip_excluded_cidr_and_ipv6(self):
+        """Test IP exclusion with CIDR networks and IPv6 addresses."""
+        test_cases = [
+            ('172.16.5.4', True),  # In 172.16.0.0/12
+            ('172.32.0.1', False),  # Just past 172.16.0.0/12
+            ('::1', True),  # IPv6 localhost
+            ('2001:db8::1234', True),  # In 2001:db8::/32
+            ('2001:db9::1', False),  # Outside 2001:db8::/32
+            ('::ffff:172.16.0.1', True),  # IPv4-mapped IPv6 address
+            ('not-an-ip', False),  # Invalid addresses are never excluded
+        ]
+
+        excluded_ips = ['172.16.0.0/12', '::1', '2001:db8::/32']
+
+        with self.settings(TURNSTILE_EXCLUDED_IPS=excluded_ips):
+            test_middleware = TurnstileMiddleware(self.get_response)
+
+            for ip, expected in test_cases:
+                with self.subTest(ip=ip, expected=expected):
+                    request = self.get_request(REMOTE_ADDR=ip)
+                    self.assertEqual(test_middleware.is_ip_excluded(request), expected)
+
+    def test_is_ip_excluded_ignores_forged_forwarded_for(self):
+        """Test that X-Forwarded-For only counts behind trusted proxies."""
+        with self.settings(TURNSTILE_EXCLUDED_IPS=['192.168.1.0/24']):
+            test_middleware = TurnstileMiddleware(self.get_response)
+
+            request = self.get_request(
+                REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='192.168.1.1'
+            )
+            self.assertFalse(test_middleware.is_ip_excluded(request))
+
+            request = self.get_request(
+                REMOTE_ADDR='10.0.0.1',
+                HTTP_X_FORWARDED_FOR='203.0.113.5, 192.168.1.1',
+            )
+            with self.settings(TURNSTILE_TRUSTED_PROXY_COUNT=1):
+                self.assertTrue(test_middleware.is_ip_excluded(request))
+
+    def test_ip_ranges_are_merged(self):
+        """Test that overlapping and adjacent IP ranges are merged at startup."""
+        excluded_ips = [
+            '10.0.0.0-10.0.0.255',
+            '10.0.0.128/25',  # Contained in the range above
+            '10.0.1.0-10.0.1.255',  # Adjacent to the first range
+            '10.0.3.0/24',  # Disjoint
+            'invalid-ip-range',
+        ]
+
+        with self.settings(TURNSTILE_EXCLUDED_IPS=excluded_ips):
+            test_middleware = TurnstileMiddleware(self.get_response)
+
+        self.assertEqual(len(test_middleware.ip_ranges), 2)
+        for ip, expected in [
+            ('10.0.1.200', True),
+            ('10.0.2.1', False),
+            ('10.0.3.255', True),
+            ('9.255.255.255', False),
+        ]:
+            with self.subTest(ip=ip, expected=expected):
+                request = self.get_request(REMOTE_ADDR=ip)
+                self.assertEqual(test_middleware.is_ip_excluded(request), expected)
+
     def test_is_domain_excluded(self):
         """Test domain exclusion logic."""
         test_cases = [
@@ -119,6 +241,30 @@ class TestTurnstileMiddleware(TestCase):
                 request = self.get_request(HTTP_HOST=host)
                 assert self.middleware.is_domain_excluded(request) == expected
 
+    def test_is_domain_excluded_normalizes_hosts(self):
+        """Test domain exclusion with mixed case, ports, IDNA and deep wildcards."""
+        excluded_domains = [
+            'Intranet.Example.org',
+            '*.internal.example.org',
+            'bücher.de',
+        ]
+
+        with self.settings(TURNSTILE_EXCLUDED_DOMAINS=excluded_domains):
+            middleware = TurnstileMiddleware(self.get_response)
+
+        test_cases = [
+            ('INTRANET.example.org:8000', True),  # Case and port are ignored
+            ('a.b.internal.example.org', True),  # Any depth of subdomain
+            ('internal.example.org', False),  # Wildcards don't match the apex
+            ('xinternal.example.org', False),  # Not a proper subdomain
+            ('xn--bcher-kva.de', True),  # Punycode form of bücher.de
+            ('example.org', False),
+        ]
+        for host, expected in test_cases:
+            with self.subTest(host=host, expected=expected):
+                request = self.get_request(HTTP_HOST=host)
+                self.assertEqual(middleware.is_domain_excluded(request), expected)
+
     def test_process_request_redirects_to_challenge(self):
         """Test that unverified requests are redirected to challenge."""
         # Create a request with an empty session
@@ -142,6 +288,153 @@ class TestTurnstileMiddleware(TestCase):
         # Middleware allows the request to continue
         self.assertIsNone(response)
 
+    @override_settings(TURNSTILE_PASS_COOKIE=True)
+    def test_process_request_with_signed_pass_cookie(self):
+        """Test that a signed pass cookie is accepted without touching the session."""
+        middleware = TurnstileMiddleware(self.get_response)
+        cookie_name = middleware.pass_store.cookie_name
+
+        response = HttpResponse()
+        set_pass_cookie(response)
+        cookie = response.cookies[cookie_name].value
+
+        # The session would raise if the middleware tried to read it
+        request = self.factory.get('/')
+        request.session = MagicMock(get=MagicMock(side_effect=AssertionError))
+        request.COOKIES[cookie_name] = cookie
+        with patch.object(middleware, 'enabled', True):
+            self.assertIsNone(middleware.process_request(request))
+
+            # A tampered cookie is rejected
+            request = self.get_request()
+            request.COOKIES[cookie_name] = cookie[:-1] + 'x'
+            response = middleware.process_request(request)
+            self.assertEqual(response.status_code, 302)
+
+            # So is an expired one
+            request = self.get_request()
+            request.COOKIES[cookie_name] = cookie
+            with patch.object(middleware.pass_store, 'max_age', -1):
+                response = middleware.process_request(request)
+            self.assertEqual(response.status_code, 302)
+
+    async def test_async_middleware_redirects_to_challenge(self):
+        """Test that the async path redirects unverified requests."""
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = TurnstileMiddleware(get_response)
+        request = AsyncRequestFactory().get('/protected/')
+        request.session = {}
+
+        with patch.object(middleware, 'enabled', True), patch(
+            'django.utils.deprecation.sync_to_async', side_effect=AssertionError
+        ):
+            response = await middleware(request)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/challenge/'))
+
+    async def test_async_middleware_uses_async_session_access(self):
+        """Test that the async path reads the session with aget when available."""
+
+        async def get_response(request):
+            return HttpResponse('protected content')
+
+        middleware = TurnstileMiddleware(get_response)
+        request = AsyncRequestFactory().get('/protected/')
+        request.session = MagicMock(
+            get=MagicMock(side_effect=AssertionError),
+            aget=AsyncMock(return_value=True),
+        )
+
+        with patch.object(middleware, 'enabled', True):
+            response = await middleware(request)
+
+        self.assertEqual(response.content, b'protected content')
+        request.session.aget.assert_awaited_once_with(middleware.session_key)
+
+    @override_settings(TURNSTILE_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        """Test that the decision and its cost are reported when enabled."""
+
+        def get_response(request):
+            return HttpResponse(headers={'Server-Timing': 'db;dur=5'})
+
+        middleware = TurnstileMiddleware(get_response)
+
+        with patch.object(middleware, 'enabled', True):
+            response = middleware(self.get_request(REMOTE_ADDR='192.168.1.1'))
+            self.assertRegex(
+                response['Server-Timing'],
+                r'^db;dur=5, turnstile;dur=\d+\.\d{3};desc="ip"$',
+            )
+
+            response = middleware(self.get_request('/protected/'))
+            self.assertIn('desc="challenge"', response['Server-Timing'])
+
+        # Off by default
+        with patch.object(self.middleware, 'enabled', True):
+            response = self.middleware(self.get_request('/protected/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(TURNSTILE_SERVER_TIMING=True)
+    async def test_async_server_timing_header(self):
+        """Test that the async path reports the decision too."""
+
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = TurnstileMiddleware(get_response)
+        request = AsyncRequestFactory().get('/protected/')
+        request.session = {middleware.session_key: True}
+
+        with patch.object(middleware, 'enabled', True):
+            response = await middleware(request)
+
+        self.assertIn('desc="session"', response['Server-Timing'])
+
+    def test_in_memory_rules_skip_session_lookup(self):
+        """Test that IP and domain bypasses are decided before the session is read."""
+        request = self.get_request(REMOTE_ADDR='192.168.1.1')
+        request.session = MagicMock(get=MagicMock(side_effect=AssertionError))
+
+        with patch.object(self.middleware, 'enabled', True):
+            self.assertIsNone(self.middleware.process_request(request))
+
+            request = self.get_request(HTTP_HOST='example.com')
+            request.session = MagicMock(get=MagicMock(side_effect=AssertionError))
+            self.assertIsNone(self.middleware.process_request(request))
+
+            # Requests no rule applies to still read the session
+            request = self.get_request(REMOTE_ADDR='172.16.0.1')
+            request.session = {self.middleware.session_key: True}
+            self.assertIsNone(self.middleware.process_request(request))
+
+        self.assertEqual(self.middleware.lookups_avoided, 2)
+
+    @override_settings(TURNSTILE_CHECK_ORDER=['path', 'session', 'ip', 'domain'])
+    def test_custom_check_order(self):
+        """Test that the check order can be overridden."""
+        middleware = TurnstileMiddleware(self.get_response)
+        request = self.get_request(REMOTE_ADDR='192.168.1.1')
+        request.session = MagicMock(get=MagicMock(return_value=False))
+
+        with patch.object(middleware, 'enabled', True):
+            self.assertIsNone(middleware.process_request(request))
+
+        request.session.get.assert_called_once_with(middleware.session_key)
+        self.assertEqual(middleware.lookups_avoided, 0)
+
+    def test_invalid_check_order(self):
+        """Test that an invalid check order is rejected at startup."""
+        for order in [['path', 'ip', 'domain'], ['path', 'session', 'referer']]:
+            with self.subTest(order=order):
+                with self.settings(TURNSTILE_CHECK_ORDER=order):
+                    with self.assertRaises(ImproperlyConfigured):
+                        TurnstileMiddleware(self.get_response)
+
     @override_settings(TURNSTILE_ENABLED=False)
     @patch.dict('os.environ', {'TURNSTILE_ENABLED': 'False'})
     def test_middleware_disabled_by_environment(self):
@@ -249,3 +542,55 @@ class TestTurnstileMiddleware(TestCase):
 
                 # The middleware should handle invalid IP ranges gracefully
                 self.assertFalse(middleware.is_ip_excluded(request))
+
+    @override_settings(TURNSTILE_LIGHTWEIGHT_CHALLENGES=True)
+    def test_lightweight_challenges(self):
+        """Test that only navigations are redirected to the challenge page."""
+        middleware = TurnstileMiddleware(self.get_response)
+        challenge_url = f'{middleware.challenge_path}?next=/protected/'
+
+        for headers, status, is_json in [
+            ({'HTTP_SEC_FETCH_MODE': 'navigate'}, 302, False),
+            ({'HTTP_ACCEPT': 'text/html,application/xhtml+xml,*/*;q=0.8'}, 302, False),
+            ({}, 302, False),
+            ({'HTTP_SEC_FETCH_MODE': 'cors'}, 403, True),
+            ({'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}, 403, True),
+            ({'HTTP_ACCEPT': 'application/json'}, 403, True),
+            ({'HTTP_SEC_FETCH_DEST': 'image'}, 403, False),
+            ({'HTTP_ACCEPT': 'image/avif,image/webp,*/*'}, 403, False),
+        ]:
+            with self.subTest(headers=headers):
+                request = self.get_request('/protected/', **headers)
+                response = middleware.process_request(request)
+
+                self.assertEqual(response.status_code, status)
+                if status == 302:
+                    self.assertEqual(response.url, challenge_url)
+                    continue
+                self.assertEqual(response['X-Turnstile-Challenge-URL'], challenge_url)
+                self.assertIn('Sec-Fetch-Mode', response['Vary'])
+                if is_json:
+                    self.assertEqual(response['Content-Type'], 'application/json')
+                    self.assertEqual(
+                        json.loads(response.content)['challenge_url'],
+                        middleware.challenge_path,
+                    )
+                else:
+                    self.assertEqual(response.content, b'')
+
+    @override_settings(
+        TURNSTILE_LIGHTWEIGHT_CHALLENGES=True,
+        TURNSTILE_LIGHTWEIGHT_CHALLENGE_STATUS=401,
+    )
+    def test_lightweight_challenge_status(self):
+        middleware = TurnstileMiddleware(self.get_response)
+        request = self.get_request('/protected/', HTTP_SEC_FETCH_DEST='font')
+
+        response = middleware.process_request(request)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Turnstile')
+
+    def test_lightweight_challenges_are_opt_in(self):
+        request = self.get_request('/protected/', HTTP_SEC_FETCH_MODE='cors')
+        self.assertEqual(self.middleware.process_request(request).status_code, 302)
@@ -0,0 +1,187 @@
+"""Tests for the pass stores."""
+
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import pass_store
+from django_turnstile_site_protect.middleware import TurnstileMiddleware
+from django_turnstile_site_protect.tests.helpers import FakeClock
+from django_turnstile_site_protect.views import averify_view, verify_view
+
+
+def with_cookies(request, response):
+    """Send the cookies set on a response back with a request."""
+    for name, morsel in response.cookies.items():
+        request.COOKIES[name] = morsel.value
+    return request
+
+
+class TestGetPassStore(SimpleTestCase):
+    """Test cases for selecting the pass store."""
+
+    def test_default_store_is_the_session(self):
+        store = pass_store.get_pass_store()
+        self.assertIsInstance(store, pass_store.SessionPassStore)
+        self.assertIs(store, pass_store.get_pass_store())
+
+    @override_settings(TURNSTILE_PASS_COOKIE=True)
+    def test_pass_cookie_setting_selects_the_cookie_store(self):
+        self.assertIsInstance(
+            pass_store.get_pass_store(), pass_store.SignedCookiePassStore
+        )
+
+    def test_store_by_name_or_path(self):
+        for name, store_class in [
+            ('cache', pass_store.CachePassStore),
+            ('memory', pass_store.MemoryPassStore),
+            (
+                'django_turnstile_site_protect.pass_store.MemoryPassStore',
+                pass_store.MemoryPassStore,
+            ),
+        ]:
+            with self.subTest(name=name), self.settings(TURNSTILE_PASS_STORE=name):
+                self.assertIsInstance(pass_store.get_pass_store(), store_class)
+
+    @override_settings(TURNSTILE_PASS_STORE='memory', TURNSTILE_PASS_STORE_KEY='ip')
+    def test_invalid_key_source(self):
+        with self.assertRaises(ImproperlyConfigured):
+            pass_store.get_pass_store()
+
+
+@override_settings(TURNSTILE_PASS_STORE='memory')
+class TestMemoryPassStore(SimpleTestCase):
+    """Test cases for the in-process LRU store."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.clock = FakeClock()
+
+    def test_clients_are_remembered_by_cookie(self):
+        """Test that a verified client is recognized by its client id cookie."""
+        store = pass_store.MemoryPassStore(clock=self.clock)
+        request = self.factory.get('/')
+        self.assertFalse(store.has_passed(request))
+
+        response = store.mark_passed(request, HttpResponse())
+
+        self.assertTrue(store.has_passed(with_cookies(self.factory.get('/'), response)))
+        self.assertFalse(store.has_passed(self.factory.get('/')))
+
+        # A forged client id is rejected
+        forged = self.factory.get('/')
+        forged.COOKIES[store.cookie_name] = 'forged'
+        self.assertFalse(store.has_passed(forged))
+
+    def test_entries_expire(self):
+        with self.settings(TURNSTILE_PASS_COOKIE_AGE=60):
+            store = pass_store.MemoryPassStore(clock=self.clock)
+        store.set('client')
+
+        self.clock.now = 59
+        self.assertTrue(store.get('client'))
+        self.clock.now = 60
+        self.assertFalse(store.get('client'))
+        self.assertEqual(len(store), 0)
+
+    @override_settings(TURNSTILE_PASS_STORE_MAX_ENTRIES=2)
+    def test_least_recently_seen_client_is_evicted(self):
+        """Test that memory stays bounded and recently seen clients survive."""
+        store = pass_store.MemoryPassStore(clock=self.clock)
+        store.set('a')
+        store.set('b')
+        self.assertTrue(store.get('a'))
+
+        store.set('c')
+
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.get('a'))
+        self.assertFalse(store.get('b'))
+        self.assertTrue(store.get('c'))
+
+    @override_settings(TURNSTILE_PASS_STORE_KEY='fingerprint')
+    def test_clients_are_remembered_by_fingerprint(self):
+        """Test that fingerprinting needs no cookie."""
+        store = pass_store.MemoryPassStore(clock=self.clock)
+        request = self.factory.get(
+            '/', REMOTE_ADDR='203.0.113.5', HTTP_USER_AGENT='Browser'
+        )
+
+        response = store.mark_passed(request, HttpResponse())
+
+        self.assertEqual(len(response.cookies), 0)
+        self.assertTrue(
+            store.has_passed(
+                self.factory.get(
+                    '/', REMOTE_ADDR='203.0.113.5', HTTP_USER_AGENT='Browser'
+                )
+            )
+        )
+        self.assertFalse(
+            store.has_passed(
+                self.factory.get('/', REMOTE_ADDR='203.0.113.5', HTTP_USER_AGENT='Bot')
+            )
+        )
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_verify_then_middleware(self, mock_post):
+        """Test that the middleware recognizes clients verified by the view."""
+        mock_post.return_value.json.return_value = {'success': True}
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+        # The session would raise if anything touched it
+        session = MagicMock(
+            get=MagicMock(side_effect=AssertionError),
+            __setitem__=MagicMock(side_effect=AssertionError),
+        )
+        request = self.factory.post('/verify/', {'cf-turnstile-response': 'token'})
+        request.session = session
+        response = verify_view(request)
+
+        request = with_cookies(self.factory.get('/protected/'), response)
+        request.session = session
+        with patch.object(middleware, 'enabled', True):
+            self.assertIsNone(middleware.process_request(request))
+
+
+@override_settings(TURNSTILE_PASS_STORE='cache')
+class TestCachePassStore(SimpleTestCase):
+    """Test cases for the Django cache store."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def test_clients_are_stored_with_a_ttl(self):
+        store = pass_store.get_pass_store()
+        response = store.mark_passed(self.factory.get('/'), HttpResponse())
+        request = with_cookies(self.factory.get('/'), response)
+
+        self.assertTrue(store.has_passed(request))
+        key = store.get_key(request)
+        self.assertTrue(cache.get(store.prefix + key))
+
+        cache.delete(store.prefix + key)
+        self.assertFalse(store.has_passed(request))
+
+    async def test_async_verify_then_middleware(self):
+        """Test the async paths through the cache store."""
+
+        async def get_response(request):
+            return HttpResponse('protected content')
+
+        middleware = TurnstileMiddleware(get_response)
+        request = self.factory.post('/verify/', {'cf-turnstile-response': 'token'})
+        with patch(
+            'django_turnstile_site_protect.backends.apost_siteverify',
+            return_value={'success': True},
+        ):
+            response = await averify_view(request)
+
+        request = with_cookies(self.factory.get('/protected/'), response)
+        with patch.object(middleware, 'enabled', True):
+            response = await middleware(request)
+        self.assertEqual(response.content, b'protected content')
@@ -0,0 +1,170 @@
+"""Tests for the challenge and verify rate limits."""
+
+import ipaddress
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import metrics, ratelimit
+from django_turnstile_site_protect.tests.helpers import FakeClock
+from django_turnstile_site_protect.views import (
+    averify_view,
+    challenge_view,
+    verify_view,
+)
+
+
+def ip(address):
+    return ipaddress.ip_address(address)
+
+
+class TestRateLimiter(SimpleTestCase):
+    """Test cases for the sliding window rate limiters."""
+
+    def test_limit_per_ip(self):
+        clock = FakeClock(6000.0)
+        limiter = ratelimit.MemoryRateLimiter(limit=3, window=60, clock=clock)
+
+        for _ in range(3):
+            self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertEqual(limiter.check(ip('203.0.113.5')), 60)
+        # Other clients have their own counters
+        self.assertIsNone(limiter.check(ip('203.0.113.6')))
+
+    def test_window_slides(self):
+        """Test that the previous window's count fades out over the next window."""
+        clock = FakeClock(6000.0)
+        limiter = ratelimit.MemoryRateLimiter(limit=4, window=60, clock=clock)
+        for _ in range(4):
+            limiter.check(ip('203.0.113.5'))
+
+        # Halfway through the next window, half of the previous count remains
+        clock.now += 90
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertEqual(limiter.check(ip('203.0.113.5')), 15)
+
+        # Two windows later, nothing remains
+        clock.now += 120
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+
+    def test_limit_per_subnet(self):
+        limiter = ratelimit.MemoryRateLimiter(subnet_limit=2, clock=FakeClock(6000.0))
+
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertIsNone(limiter.check(ip('203.0.113.6')))
+        self.assertIsNotNone(limiter.check(ip('203.0.113.7')))
+        self.assertIsNone(limiter.check(ip('198.51.100.1')))
+
+        # IPv6 clients are grouped by /64
+        self.assertIsNone(limiter.check(ip('2001:db8::1')))
+        self.assertIsNone(limiter.check(ip('2001:db8::ffff:1')))
+        self.assertIsNotNone(limiter.check(ip('2001:db8::2')))
+        self.assertIsNone(limiter.check(ip('2001:db8:0:1::1')))
+
+    def test_invalid_ip_is_not_limited(self):
+        limiter = ratelimit.MemoryRateLimiter(limit=1, clock=FakeClock(6000.0))
+        for _ in range(3):
+            self.assertIsNone(limiter.check(None))
+
+    @override_settings(TURNSTILE_RATE_LIMIT_MAX_ENTRIES=2)
+    def test_memory_limiter_is_bounded(self):
+        limiter = ratelimit.MemoryRateLimiter(limit=5, clock=FakeClock(6000.0))
+        for address in ('203.0.113.1', '203.0.113.2', '203.0.113.3'):
+            limiter.check(ip(address))
+        self.assertEqual(len(limiter), 2)
+
+    def test_cache_limiter(self):
+        cache.clear()
+        clock = FakeClock(6000.0)
+        limiter = ratelimit.CacheRateLimiter(limit=2, clock=clock)
+
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertIsNone(limiter.check(ip('203.0.113.5')))
+        self.assertIsNotNone(limiter.check(ip('203.0.113.5')))
+
+        # Another process shares the counters
+        other = ratelimit.CacheRateLimiter(limit=2, clock=clock)
+        self.assertIsNotNone(other.check(ip('203.0.113.5')))
+
+    async def test_cache_limiter_async(self):
+        cache.clear()
+        limiter = ratelimit.CacheRateLimiter(limit=1, clock=FakeClock(6000.0))
+
+        self.assertIsNone(await limiter.acheck(ip('203.0.113.5')))
+        self.assertIsNotNone(await limiter.acheck(ip('203.0.113.5')))
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(ratelimit.get_rate_limiter())
+
+    @override_settings(TURNSTILE_RATE_LIMIT=10, TURNSTILE_RATE_LIMIT_WINDOW=0)
+    def test_invalid_window(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ratelimit.get_rate_limiter()
+
+
+@override_settings(TURNSTILE_RATE_LIMIT=1)
+class TestRateLimitedViews(SimpleTestCase):
+    """Test cases for rate limiting in the challenge and verify views."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_challenge_view(self):
+        challenge_view(self.factory.get('/challenge/'))
+
+        with patch('django_turnstile_site_protect.views.render_to_string') as render:
+            response = challenge_view(self.factory.get('/challenge/'))
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        render.assert_not_called()
+        self.assertEqual(
+            metrics.get_sink().value(metrics.RATE_LIMITED, view='challenge'), 1
+        )
+
+    @patch('django_turnstile_site_protect.backends.post_siteverify')
+    def test_verify_view(self, post_siteverify):
+        post_siteverify.return_value = {'success': False}
+        data = {'cf-turnstile-response': 'token'}
+        for _ in range(2):
+            response = verify_view(self.factory.post('/verify/', data))
+
+        self.assertEqual(response.status_code, 429)
+        post_siteverify.assert_called_once()
+
+    @patch('django_turnstile_site_protect.backends.apost_siteverify')
+    async def test_async_verify_view(self, apost_siteverify):
+        apost_siteverify.return_value = {'success': False}
+        data = {'cf-turnstile-response': 'token'}
+        for _ in range(2):
+            response = await averify_view(self.factory.post('/verify/', data))
+
+        self.assertEqual(response.status_code, 429)
+        apost_siteverify.assert_called_once()
+
+    def test_forged_forwarded_for_is_ignored(self):
+        challenge_view(
+            self.factory.get('/challenge/', HTTP_X_FORWARDED_FOR='192.0.2.1')
+        )
+        response = challenge_view(
+            self.factory.get('/challenge/', HTTP_X_FORWARDED_FOR='192.0.2.2')
+        )
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(TURNSTILE_TRUSTED_PROXY_COUNT=1)
+    def test_trusted_proxy(self):
+        def get(forwarded_for):
+            request = self.factory.get(
+                '/challenge/',
+                HTTP_X_FORWARDED_FOR=forwarded_for,
+                REMOTE_ADDR='10.0.0.1',
+            )
+            return challenge_view(request).status_code
+
+        self.assertEqual(get('192.0.2.1, 203.0.113.5'), 200)
+        # Only the entry added by the proxy counts
+        self.assertEqual(get('192.0.2.2, 203.0.113.5'), 429)
+        self.assertEqual(get('203.0.113.6'), 200)
@@ -0,0 +1,133 @@
+"""Tests for hot-reloadable rules files."""
+
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware
+
+
+class TestRulesFile(SimpleTestCase):
+    """Test cases for TURNSTILE_RULES_FILE."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rules.json')
+        self.writes = 0
+        self.write({'TURNSTILE_EXCLUDED_IPS': ['203.0.113.0/24']})
+
+    def write(self, rules):
+        with open(self.path, 'w') as f:
+            json.dump(rules, f)
+        # Make sure every write changes the modification time
+        self.writes += 1
+        stamp = time.time_ns() + self.writes * 1_000_000
+        os.utime(self.path, ns=(stamp, stamp))
+
+    def middleware(self, interval=3600):
+        with self.settings(
+            TURNSTILE_RULES_FILE=self.path, TURNSTILE_RULES_RELOAD_INTERVAL=interval
+        ):
+            middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        if middleware.rules_watcher:
+            self.addCleanup(middleware.rules_watcher.stop)
+        return middleware
+
+    def decide(self, middleware, **extra):
+        request = self.factory.get('/protected/', **extra)
+        request.session = {}
+        return middleware.rule_engine.decide(request)
+
+    def test_file_overrides_settings(self):
+        """Test that file values replace settings and other settings still apply."""
+        middleware = self.middleware()
+
+        self.assertEqual(self.decide(middleware, REMOTE_ADDR='203.0.113.9'), 'ip')
+        # TURNSTILE_EXCLUDED_IPS from the test settings is replaced
+        self.assertIsNone(self.decide(middleware, REMOTE_ADDR='192.168.1.1'))
+        # TURNSTILE_EXCLUDED_DOMAINS is not in the file, so the setting applies
+        self.assertEqual(self.decide(middleware, HTTP_HOST='example.com'), 'domain')
+
+    def test_changes_are_swapped_in(self):
+        middleware = self.middleware()
+        old_engine = middleware.rule_engine
+        self.assertFalse(middleware.rules_watcher.check())
+
+        self.write(
+            {
+                'TURNSTILE_EXCLUDED_IPS': ['198.51.100.0/24'],
+                'TURNSTILE_EXCLUDED_PATHS': ['/feeds/'],
+            }
+        )
+        self.assertTrue(middleware.rules_watcher.check())
+
+        self.assertIsNot(middleware.rule_engine, old_engine)
+        self.assertEqual(self.decide(middleware, REMOTE_ADDR='198.51.100.1'), 'ip')
+        self.assertIsNone(self.decide(middleware, REMOTE_ADDR='203.0.113.9'))
+        self.assertTrue(middleware.is_path_excluded('/feeds/rss/'))
+        # The challenge and verify paths are always excluded
+        self.assertTrue(middleware.is_path_excluded(middleware.challenge_path))
+
+    def test_invalid_changes_keep_the_current_rules(self):
+        """Test that a bad file is logged and the previous snapshot stays."""
+        middleware = self.middleware()
+        old_engine = middleware.rule_engine
+
+        for contents in [
+            {'TURNSTILE_SECRET_KEY': 'nope'},
+            {'TURNSTILE_EXCLUDED_IPS_FILES': ['/does/not/exist']},
+        ]:
+            with self.subTest(contents=contents):
+                self.write(contents)
+                with self.assertLogs(
+                    'django_turnstile_site_protect.middleware.reload', 'ERROR'
+                ):
+                    self.assertFalse(middleware.rules_watcher.check())
+                self.assertIs(middleware.rule_engine, old_engine)
+                self.assertEqual(middleware.excluded_ips, ['203.0.113.0/24'])
+
+    def test_invalid_file_at_startup(self):
+        with open(self.path, 'w') as f:
+            f.write('[not, json')
+        with self.assertRaises(ImproperlyConfigured):
+            self.middleware()
+
+    def test_background_reload(self):
+        """Test that the watcher thread picks up changes by itself."""
+        middleware = self.middleware(interval=0.01)
+        self.assertIsNone(middleware.rules_watcher._thread)
+        # The first request starts the watcher
+        middleware.enabled = True
+        middleware.process_request(
+            self.factory.get('/feeds/', REMOTE_ADDR='203.0.113.9')
+        )
+
+        self.write({'TURNSTILE_EXCLUDED_IPS': ['198.51.100.0/24']})
+
+        deadline = time.monotonic() + 5
+        while self.decide(middleware, REMOTE_ADDR='198.51.100.1') != 'ip':
+            self.assertLess(time.monotonic(), deadline, 'rules were not reloaded')
+            time.sleep(0.01)
+
+    def test_forked_workers_start_their_own_watcher(self):
+        watcher = self.middleware().rules_watcher
+        watcher.ensure_started()
+        thread = watcher._thread
+        watcher.ensure_started()
+        self.assertIs(watcher._thread, thread)
+
+        # The thread isn't copied into a forked worker
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            watcher.ensure_started()
+        self.assertIsNot(watcher._thread, thread)
+
+    def test_reloading_can_be_disabled(self):
+        self.assertIsNone(self.middleware(interval=0).rules_watcher)
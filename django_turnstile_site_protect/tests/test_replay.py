@@ -0,0 +1,250 @@
+"""Tests for the token replay cache."""
+
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import metrics, replay, views
+from django_turnstile_site_protect.tests.helpers import FakeClock
+from django_turnstile_site_protect.views import averify_view, verify_view
+
+
+@patch('django_turnstile_site_protect.backends.post_siteverify')
+class TestReplayCache(SimpleTestCase):
+    """Test cases for answering replayed tokens without a siteverify call."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def verify(self, token='token', ip='203.0.113.5', session=None):
+        request = self.factory.post(
+            '/verify/',
+            {'cf-turnstile-response': token, 'next': '/protected/'},
+            REMOTE_ADDR=ip,
+        )
+        request.session = {} if session is None else session
+        response = verify_view(request)
+        return response, request.session.get('turnstile_passed', False)
+
+    def test_replay_from_another_client_is_rejected(self, post_siteverify):
+        post_siteverify.return_value = {'success': True}
+        self.assertTrue(self.verify()[1])
+
+        response, passed = self.verify(ip='198.51.100.1')
+
+        self.assertFalse(passed)
+        self.assertIn('challenge', response.url)
+        post_siteverify.assert_called_once()
+        self.assertEqual(
+            metrics.get_sink().value(metrics.VERIFICATIONS, outcome='duplicate'), 1
+        )
+
+    def test_replay_from_same_ip_is_rejected(self, post_siteverify):
+        # Behind a proxy, every client has the same REMOTE_ADDR
+        post_siteverify.return_value = {'success': True}
+        self.verify()
+
+        response, passed = self.verify()
+
+        self.assertFalse(passed)
+        self.assertIn('challenge', response.url)
+        post_siteverify.assert_called_once()
+
+    def test_double_submit_is_sent_on(self, post_siteverify):
+        post_siteverify.return_value = {'success': True}
+        session = {}
+        self.verify(session=session)
+
+        response, passed = self.verify(session=session)
+
+        self.assertTrue(passed)
+        self.assertEqual(response.url, '/protected/')
+        post_siteverify.assert_called_once()
+        self.assertEqual(
+            metrics.get_sink().value(metrics.VERIFICATIONS, outcome='resubmitted'), 1
+        )
+
+    def test_rejected_token_is_not_resent(self, post_siteverify):
+        post_siteverify.return_value = {'success': False}
+        self.verify()
+        self.assertFalse(self.verify()[1])
+        post_siteverify.assert_called_once()
+
+    def test_errors_are_not_remembered(self, post_siteverify):
+        post_siteverify.side_effect = [ConnectionError, {'success': True}]
+        self.assertFalse(self.verify()[1])
+        self.assertTrue(self.verify()[1])
+        self.assertEqual(post_siteverify.call_count, 2)
+
+    def test_concurrent_submits_share_one_call(self, post_siteverify):
+        release = threading.Event()
+
+        def slow_siteverify(url, data):
+            release.wait(5)
+            return {'success': True}
+
+        post_siteverify.side_effect = slow_siteverify
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.verify()[1]))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        # Let every thread reach the shared call before it returns
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        # Only the request that made the call passes
+        self.assertEqual(sorted(results), [False] * 4 + [True])
+        post_siteverify.assert_called_once()
+
+    def test_concurrent_submits_share_an_outage(self, post_siteverify):
+        release = threading.Event()
+        calls = []
+
+        def unavailable(request, token):
+            calls.append(token)
+            release.wait(5)
+            return views.UNAVAILABLE, None
+
+        responses = []
+        with patch.object(views, '_verify_with_backend', unavailable):
+            threads = [
+                threading.Thread(target=lambda: responses.append(self.verify()[0]))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        # Nobody spent the token, so nobody is turned away as a duplicate
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.status_code for r in responses], [503] * 3)
+        self.assertEqual(
+            metrics.get_sink().value(metrics.VERIFICATIONS, outcome='duplicate'), 0
+        )
+        self.assertFalse(
+            replay.get_replay_guard().check(replay.ReplayGuard.key('token'))
+        )
+
+    async def test_async_concurrent_submits_share_an_outage(self, post_siteverify):
+        calls = []
+
+        async def unavailable(request, token):
+            calls.append(token)
+            await asyncio.sleep(0.05)
+            return views.UNAVAILABLE, None
+
+        def post():
+            request = self.factory.post(
+                '/verify/', {'cf-turnstile-response': 'token', 'next': '/protected/'}
+            )
+            request.session = {}
+            return request
+
+        with patch.object(views, '_averify_with_backend', unavailable):
+            responses = await asyncio.gather(*(averify_view(post()) for _ in range(3)))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.status_code for r in responses], [503] * 3)
+
+    @patch('django_turnstile_site_protect.backends.apost_siteverify')
+    async def test_async_concurrent_submits_share_one_call(
+        self, apost_siteverify, post_siteverify
+    ):
+        async def slow_siteverify(url, data):
+            await asyncio.sleep(0.05)
+            return {'success': True}
+
+        apost_siteverify.side_effect = slow_siteverify
+
+        def post():
+            request = self.factory.post(
+                '/verify/', {'cf-turnstile-response': 'token', 'next': '/protected/'}
+            )
+            request.session = {}
+            return request
+
+        requests = [post() for _ in range(5)]
+        await asyncio.gather(*(averify_view(request) for request in requests))
+
+        passed = [bool(r.session.get('turnstile_passed')) for r in requests]
+        self.assertEqual(passed.count(True), 1)
+        apost_siteverify.assert_called_once()
+
+    @override_settings(TURNSTILE_REPLAY_CACHE='cache')
+    def test_cache_backend(self, post_siteverify):
+        cache.clear()
+        post_siteverify.return_value = {'success': True}
+        self.verify()
+
+        # Another process sees the token through the cache
+        replay._replay_guards.clear()
+        self.assertFalse(self.verify(ip='198.51.100.1')[1])
+        post_siteverify.assert_called_once()
+
+    @override_settings(TURNSTILE_REPLAY_CACHE='cache')
+    @patch('django_turnstile_site_protect.backends.apost_siteverify')
+    async def test_async_cache_backend(self, apost_siteverify, post_siteverify):
+        cache.clear()
+        apost_siteverify.return_value = {'success': True}
+        requests = []
+        for ip in ('203.0.113.5', '198.51.100.1'):
+            request = self.factory.post(
+                '/verify/',
+                {'cf-turnstile-response': 'token', 'next': '/protected/'},
+                REMOTE_ADDR=ip,
+            )
+            request.session = {}
+            await averify_view(request)
+            requests.append(request)
+
+        self.assertTrue(requests[0].session.get('turnstile_passed'))
+        self.assertFalse(requests[1].session.get('turnstile_passed'))
+        apost_siteverify.assert_called_once()
+
+    @override_settings(TURNSTILE_REPLAY_CACHE=None)
+    def test_disabled(self, post_siteverify):
+        post_siteverify.return_value = {'success': True}
+        self.verify()
+        self.verify(ip='198.51.100.1')
+        self.assertEqual(post_siteverify.call_count, 2)
+
+
+class TestMemoryReplayGuard(SimpleTestCase):
+    """Test cases for the in-memory replay guard."""
+
+    def test_tokens_expire(self):
+        clock = FakeClock()
+        guard = replay.MemoryReplayGuard(clock=clock)
+        key = guard.key('token')
+        guard.remember(key)
+
+        clock.now += 299
+        self.assertTrue(guard.check(key))
+        clock.now += 1
+        self.assertFalse(guard.check(key))
+
+    @override_settings(TURNSTILE_REPLAY_CACHE_MAX_ENTRIES=2)
+    def test_bounded(self):
+        guard = replay.MemoryReplayGuard()
+        for token in ('a', 'b', 'c'):
+            guard.remember(guard.key(token))
+
+        self.assertEqual(len(guard), 2)
+        self.assertFalse(guard.check(guard.key('a')))
+
+    def test_only_hashes_are_stored(self):
+        guard = replay.MemoryReplayGuard()
+        guard.remember(guard.key('secret-token'))
+        self.assertNotIn('secret-token', repr(guard._seen))
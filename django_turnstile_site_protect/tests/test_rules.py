@@ -0,0 +1,90 @@
+"""Tests for the compiled bypass rule engine."""
+
+from unittest.mock import MagicMock
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect.middleware import TurnstileMiddleware, rules
+
+
+@override_settings(
+    ALLOWED_HOSTS=['*'],
+    TURNSTILE_EXCLUDED_PATHS=['/static/'],
+    TURNSTILE_EXCLUDED_METHODS=['options'],
+    TURNSTILE_EXCLUDED_IPS=['10.0.0.0/8'],
+    TURNSTILE_EXCLUDED_DOMAINS=['intranet.example.org'],
+    TURNSTILE_EXCLUDED_HEADERS={'X-Internal-Token': 's3cret', 'X-Health-Check': None},
+    TURNSTILE_EXCLUDED_USER_AGENTS=[r'^UptimeRobot/', 'pingdom'],
+)
+class TestRuleEngine(SimpleTestCase):
+    """Test cases for the decision table built by TurnstileMiddleware."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+    def decide(self, method='get', path='/page/', **extra):
+        request = getattr(self.factory, method)(path, **extra)
+        request.session = {}
+        return self.middleware.rule_engine.decide(request)
+
+    def test_reason_codes(self):
+        """Test that decide() reports the rule that bypassed the request."""
+        test_cases = [
+            ({'path': '/static/app.js'}, rules.PATH),
+            ({'method': 'options'}, rules.METHOD),
+            ({'HTTP_HOST': 'INTRANET.example.org:8443'}, rules.DOMAIN),
+            ({'REMOTE_ADDR': '10.1.2.3'}, rules.IP),
+            ({'HTTP_X_INTERNAL_TOKEN': 's3cret'}, rules.HEADER),
+            ({'HTTP_X_HEALTH_CHECK': 'anything'}, rules.HEADER),
+            ({'HTTP_USER_AGENT': 'UptimeRobot/2.0'}, rules.USER_AGENT),
+            ({'HTTP_USER_AGENT': 'Mozilla/5.0 (Pingdom.com_bot)'}, rules.USER_AGENT),
+            ({'HTTP_X_INTERNAL_TOKEN': 'wrong'}, None),
+            ({'HTTP_USER_AGENT': 'Mozilla/5.0 UptimeRobot/2.0'}, None),
+            ({}, None),
+        ]
+        for kwargs, reason in test_cases:
+            with self.subTest(kwargs=kwargs, reason=reason):
+                self.assertEqual(self.decide(**kwargs), reason)
+
+    def test_first_matching_rule_wins(self):
+        """Test that evaluation short-circuits in the configured order."""
+        reason = self.decide(
+            path='/static/app.js', REMOTE_ADDR='10.1.2.3', HTTP_USER_AGENT='pingdom'
+        )
+        self.assertEqual(reason, rules.PATH)
+
+    def test_passed_challenge_is_a_reason(self):
+        """Test that the session check takes part in the table as 'session'."""
+        request = self.factory.get('/page/')
+        request.session = {self.middleware.session_key: True}
+        self.assertEqual(self.middleware.rule_engine.decide(request), rules.SESSION)
+
+    def test_request_is_normalized_once(self):
+        """Test that the host is computed once even if several rules use it."""
+        request = self.factory.get('/page/', HTTP_HOST='intranet.example.org')
+        request.get_host = MagicMock(return_value='other.example.org')
+        request.session = {}
+
+        engine = rules.RuleEngine(
+            [
+                rules.domain_rule(self.middleware.domain_index),
+                rules.domain_rule(self.middleware.domain_index),
+            ]
+        )
+        self.assertIsNone(engine.decide(request))
+        request.get_host.assert_called_once_with()
+
+    @override_settings(
+        TURNSTILE_EXCLUDED_METHODS=[],
+        TURNSTILE_EXCLUDED_HEADERS={},
+        TURNSTILE_EXCLUDED_USER_AGENTS=[],
+        TURNSTILE_EXCLUDED_DOMAINS=[],
+    )
+    def test_unconfigured_rules_are_left_out(self):
+        """Test that rule kinds with nothing configured cost nothing."""
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        self.assertEqual(
+            middleware.rule_engine.reasons, (rules.PATH, rules.IP, rules.SESSION)
+        )
@@ -0,0 +1,113 @@
+"""Tests for blocking clients by user agent."""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from django_turnstile_site_protect import metrics
+from django_turnstile_site_protect.crawlers import AI_CRAWLERS
+from django_turnstile_site_protect.middleware import TurnstileMiddleware, rules
+from django_turnstile_site_protect.middleware.user_agents import SignatureMatcher
+
+GPTBOT = (
+    'Mozilla/5.0 AppleWebKit/537.36 (KHTML, like Gecko; compatible; '
+    'GPTBot/1.2; +https://openai.com/gptbot)'
+)
+CHROME = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+)
+
+
+class TestSignatureMatcher(SimpleTestCase):
+    """Test cases for the user-agent signature matcher."""
+
+    def test_match(self):
+        matcher = SignatureMatcher(AI_CRAWLERS)
+        for user_agent, expected in [
+            (GPTBOT, 'GPTBot'),
+            ('ccbot/2.0 (https://commoncrawl.org/faq/)', 'CCBot'),
+            ('Mozilla/5.0 (compatible; ClaudeBot/1.0)', 'ClaudeBot'),
+            ('Mozilla/5.0 (compatible; Claude-User/1.0)', 'Claude-User'),
+            (CHROME, None),
+            ('', None),
+        ]:
+            with self.subTest(user_agent=user_agent):
+                self.assertEqual(matcher.match(user_agent), expected)
+
+    def test_signatures_are_literal(self):
+        matcher = SignatureMatcher(['bot.v1'])
+        self.assertEqual(matcher.match('Bot.V1'), 'bot.v1')
+        self.assertIsNone(matcher.match('botxv1'))
+
+    def test_longest_signature_wins(self):
+        matcher = SignatureMatcher(['Claude', 'ClaudeBot'])
+        self.assertEqual(matcher.match('ClaudeBot/1.0'), 'ClaudeBot')
+
+    def test_empty(self):
+        matcher = SignatureMatcher()
+        self.assertEqual(len(matcher), 0)
+        self.assertIsNone(matcher.match(GPTBOT))
+
+
+@override_settings(TURNSTILE_BLOCKED_USER_AGENTS=AI_CRAWLERS)
+class TestBlockedUserAgents(SimpleTestCase):
+    """Test cases for the middleware's user-agent block rule."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = TurnstileMiddleware(lambda request: HttpResponse())
+
+    def test_blocked_without_session_access(self):
+        request = self.factory.get('/protected/', HTTP_USER_AGENT=GPTBOT)
+        # No session attached: reading it would raise AttributeError
+
+        response = self.middleware.process_request(request)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.content, b'Forbidden')
+        self.assertEqual(
+            metrics.get_sink().value(metrics.BLOCKED, signature='GPTBot'), 1
+        )
+        self.assertEqual(
+            metrics.get_sink().value(metrics.DECISIONS, reason=rules.BLOCK), 1
+        )
+
+    async def test_blocked_async(self):
+        request = self.factory.get('/protected/', HTTP_USER_AGENT=GPTBOT)
+
+        response = await self.middleware.aprocess_request(request)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_other_user_agents_are_challenged(self):
+        request = self.factory.get('/protected/', HTTP_USER_AGENT=CHROME)
+        request.session = {}
+
+        response = self.middleware.process_request(request)
+
+        self.assertEqual(response.status_code, 302)
+
+    def test_excluded_paths_stay_reachable(self):
+        """Test that path exclusions, such as robots.txt, are checked first."""
+        request = self.factory.get('/excluded/path/', HTTP_USER_AGENT=GPTBOT)
+        self.assertIsNone(self.middleware.process_request(request))
+
+    @override_settings(TURNSTILE_BLOCKED_STATUS=429)
+    def test_blocked_status(self):
+        middleware = TurnstileMiddleware(lambda request: HttpResponse())
+        request = self.factory.get('/protected/', HTTP_USER_AGENT=GPTBOT)
+
+        response = middleware.process_request(request)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.content, b'Too Many Requests')
+
+    @override_settings(TURNSTILE_BLOCKED_STATUS=404)
+    def test_invalid_blocked_status(self):
+        with self.assertRaises(ImproperlyConfigured):
+            TurnstileMiddleware(lambda request: HttpResponse())
+
+    def test_reload(self):
+        self.middleware.load_rules({'TURNSTILE_BLOCKED_USER_AGENTS': []})
+        self.assertNotIn(rules.BLOCK, self.middleware.rule_engine.reasons)
@@ -1,12 +1,74 @@
 """Tests for the Turnstile views."""
 
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs
 
+from django.core.exceptions import ImproperlyConfigured
 from django.http import HttpResponseRedirect
-from django.test import RequestFactory, TestCase
+from django.template.loader import render_to_string
+from django.test import (
+    RequestFactory,
+    TestCase,
+    modify_settings,
+    override_settings,
+)
 from django.urls import reverse
+from django.utils import translation
+
+from django_turnstile_site_protect import client
+from django_turnstile_site_protect.views import (
+    averify_json_view,
+    averify_view,
+    challenge_view,
+    verify_json_view,
+    verify_view,
+)
+
+
+class StubSiteverifyHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Cloudflare siteverify endpoint."""
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        data = parse_qs(self.rfile.read(length).decode())
+        self.server.requests.append(data)
+
+        body = json.dumps({'success': data.get('response') == ['valid-token']})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSiteverifyServer:
+    """Run a stub siteverify server on a free local port."""
+
+    class HTTPServer(ThreadingHTTPServer):
+        # Accept bursts of concurrent connections without SYN retries
+        request_queue_size = 128
+
+    def __enter__(self):
+        self.server = self.HTTPServer(('127.0.0.1', 0), StubSiteverifyHandler)
+        self.server.requests = []
+        self.url = f'http://127.0.0.1:{self.server.server_port}/siteverify'
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.01}
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        return self
 
-from django_turnstile_site_protect.views import challenge_view, verify_view
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
 
 
 class TestChallengeView(TestCase):
@@ -38,6 +100,21 @@ class TestChallengeView(TestCase):
             # Check if the template is being used (check for the Cloudflare Turnstile API URL)
             self.assertIn('challenges.cloudflare.com/turnstile/v0/api.js', content)
 
+    def test_challenge_view_verifies_with_fetch(self):
+        """Test that the page posts to the JSON endpoint, by default without delay."""
+        request = self.factory.get('/challenge/')
+        request.session = {}
+
+        content = challenge_view(request).content.decode()
+        self.assertIn(reverse('turnstile_verify_json'), content)
+        self.assertIn('setTimeout(() => verify(form), 0 * 1000)', content)
+        # A rejected token is spent, so it isn't posted again
+        self.assertIn('turnstile.reset(', content)
+
+        with self.settings(TURNSTILE_SUBMIT_DELAY=0.5, LANGUAGE_CODE='de'):
+            content = challenge_view(request).content.decode()
+        self.assertIn('setTimeout(() => verify(form), 0.5 * 1000)', content)
+
     def test_challenge_view_default_next_url(self):
         """Test challenge view with default next URL."""
         request = self.factory.get('/challenge/')
@@ -87,6 +164,74 @@ class TestChallengeView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'http://evil.com', response.content)
 
+    @override_settings(TURNSTILE_PRERENDER_CHALLENGE=True)
+    def test_challenge_view_is_prerendered(self):
+        """Test that the template is rendered once and per-request values are spliced."""
+        with patch(
+            'django_turnstile_site_protect.views.render_to_string',
+            wraps=render_to_string,
+        ) as mock_render, self.settings(TURNSTILE_SITE_KEY='prerender-site-key'):
+            first = self.client.get(reverse('turnstile_challenge'), {'next': '/a/'})
+            second = self.client.get(
+                reverse('turnstile_challenge'), {'next': '/b/?x=1&y=<2>'}
+            )
+
+        self.assertEqual(mock_render.call_count, 1)
+        self.assertIn(b'name="next" value="/a/"', first.content)
+        self.assertIn(b'name="next" value="/b/?x=1&amp;y=&lt;2&gt;"', second.content)
+        self.assertIn(b'name="csrfmiddlewaretoken" value="', second.content)
+        self.assertNotIn(b'marker', second.content)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertIn('private', second['Cache-Control'])
+
+    @override_settings(TURNSTILE_PRERENDER_CHALLENGE=True)
+    def test_challenge_view_prerendered_per_language(self):
+        """Test that each language gets its own pre-rendered page."""
+        with patch(
+            'django_turnstile_site_protect.views.render_to_string',
+            wraps=render_to_string,
+        ) as mock_render:
+            for language in ('en', 'de', 'en'):
+                with translation.override(language):
+                    self.client.get(reverse('turnstile_challenge'))
+
+        self.assertEqual(mock_render.call_count, 2)
+
+    @override_settings(TURNSTILE_PRERENDER_CHALLENGE=True)
+    @modify_settings(MIDDLEWARE={'append': 'django.middleware.csrf.CsrfViewMiddleware'})
+    def test_challenge_view_not_modified(self):
+        """Test that a repeat fetch with a matching ETag gets a 304."""
+        url = reverse('turnstile_challenge')
+        response = self.client.get(url, {'next': '/protected/'})
+        etag = response['ETag']
+
+        response = self.client.get(
+            url, {'next': '/protected/'}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # A different next URL is a different page
+        response = self.client.get(url, {'next': '/other/'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # And so is a different configuration
+        with self.settings(TURNSTILE_THEME='dark'):
+            response = self.client.get(
+                url, {'next': '/protected/'}, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_challenge_view_without_prerendering(self):
+        """Test that templates are rendered per request by default."""
+        request = self.factory.get('/challenge/?next=/protected/')
+        request.session = {}
+
+        response = challenge_view(request)
+
+        self.assertIn('name="next" value="/protected/"', response.content.decode())
+        self.assertNotIn('ETag', response)
+
 
 class TestVerifyView(TestCase):
     """Test cases for the verify_view."""
@@ -104,7 +249,7 @@ class TestVerifyView(TestCase):
         self.assertIsInstance(response, HttpResponseRedirect)
         self.assertEqual(response.url, reverse('turnstile_challenge'))
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_success(self, mock_post):
         """Test successful verification."""
         # Mock the API response
@@ -133,7 +278,24 @@ class TestVerifyView(TestCase):
             self.assertEqual(kwargs['data']['secret'], 'test-secret-key')
             self.assertEqual(kwargs['data']['response'], 'test-token')
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @override_settings(TURNSTILE_REPLAY_CACHE=None)
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_verify_view_server_timing(self, mock_post):
+        """Test that the upstream latency is reported when enabled."""
+        mock_post.return_value.json.return_value = {'success': True}
+        request = self.factory.post('/verify/', {'cf-turnstile-response': 'token'})
+        request.session = {}
+
+        response = verify_view(request)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        with self.settings(TURNSTILE_SERVER_TIMING=True):
+            response = verify_view(request)
+        self.assertRegex(
+            response['Server-Timing'], r'^turnstile-verify;dur=\d+\.\d{3}$'
+        )
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_failure(self, mock_post):
         """Test that verification fails with invalid token."""
         # Mock Turnstile API response
@@ -158,7 +320,7 @@ class TestVerifyView(TestCase):
             target_status_code=200,
         )
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_no_token(self, mock_post):
         """Test that verification fails with no token."""
         response = self.client.post(reverse('turnstile_verify'))
@@ -172,7 +334,7 @@ class TestVerifyView(TestCase):
         # Check that the session wasn't modified
         self.assertNotIn('turnstile_passed', self.client.session)
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_api_error(self, mock_post):
         """Test verify view when API call raises an exception."""
         # Mock the API to raise an exception
@@ -192,7 +354,7 @@ class TestVerifyView(TestCase):
             session = self.client.session
             self.assertNotIn('turnstile_passed', session)
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_with_custom_session_key(self, mock_post):
         """Test verify view with custom session key."""
         mock_response = MagicMock()
@@ -220,7 +382,30 @@ class TestVerifyView(TestCase):
             self.assertTrue(request.session.get(custom_key))
             self.assertNotIn('turnstile_passed', request.session)
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
+    def test_verify_view_with_pass_cookie(self, mock_post):
+        """Test that verify view issues a signed cookie instead of writing the session."""
+        mock_response = MagicMock()
+        mock_response.json.return_value = {'success': True}
+        mock_post.return_value = mock_response
+
+        request = self.factory.post(
+            '/verify/', {'cf-turnstile-response': 'test-token', 'next': '/protected/'}
+        )
+        request.session = {}
+
+        with self.settings(
+            TURNSTILE_PASS_COOKIE=True, TURNSTILE_PASS_COOKIE_NAME='custom_pass'
+        ):
+            response = verify_view(request)
+
+        self.assertEqual(response.url, '/protected/')
+        self.assertEqual(request.session, {})
+        cookie = response.cookies['custom_pass']
+        self.assertTrue(cookie['httponly'])
+        self.assertTrue(cookie['max-age'])
+
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_with_invalid_http_methods(self, mock_post):
         """Test verify view with unsupported HTTP methods."""
         for method in ['get', 'put', 'delete', 'patch']:
@@ -237,7 +422,7 @@ class TestVerifyView(TestCase):
                 # Should not call the API
                 mock_post.assert_not_called()
 
-    @patch('django_turnstile_site_protect.views.requests.post')
+    @patch('django_turnstile_site_protect.client.requests.Session.post')
     def test_verify_view_with_invalid_next_url(self, mock_post):
         """Test verify view with invalid next URL (should be sanitized)."""
         mock_response = MagicMock()
@@ -267,7 +452,7 @@ class TestVerifyView(TestCase):
         mock_response.json.return_value = {'success': True}
 
         with patch(
-            'django_turnstile_site_protect.views.requests.post',
+            'django_turnstile_site_protect.client.requests.Session.post',
             return_value=mock_response,
         ):
             # Create a POST request with an unsafe next URL
@@ -286,3 +471,152 @@ class TestVerifyView(TestCase):
             # Check that we're redirected to the home page, not the unsafe URL
             self.assertIsInstance(response, HttpResponseRedirect)
             self.assertEqual(response.url, '/')
+
+
+@patch('django_turnstile_site_protect.backends.post_siteverify')
+class TestVerifyJsonView(TestCase):
+    """Test cases for the JSON verify endpoint."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post(self, token='token', next_url='/protected/'):
+        request = self.factory.post(
+            '/verify/json/', {'cf-turnstile-response': token, 'next': next_url}
+        )
+        request.session = {}
+        return request
+
+    def test_success(self, post_siteverify):
+        post_siteverify.return_value = {'success': True}
+        request = self.post()
+
+        response = verify_json_view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content), {'success': True, 'redirect': '/protected/'}
+        )
+        self.assertTrue(request.session.get('turnstile_passed'))
+
+    def test_unsafe_next_url(self, post_siteverify):
+        post_siteverify.return_value = {'success': True}
+
+        response = verify_json_view(self.post(next_url='https://evil.example/'))
+
+        self.assertEqual(json.loads(response.content)['redirect'], '/')
+
+    def test_rejected(self, post_siteverify):
+        post_siteverify.return_value = {'success': False}
+        request = self.post()
+
+        response = verify_json_view(request)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(json.loads(response.content)['success'])
+        self.assertNotIn('turnstile_passed', request.session)
+
+    def test_missing_token(self, post_siteverify):
+        response = verify_json_view(self.post(token=''))
+
+        self.assertEqual(response.status_code, 403)
+        post_siteverify.assert_not_called()
+
+    def test_unavailable(self, post_siteverify):
+        post_siteverify.side_effect = ConnectionError
+        with self.settings(TURNSTILE_CIRCUIT_BREAKER_THRESHOLD=1):
+            verify_json_view(self.post())
+            response = verify_json_view(self.post())
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_get_not_allowed(self, post_siteverify):
+        response = verify_json_view(self.factory.get('/verify/json/'))
+        self.assertEqual(response.status_code, 405)
+
+    @patch('django_turnstile_site_protect.backends.apost_siteverify')
+    async def test_async_success(self, apost_siteverify, post_siteverify):
+        apost_siteverify.return_value = {'success': True}
+        request = self.post()
+
+        response = await averify_json_view(request)
+
+        self.assertEqual(json.loads(response.content)['redirect'], '/protected/')
+        self.assertTrue(request.session.get('turnstile_passed'))
+        post_siteverify.assert_not_called()
+
+
+@unittest.skipIf(client.httpx is None, 'httpx is not installed')
+class TestAsyncVerifyView(TestCase):
+    """Test cases for the averify_view against a stub siteverify server."""
+
+    def setUp(self):
+        # AsyncRequestFactory can't read POST bodies on Django 3.2, and the
+        # view only needs request.POST
+        self.factory = RequestFactory()
+
+    def post(self, token, next_url='/protected/'):
+        request = self.factory.post(
+            '/verify/', {'cf-turnstile-response': token, 'next': next_url}
+        )
+        request.session = {}
+        return request
+
+    async def test_averify_view_success(self):
+        """Test successful verification through the pooled async client."""
+        with StubSiteverifyServer() as stub:
+            request = self.post('valid-token')
+            with self.settings(
+                TURNSTILE_SECRET_KEY='test-secret-key',
+                TURNSTILE_VERIFICATION_URL=stub.url,
+            ):
+                response = await averify_view(request)
+
+        self.assertEqual(response.url, '/protected/')
+        self.assertTrue(request.session.get('turnstile_passed'))
+        self.assertEqual(stub.server.requests[0]['secret'], ['test-secret-key'])
+
+    async def test_averify_view_failure(self):
+        """Test that a rejected token redirects back to the challenge."""
+        with StubSiteverifyServer() as stub:
+            request = self.post('invalid-token')
+            with self.settings(TURNSTILE_VERIFICATION_URL=stub.url):
+                response = await averify_view(request)
+
+        self.assertEqual(
+            response.url, f"{reverse('turnstile_challenge')}?next=/protected/"
+        )
+        self.assertNotIn('turnstile_passed', request.session)
+
+    @override_settings(TURNSTILE_REPLAY_CACHE=None)
+    async def test_averify_view_reuses_client(self):
+        """Test that concurrent verifications share one pooled client."""
+        import asyncio
+
+        with StubSiteverifyServer() as stub:
+            with self.settings(TURNSTILE_VERIFICATION_URL=stub.url):
+                responses = await asyncio.gather(
+                    *(averify_view(self.post('valid-token')) for _ in range(20))
+                )
+                self.assertIs(client.get_async_client(), client.get_async_client())
+
+        self.assertEqual(len(stub.server.requests), 20)
+        self.assertTrue(all(r.url == '/protected/' for r in responses))
+
+    async def test_averify_view_upstream_error(self):
+        """Test that an unreachable siteverify endpoint fails closed."""
+        with StubSiteverifyServer() as stub:
+            url = stub.url
+        request = self.post('valid-token')
+        with self.settings(TURNSTILE_VERIFICATION_URL=url):
+            response = await averify_view(request)
+
+        self.assertIn('challenge', response.url)
+        self.assertNotIn('turnstile_passed', request.session)
+
+    async def test_averify_view_requires_httpx(self):
+        """Test that a missing httpx install is reported, not swallowed."""
+        with patch.object(client, 'httpx', None):
+            with self.assertRaises(ImproperlyConfigured):
+                await averify_view(self.post('valid-token'))
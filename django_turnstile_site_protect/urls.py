@@ -1,8 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import challenge_view, verify_view
+from .views import (
+    averify_json_view,
+    averify_view,
+    challenge_view,
+    verify_json_view,
+    verify_view,
+)
+
+# Under ASGI, the async verify views keep siteverify calls off worker threads
+if getattr(settings, 'TURNSTILE_ASYNC_VERIFY', False):
+    verify, verify_json = averify_view, averify_json_view
+else:
+    verify, verify_json = verify_view, verify_json_view
 
 urlpatterns = [
     path('challenge/', challenge_view, name='turnstile_challenge'),
-    path('verify/', verify_view, name='turnstile_verify'),
+    path('verify/', verify, name='turnstile_verify'),
+    # Under the verify path, so the middleware's exclusion covers it too
+    path('verify/json/', verify_json, name='turnstile_verify_json'),
 ]
@@ -0,0 +1,122 @@
+import ipaddress
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Sec-Fetch-Dest values of requests that load a page
+NAVIGATION_DESTINATIONS = frozenset(('document', 'iframe', 'frame', 'embed', 'object'))
+
+
+def get_client_ip(request):
+    """
+    Return the client's IP address as an ipaddress object, or None if it is
+    missing or invalid, without trusting headers the client can forge.
+
+    This is REMOTE_ADDR, unless TURNSTILE_TRUSTED_PROXY_COUNT proxies sit in
+    front of the site. Each of them appends the address it received the
+    request from to X-Forwarded-For, so the client is the entry that many
+    places from the end. Anything before it may have been sent by the client.
+    """
+    proxies = getattr(settings, 'TURNSTILE_TRUSTED_PROXY_COUNT', 0)
+    ip = request.META.get('REMOTE_ADDR')
+    if proxies:
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        forwarded = [entry.strip() for entry in x_forwarded_for.split(',')]
+        # Requests that didn't come through every proxy keep REMOTE_ADDR
+        if x_forwarded_for and len(forwarded) >= proxies:
+            ip = forwarded[-proxies]
+
+    try:
+        return ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+
+
+class SharedInstances:
+    """
+    Process-wide objects, one per configuration, built on first use.
+
+    Keying them by the settings they were built from means a settings change
+    (e.g. in tests) gets a fresh object. Lookups take no lock; building an
+    object does, so that concurrent first requests share it.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        instance = self._instances.get(key)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(key)
+                if instance is None:
+                    instance = self._instances[key] = factory()
+        return instance
+
+    def clear(self):
+        with self._lock:
+            self._instances.clear()
+
+
+async def acache_call(cache, method, *args):
+    """
+    Call the async version of a cache method, e.g. aget() for 'get'. Caches
+    only support native async access from Django 4.0; before that the sync
+    method runs in a thread.
+    """
+    async_method = getattr(cache, f'a{method}', None)
+    if async_method is None:
+        return await sync_to_async(getattr(cache, method))(*args)
+    return await async_method(*args)
+
+
+def is_navigation(request):
+    """
+    Guess whether a request loads a page the user will see, as opposed to a
+    fetch or XHR call, an image, a font and so on.
+
+    Fetch metadata headers decide when the client sends them. Otherwise
+    XMLHttpRequest calls and requests that don't accept HTML are not
+    navigations. Clients that send no Accept header are given the benefit
+    of the doubt.
+    """
+    meta = request.META
+    mode = meta.get('HTTP_SEC_FETCH_MODE')
+    if mode:
+        return mode in ('navigate', 'nested-navigate')
+    destination = meta.get('HTTP_SEC_FETCH_DEST')
+    if destination:
+        return destination in NAVIGATION_DESTINATIONS
+    if meta.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest':
+        return False
+    accept = meta.get('HTTP_ACCEPT')
+    return not accept or 'text/html' in accept
+
+
+def accepts_json(request):
+    """
+    Check if the client asked for JSON, or is a JavaScript caller that
+    can read it.
+    """
+    meta = request.META
+    return (
+        'json' in meta.get('HTTP_ACCEPT', '')
+        or meta.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
+        or meta.get('HTTP_SEC_FETCH_MODE') == 'cors'
+    )
+
+
+def add_server_timing(response, name, duration, description=None):
+    """
+    Append a metric to the response's Server-Timing header. `duration` is in
+    seconds; the header carries milliseconds.
+    """
+    metric = f'{name};dur={duration * 1000:.3f}'
+    if description:
+        metric += f';desc="{description}"'
+    if response.has_header('Server-Timing'):
+        metric = f"{response['Server-Timing']}, {metric}"
+    response['Server-Timing'] = metric
+    return response
@@ -1,90 +1,551 @@
-import requests
+import hashlib
+import math
+import re
+import time
+
 from django.conf import settings
-from django.http import HttpResponseRedirect
+from django.core.exceptions import ImproperlyConfigured
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseRedirect,
+    JsonResponse,
+)
+from django.middleware.csrf import get_token
 from django.shortcuts import render
+from django.template.loader import render_to_string
 from django.urls import reverse
-from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.html import escape
+from django.utils.http import http_date, url_has_allowed_host_and_scheme
+from django.utils.translation import get_language
+
+from . import metrics
+from .backends import get_verification_backend
+from .breaker import get_breaker
+from .pass_store import get_pass_store
+from .ratelimit import get_rate_limiter
+from .replay import get_replay_guard
+from .utils import add_server_timing, get_client_ip
+
+CHALLENGE_TEMPLATE = 'django_turnstile_site_protect/challenge.html'
+
+# Markers rendered in place of the per-request values. They are plain
+# alphanumerics, so HTML escaping leaves them intact.
+NEXT_URL_MARKER = 'turnstilenexturlmarker'
+CSRF_TOKEN_MARKER = 'turnstilecsrftokenmarker'
+MARKERS = re.compile(f'({NEXT_URL_MARKER}|{CSRF_TOKEN_MARKER})')
+
+
+class ChallengePage:
+    """
+    The challenge page rendered once for a given configuration, split around
+    the markers so per-request values can be spliced in without the template
+    engine.
+    """
+
+    def __init__(self, html):
+        self.parts = MARKERS.split(html)
+        self.digest = hashlib.sha256(html.encode()).hexdigest()
+        self.last_modified = int(time.time())
+
+    def etag(self, next_url, csrf_secret):
+        """
+        Return an ETag that changes with the page, the next URL and the CSRF
+        secret. Any token masked from the same secret stays valid, so a cached
+        copy can be reused for as long as the secret doesn't change.
+        """
+        key = '\n'.join((self.digest, next_url, csrf_secret or ''))
+        return '"%s"' % hashlib.sha256(key.encode()).hexdigest()
+
+    def render(self, next_url, csrf_token):
+        values = {NEXT_URL_MARKER: escape(next_url), CSRF_TOKEN_MARKER: csrf_token}
+        return ''.join(values.get(part, part) for part in self.parts)
+
+
+_challenge_pages = {}
+
+
+def _too_many_requests(retry_after, view):
+    """
+    Return the response to a rate limited client. It is deliberately bare:
+    no template, no session and no CSRF token.
+    """
+    metrics.increment(metrics.RATE_LIMITED, view=view)
+    response = HttpResponse(
+        b'Too Many Requests', content_type='text/plain; charset=utf-8', status=429
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _rate_limited(request, view):
+    """
+    Count the request against the client's rate limits. Returns a 429
+    response if it is over a limit, or None.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return None
+    retry_after = limiter.check(get_client_ip(request))
+    return retry_after and _too_many_requests(retry_after, view)
+
+
+async def _arate_limited(request, view):
+    """
+    Async version of _rate_limited.
+    """
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return None
+    retry_after = await limiter.acheck(get_client_ip(request))
+    return retry_after and _too_many_requests(retry_after, view)
+
+
+def _get_challenge_context():
+    """
+    Get Turnstile configuration from settings.
+    """
+    return {
+        'site_key': getattr(settings, 'TURNSTILE_SITE_KEY', ''),
+        'mode': getattr(settings, 'TURNSTILE_MODE', 'managed'),
+        'appearance': getattr(settings, 'TURNSTILE_APPEARANCE', 'always'),
+        'theme': getattr(settings, 'TURNSTILE_THEME', 'auto'),
+        'language': getattr(settings, 'TURNSTILE_LANGUAGE', 'auto'),
+        'size': getattr(settings, 'TURNSTILE_SIZE', 'normal'),
+        'submit_delay': getattr(settings, 'TURNSTILE_SUBMIT_DELAY', 0),
+    }
+
+
+def _get_challenge_page(context):
+    """
+    Return the pre-rendered challenge page for a configuration and the
+    active language, rendering it on first use.
+    """
+    key = (*context.items(), get_language())
+    page = _challenge_pages.get(key)
+    if page is None:
+        html = render_to_string(
+            CHALLENGE_TEMPLATE,
+            dict(context, next_url=NEXT_URL_MARKER, csrf_token=CSRF_TOKEN_MARKER),
+        )
+        page = _challenge_pages[key] = ChallengePage(html)
+    return page
 
 
 def challenge_view(request):
     """
     Render the Turnstile challenge page.
+
+    With TURNSTILE_PRERENDER_CHALLENGE, the static part of the page is
+    rendered once per process, configuration and language; the next URL and
+    CSRF token are spliced in per request. Those responses carry ETag and
+    Last-Modified headers so repeat fetches can be answered with 304 Not
+    Modified.
     """
+    # Rate limited clients are turned away before any rendering
+    response = _rate_limited(request, 'challenge')
+    if response is not None:
+        return response
+
     # Get next URL from query parameters or default to homepage
     next_url = request.GET.get('next', '/')
 
-    # Get Turnstile configuration from settings
-    site_key = getattr(settings, 'TURNSTILE_SITE_KEY', '')
-    mode = getattr(settings, 'TURNSTILE_MODE', 'managed')
-    appearance = getattr(settings, 'TURNSTILE_APPEARANCE', 'always')
-    theme = getattr(settings, 'TURNSTILE_THEME', 'auto')
-    language = getattr(settings, 'TURNSTILE_LANGUAGE', 'auto')
-    size = getattr(settings, 'TURNSTILE_SIZE', 'normal')
-
-    context = {
-        'site_key': site_key,
-        'next_url': next_url,
-        'mode': mode,
-        'appearance': appearance,
-        'theme': theme,
-        'language': language,
-        'size': size,
-    }
+    context = _get_challenge_context()
+
+    # Pre-rendering is opt-in: the page is rendered without the request
+    if not getattr(settings, 'TURNSTILE_PRERENDER_CHALLENGE', False):
+        context['next_url'] = next_url
+        metrics.increment(metrics.CHALLENGE_RENDERS, status=200)
+        return render(request, CHALLENGE_TEMPLATE, context)
+
+    page = _get_challenge_page(context)
+    csrf_token = get_token(request)
+    etag = page.etag(next_url, request.META.get('CSRF_COOKIE'))
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=page.last_modified
+    )
+    if response is None:
+        response = HttpResponse(page.render(next_url, csrf_token))
+    metrics.increment(metrics.CHALLENGE_RENDERS, status=response.status_code)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(page.last_modified)
+    # The page embeds a CSRF token, so only the browser may cache it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _challenge_redirect(next_url):
+    """
+    Redirect back to the challenge page, preserving the next URL.
+    """
+    return HttpResponseRedirect(f"{reverse('turnstile_challenge')}?next={next_url}")
+
+
+def _record_verification(result, started):
+    """
+    Record the upstream latency and outcome of a verification call, and return
+    the latency. `result` is None if the call raised.
+    """
+    duration = time.perf_counter() - started
+    metrics.observe(metrics.SITEVERIFY_SECONDS, duration)
+    if result is None:
+        metrics.increment(metrics.VERIFICATIONS, outcome='error')
+        return duration
+    for code in result.get('error-codes') or ():
+        metrics.increment(metrics.VERIFICATION_ERRORS, code=code)
+    outcome = 'success' if result.get('success') else 'failure'
+    metrics.increment(metrics.VERIFICATIONS, outcome=outcome)
+    return duration
+
+
+def _with_server_timing(response, duration):
+    """
+    Report the upstream verification latency if TURNSTILE_SERVER_TIMING is on.
+    """
+    if duration is not None and getattr(settings, 'TURNSTILE_SERVER_TIMING', False):
+        add_server_timing(response, 'turnstile-verify', duration)
+    return response
+
+
+def _safe_next_url(request, next_url):
+    """
+    Return the next URL if it is safe to send the user to, or '/'.
+    """
+    if not url_has_allowed_host_and_scheme(
+        next_url, allowed_hosts={request.get_host()}
+    ):
+        return '/'
+    return next_url
+
+
+def _success_redirect(request, next_url):
+    """
+    Redirect to the next URL after a successful verification.
+    """
+    # Ensure the URL is safe before redirecting
+    return HttpResponseRedirect(_safe_next_url(request, next_url))
+
+
+def _verified_response(request, next_url):
+    """
+    Remember that the user passed the challenge and redirect to the next URL.
+    """
+    response = _success_redirect(request, next_url)
+    return get_pass_store().mark_passed(request, response)
+
+
+async def _averified_response(request, next_url):
+    """
+    Async version of _verified_response.
+    """
+    response = _success_redirect(request, next_url)
+    return await get_pass_store().amark_passed(request, response)
+
+
+_unavailable_content = None
+
+
+def _unavailable_response(breaker):
+    """
+    Return the "temporarily unavailable" page shown while the circuit is
+    open. The page is rendered once per process and then served from memory.
+    """
+    global _unavailable_content
+
+    if _unavailable_content is None:
+        _unavailable_content = render_to_string(
+            'django_turnstile_site_protect/unavailable.html'
+        )
+
+    response = HttpResponse(_unavailable_content, status=503)
+    response['Retry-After'] = str(math.ceil(breaker.retry_after()))
+    return response
+
 
-    return render(request, 'django_turnstile_site_protect/challenge.html', context)
+def metrics_view(request):
+    """
+    Expose the collected metrics in the Prometheus text format. Not routed
+    by default; see the README.
+    """
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+# Outcomes of a verification attempt
+VERIFIED = 'verified'
+REJECTED = 'rejected'
+UNAVAILABLE = 'unavailable'
+ERROR = 'error'
+# A spent token from a client that has already passed, such as a double submit
+RESUBMITTED = 'resubmitted'
+
+
+def _spent(outcome, duration):
+    """
+    Check if a verification spent its token: the backend was asked and gave
+    an answer. Errors, outages and failing open leave the token unused.
+    """
+    return duration is not None and outcome in (VERIFIED, REJECTED)
+
+
+def _replayed(passed):
+    """
+    Answer a token the replay cache has seen before, without a network call.
+    `passed` is whether the client already has a pass: the token is rejected
+    either way, but such a client is sent on without being granted another.
+    """
+    if passed:
+        metrics.increment(metrics.VERIFICATIONS, outcome='resubmitted')
+        return RESUBMITTED, None
+    metrics.increment(metrics.VERIFICATIONS, outcome='duplicate')
+    return REJECTED, None
+
+
+def _verify_with_backend(request, token):
+    """
+    Verify a token with the verification backend (Cloudflare by default),
+    through the circuit breaker. Returns (outcome, duration), where duration
+    is the backend's latency, or None if it wasn't called.
+    """
+    # Don't wait on the network while the verification endpoint is known to be down
+    breaker = get_breaker()
+    if not breaker.allow_request():
+        if getattr(settings, 'TURNSTILE_FAIL_OPEN', False):
+            metrics.increment(metrics.VERIFICATIONS, outcome='fail_open')
+            return VERIFIED, None
+        metrics.increment(metrics.VERIFICATIONS, outcome='circuit_open')
+        return UNAVAILABLE, None
+
+    backend = get_verification_backend()
+    remote_ip = str(get_client_ip(request) or '')
+
+    # Verify the token, with Cloudflare unless a local backend is configured
+    started = time.perf_counter()
+    try:
+        result = backend.verify(token, remote_ip)
+    except Exception:
+        # Network errors, timeouts and bad responses count towards opening the circuit
+        breaker.record_failure()
+        return ERROR, _record_verification(None, started)
+    breaker.record_success()
+    duration = _record_verification(result, started)
+    return (VERIFIED if result.get('success') else REJECTED), duration
+
+
+def _verify_token(request, token):
+    """
+    Verify a token, answering replays from the replay cache and sharing one
+    siteverify call between concurrent submits of the same token. Returns
+    (outcome, duration) like _verify_with_backend.
+    """
+    # If no token is provided, there is nothing to verify
+    if not token:
+        metrics.increment(metrics.VERIFICATIONS, outcome='missing_token')
+        return REJECTED, None
+
+    guard = get_replay_guard()
+    if guard is None:
+        return _verify_with_backend(request, token)
+
+    key = guard.key(token)
+    if guard.check(key):
+        return _replayed(get_pass_store().has_passed(request))
+
+    def verify():
+        outcome, duration = _verify_with_backend(request, token)
+        # Errors and outages say nothing about the token, so it may be retried
+        if _spent(outcome, duration):
+            guard.remember(key)
+        return outcome, duration
+
+    (outcome, duration), shared = guard.single_flight(key, verify)
+    if not shared:
+        return outcome, duration
+    if _spent(outcome, duration):
+        # Another request spent the same token meanwhile
+        return _replayed(get_pass_store().has_passed(request))
+    # Share the other request's error, outage or fail-open outcome
+    return outcome, None
+
+
+async def _averify_with_backend(request, token):
+    """
+    Async version of _verify_with_backend.
+    """
+    breaker = get_breaker()
+    if not breaker.allow_request():
+        if getattr(settings, 'TURNSTILE_FAIL_OPEN', False):
+            metrics.increment(metrics.VERIFICATIONS, outcome='fail_open')
+            return VERIFIED, None
+        metrics.increment(metrics.VERIFICATIONS, outcome='circuit_open')
+        return UNAVAILABLE, None
+
+    backend = get_verification_backend()
+    remote_ip = str(get_client_ip(request) or '')
+
+    started = time.perf_counter()
+    try:
+        result = await backend.averify(token, remote_ip)
+    except ImproperlyConfigured:
+        # A missing async HTTP client is a deployment error, not a failed check
+        raise
+    except Exception:
+        breaker.record_failure()
+        return ERROR, _record_verification(None, started)
+    breaker.record_success()
+    duration = _record_verification(result, started)
+    return (VERIFIED if result.get('success') else REJECTED), duration
+
+
+async def _averify_token(request, token):
+    """
+    Async version of _verify_token.
+    """
+    if not token:
+        metrics.increment(metrics.VERIFICATIONS, outcome='missing_token')
+        return REJECTED, None
+
+    guard = get_replay_guard()
+    if guard is None:
+        return await _averify_with_backend(request, token)
+
+    key = guard.key(token)
+    if await guard.acheck(key):
+        return _replayed(await get_pass_store().ahas_passed(request))
+
+    async def verify():
+        outcome, duration = await _averify_with_backend(request, token)
+        if _spent(outcome, duration):
+            await guard.aremember(key)
+        return outcome, duration
+
+    (outcome, duration), shared = await guard.asingle_flight(key, verify)
+    if not shared:
+        return outcome, duration
+    if _spent(outcome, duration):
+        return _replayed(await get_pass_store().ahas_passed(request))
+    return outcome, None
 
 
 def verify_view(request):
     """
     Verify the Turnstile token and redirect to the original page if successful.
     """
+    # Rate limited clients are turned away before any call to Cloudflare
+    response = _rate_limited(request, 'verify')
+    if response is not None:
+        return response
+
     if request.method != 'POST':
         return HttpResponseRedirect(reverse('turnstile_challenge'))
 
-    # Get the token from the form submission
-    token = request.POST.get('cf-turnstile-response')
+    # Get the next URL for redirection after verification
+    next_url = request.POST.get('next', '/')
+
+    outcome, duration = _verify_token(
+        request, request.POST.get('cf-turnstile-response')
+    )
+    if outcome == UNAVAILABLE:
+        return _unavailable_response(get_breaker())
+    if outcome == VERIFIED:
+        # Remember the user and redirect
+        response = _verified_response(request, next_url)
+    elif outcome == RESUBMITTED:
+        response = _success_redirect(request, next_url)
+    else:
+        # Redirect back to the challenge page
+        response = _challenge_redirect(next_url)
+    return _with_server_timing(response, duration)
+
+
+async def averify_view(request):
+    """
+    Async version of verify_view. The siteverify call goes through a shared,
+    connection-pooled async client, so concurrent verifications don't hold
+    a worker thread each. Requires httpx.
+    """
+    # Rate limited clients are turned away before any call to Cloudflare
+    response = await _arate_limited(request, 'verify')
+    if response is not None:
+        return response
+
+    if request.method != 'POST':
+        return HttpResponseRedirect(reverse('turnstile_challenge'))
 
     # Get the next URL for redirection after verification
     next_url = request.POST.get('next', '/')
 
-    # If no token is provided, redirect back to the challenge page
-    if not token:
-        return HttpResponseRedirect(f"{reverse('turnstile_challenge')}?next={next_url}")
-
-    # Get the secret key and verification URL from settings
-    secret_key = getattr(settings, 'TURNSTILE_SECRET_KEY', '')
-    verification_url = getattr(
-        settings,
-        'TURNSTILE_VERIFICATION_URL',
-        'https://challenges.cloudflare.com/turnstile/v0/siteverify',
+    outcome, duration = await _averify_token(
+        request, request.POST.get('cf-turnstile-response')
     )
-    session_key = getattr(settings, 'TURNSTILE_SESSION_KEY', 'turnstile_passed')
+    if outcome == UNAVAILABLE:
+        return _unavailable_response(get_breaker())
+    if outcome == VERIFIED:
+        response = await _averified_response(request, next_url)
+    elif outcome == RESUBMITTED:
+        response = _success_redirect(request, next_url)
+    else:
+        response = _challenge_redirect(next_url)
+    return _with_server_timing(response, duration)
 
-    # Verify the token with Cloudflare Turnstile API
-    data = {
-        'secret': secret_key,
-        'response': token,
-        'remoteip': request.META.get('REMOTE_ADDR', ''),
-    }
 
-    try:
-        response = requests.post(verification_url, data=data)
-        result = response.json()
-
-        # If verification is successful, set the session flag and redirect
-        if result.get('success'):
-            request.session[session_key] = True
-
-            # Ensure the URL is safe before redirecting
-            if url_has_allowed_host_and_scheme(
-                next_url, allowed_hosts={request.get_host()}
-            ):
-                return HttpResponseRedirect(next_url)
-            else:
-                return HttpResponseRedirect('/')
-    except Exception:
-        # Log the error or handle it as needed
-        pass
+def _json_verification_response(request, outcome):
+    """
+    Return the JSON verify endpoint's answer for an outcome. A verified
+    response carries the validated next URL, for the page to navigate to.
+    """
+    if outcome in (VERIFIED, RESUBMITTED):
+        next_url = _safe_next_url(request, request.POST.get('next', '/'))
+        return JsonResponse({'success': True, 'redirect': next_url})
+    if outcome == UNAVAILABLE:
+        response = JsonResponse({'success': False, 'error': 'unavailable'}, status=503)
+        response['Retry-After'] = str(math.ceil(get_breaker().retry_after()))
+        return response
+    return JsonResponse({'success': False, 'error': 'rejected'}, status=403)
 
-    # If verification fails or an error occurs, redirect back to the challenge page
-    return HttpResponseRedirect(f"{reverse('turnstile_challenge')}?next={next_url}")
+
+def verify_json_view(request):
+    """
+    Verify the Turnstile token and answer with JSON instead of a redirect.
+    The challenge page posts to this view with fetch and navigates straight
+    to the returned URL.
+    """
+    response = _rate_limited(request, 'verify')
+    if response is not None:
+        return response
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    outcome, duration = _verify_token(
+        request, request.POST.get('cf-turnstile-response')
+    )
+    response = _json_verification_response(request, outcome)
+    if outcome == VERIFIED:
+        response = get_pass_store().mark_passed(request, response)
+    return _with_server_timing(response, duration)
+
+
+async def averify_json_view(request):
+    """
+    Async version of verify_json_view. Requires httpx.
+    """
+    response = await _arate_limited(request, 'verify')
+    if response is not None:
+        return response
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    outcome, duration = await _averify_token(
+        request, request.POST.get('cf-turnstile-response')
+    )
+    response = _json_verification_response(request, outcome)
+    if outcome == VERIFIED:
+        response = await get_pass_store().amark_passed(request, response)
+    return _with_server_timing(response, duration)
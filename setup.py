@@ -18,6 +18,10 @@ setup(
         'Django>=3.2',
         'requests>=2.25.0',
     ],
+    extras_require={
+        'async': ['httpx>=0.23.0'],
+        'geoip': ['maxminddb>=2.0.0'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Web Environment',